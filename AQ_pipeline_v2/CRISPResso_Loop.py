@@ -1,7 +1,21 @@
+import argparse
 import logging
+from functools import partial
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from loaders.amplicon_list import load_amplicon_list, find_amplicon_list
-from pipeline.crispresso import identify_amplicon, run_crispresso
+from pipeline.crispresso import (AmpliconIndex, identify_amplicon, run_crispresso, run_crispresso_batch, order_by_fastq_size,
+                                 fastq_size)
+from pipeline.direct import run_direct
+from pipeline.collapse import run_collapsed
+from pipeline.subsample import run_subsampled
+from pipeline.shard import run_sharded
+from pipeline.preflight import preflight_amplicon, DEFAULT_PREFLIGHT_READS
+from pipeline.validate import validate_sample
+from utils.kmers import KmerIndex
+from pipeline.journal import RunJournal, MATCHED, CRISPRESSO_DONE, FAILED
+from config import AmpliconConfig
 
 #Entry point for the CRISPResso loop
 
@@ -19,35 +33,269 @@ logging.basicConfig(
     ]
 )
 
+JOURNAL_PATH = log_dir / "crispresso_loop_journal.jsonl"
+BATCH_ROOT = Path("crispresso_batch")
 
-def main():
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the Stage 1 command line options
+    Args:
+        argv: list of arguments, defaults to sys.argv when None
+    Returns:
+        argparse.Namespace: the parsed options
+    """
+    parser = argparse.ArgumentParser(description="Stage 1: run CRISPResso on every fastq subdirectory")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of CRISPResso processes to run at once (default 1)")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun CRISPResso even on samples whose inputs are unchanged since the last run")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run, skipping samples the last run already finished")
+    parser.add_argument("--batch", action="store_true",
+                        help="run all samples that share an amplicon through one CRISPRessoBatch call")
+    parser.add_argument("--engine", choices=["crispresso", "direct", "collapse"], default="crispresso",
+                        help="direct: count ABE protospacer alleles straight from the fastqs, sending only reads "
+                             "that cannot be anchored to CRISPResso; collapse: run CRISPResso on each unique "
+                             "read once and scale the counts back up (default crispresso)")
+    parser.add_argument("--preflight", type=int, nargs="?", const=DEFAULT_PREFLIGHT_READS, default=0, metavar="READS",
+                        help="before running CRISPResso, check the first READS reads of each sample against every "
+                             "amplicon and fail samples whose reads do not match their directory name "
+                             f"(default {DEFAULT_PREFLIGHT_READS} reads when given without a number)")
+    parser.add_argument("--validate", action="store_true",
+                        help="before running CRISPResso, read every fastq in full, fail samples with truncated or "
+                             "malformed files or unequal R1/R2 read counts, and save the read counts for Stage 2 "
+                             "to check against CRISPResso's")
+    parser.add_argument("--max-reads", type=int, default=0, metavar="N",
+                        help="quick-look mode: run CRISPResso on a random sample of N reads (read pairs) per sample, "
+                             "drawn with a fixed seed; Stage 2 reports the subsampling factor")
+    parser.add_argument("--shards", type=int, default=1, metavar="K",
+                        help="split each large sample into K shards that CRISPResso runs on at once, and merge "
+                             "their outputs (default 1, no sharding)")
+    parser.add_argument("--shard-min-size", type=int, default=1024, metavar="MB",
+                        help="only samples whose fastqs add up to at least MB megabytes are sharded (default 1024)")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.batch and args.engine != "crispresso":
+        parser.error(f"--batch cannot be combined with --engine {args.engine}")
+    if args.max_reads < 0:
+        parser.error("--max-reads must be a positive number of reads")
+    if args.max_reads and args.batch:
+        parser.error("--max-reads cannot be combined with --batch")
+    if args.max_reads and args.engine != "crispresso":
+        parser.error(f"--max-reads cannot be combined with --engine {args.engine}")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards > 1 and (args.batch or args.engine != "crispresso" or args.max_reads):
+        parser.error("--shards cannot be combined with --batch, --engine direct/collapse or --max-reads")
+    if args.preflight < 0:
+        parser.error("--preflight must be a positive number of reads")
+    return args
+
+def match_sample(sample_dir: Path,
+                 amplicon_configs: AmpliconIndex,
+                 kmer_index: KmerIndex | None,
+                 preflight_reads: int) -> AmpliconConfig:
+    """Matches a sample directory to its amplicon, checking the match against the sample's
+        reads first when a pre-flight KmerIndex is given
+    Args:
+        sample_dir: the fastq subdirectory for the sample
+        amplicon_configs: index of all AmpliconConfig objects from amplicon_list.csv
+        kmer_index: KmerIndex of the same amplicons, None to match by name only
+        preflight_reads: how many reads the pre-flight check reads
+    Returns:
+        AmpliconConfig: the matched amplicon
+    Raises:
+        ValueError: no amplicon matches, or the pre-flight check failed
+    """
+    if kmer_index is None:
+        return identify_amplicon(sample_dir.name, amplicon_configs)
+    return preflight_amplicon(sample_dir, amplicon_configs, kmer_index, preflight_reads)
+
+def process_sample(sample_dir: Path,
+                   amplicon_configs: AmpliconIndex,
+                   log_path: Path | None,
+                   force: bool,
+                   journal: RunJournal,
+                   engine: str = "crispresso",
+                   kmer_index: KmerIndex | None = None,
+                   preflight_reads: int = 0,
+                   validate: bool = False,
+                   max_reads: int = 0,
+                   shards: int = 1,
+                   shard_min_bytes: int = 0) -> bool:
+    """Matches one sample directory to its amplicon and runs CRISPResso on it
+    Args:
+        sample_dir: the fastq subdirectory for the sample
+        amplicon_configs: index of all AmpliconConfig objects from amplicon_list.csv
+        log_path: where CRISPResso's own output is written, None for the terminal
+        force: rerun CRISPResso even if the sample's fingerprint is unchanged
+        journal: the run journal the sample's progress is recorded in
+        engine: "crispresso", or "direct"/"collapse" to use that engine where it applies
+        kmer_index: KmerIndex of all amplicons for the pre-flight check, None to skip it
+        preflight_reads: how many reads the pre-flight check reads
+        validate: check and count every read of the sample's fastqs first
+        max_reads: run CRISPResso on a random sample of this many reads, 0 for all reads
+        shards: split the sample over this many CRISPResso processes when its fastqs hold at
+            least shard_min_bytes
+        shard_min_bytes: the size from which samples are sharded
+    Returns:
+        bool: True if CRISPResso ran, False if the sample was a cache hit
+    """
+    logging.info(f"Processing {sample_dir.name}")
+    details = {"reads": validate_sample(sample_dir)} if validate else {}
+    config = match_sample(sample_dir, amplicon_configs, kmer_index, preflight_reads)
+    journal.record(sample_dir.name, MATCHED, amplicon=config.name, **details)
+    runner = {"direct": run_direct, "collapse": run_collapsed}.get(engine, run_crispresso)
+    if max_reads:
+        runner = partial(run_subsampled, max_reads=max_reads)
+    elif shards > 1 and fastq_size(sample_dir) >= shard_min_bytes:
+        runner = partial(run_sharded, n_shards=shards)
+    ran = runner(config, sample_dir, log_path, force=force)
+    journal.record(sample_dir.name, CRISPRESSO_DONE, amplicon=config.name)
+    if ran:
+        logging.info(f"Done: {sample_dir.name}")
+    else:
+        logging.info(f"Cache hit: {sample_dir.name} — inputs unchanged, CRISPResso skipped")
+    return ran
+
+def run_per_sample(sample_dirs: list[Path],
+                   amplicon_configs: AmpliconIndex,
+                   args: argparse.Namespace,
+                   journal: RunJournal,
+                   kmer_index: KmerIndex | None = None) -> Iterator[tuple[Path, bool | Exception]]:
+    """Runs one CRISPResso process per sample on a pool of args.jobs workers
+    Args:
+        sample_dirs: the sample directories to run, in scheduling order
+        amplicon_configs: index of all AmpliconConfig objects from amplicon_list.csv
+        args: the parsed command line options
+        journal: the run journal the samples' progress is recorded in
+        kmer_index: KmerIndex of all amplicons for the pre-flight check, None to skip it
+    Yields:
+        tuple[Path, bool | Exception]: each sample directory as it finishes, with True if
+            CRISPResso ran, False for a cache hit, or the exception it failed with
+    """
+    # parallel runs would interleave CRISPResso's terminal output, so each sample gets its own log
+    crispresso_log_dir = log_dir / "crispresso" if args.jobs > 1 else None
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for sample_dir in sample_dirs:
+            log_path = crispresso_log_dir / f"{sample_dir.name}.log" if crispresso_log_dir else None
+            futures[executor.submit(process_sample, sample_dir, amplicon_configs, log_path, args.force, journal,
+                                     args.engine, kmer_index, args.preflight, args.validate,
+                                     args.max_reads, args.shards, args.shard_min_size * 1024**2)] = sample_dir
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+def run_batched(sample_dirs: list[Path],
+                amplicon_configs: AmpliconIndex,
+                args: argparse.Namespace,
+                journal: RunJournal,
+                kmer_index: KmerIndex | None = None) -> Iterator[tuple[Path, bool | Exception]]:
+    """Groups samples by matched amplicon and runs each group through one CRISPRessoBatch
+        call, which uses up to args.jobs processes
+    Args:
+        sample_dirs: the sample directories to run
+        amplicon_configs: index of all AmpliconConfig objects from amplicon_list.csv
+        args: the parsed command line options
+        journal: the run journal the samples' progress is recorded in
+        kmer_index: KmerIndex of all amplicons for the pre-flight check, None to skip it
+    Yields:
+        tuple[Path, bool | Exception]: each sample directory with True if CRISPResso ran,
+            False for a cache hit, or the exception it failed with
+    """
+    groups = {}
+    for sample_dir in sample_dirs:
+        try:
+            details = {"reads": validate_sample(sample_dir)} if args.validate else {}
+            config = match_sample(sample_dir, amplicon_configs, kmer_index, args.preflight)
+        except (OSError, ValueError) as e:
+            yield sample_dir, e
+            continue
+        journal.record(sample_dir.name, MATCHED, amplicon=config.name, **details)
+        groups.setdefault(config.name, (config, []))[1].append(sample_dir)
+
+    for config, group_dirs in groups.values():
+        logging.info(f"Processing batch {config.name} ({len(group_dirs)} samples)")
+        log_path = log_dir / "crispresso" / f"batch_{config.name}.log"
+        try:
+            outcomes = run_crispresso_batch(config, group_dirs, BATCH_ROOT, log_path, args.jobs, args.force)
+        except Exception as e:
+            outcomes = {sample_dir: e for sample_dir in group_dirs}
+        for sample_dir in group_dirs:
+            outcome = outcomes[sample_dir]
+            if outcome is True:
+                logging.info(f"Done: {sample_dir.name}")
+            elif outcome is False:
+                logging.info(f"Cache hit: {sample_dir.name} — inputs unchanged, CRISPResso skipped")
+            if not isinstance(outcome, Exception):
+                journal.record(sample_dir.name, CRISPRESSO_DONE, amplicon=config.name)
+            yield sample_dir, outcome
+
+
+def main(argv: list[str] | None = None):
     """Entry point for Stage 1. Iterates over fastq subdirectories, matches each
-    to an AmpliconConfig object, and runs CRISPResso on each sample
+    to an AmpliconConfig object, and runs CRISPResso on each sample. With --jobs N
+    up to N samples run at once, largest fastqs first. Samples whose inputs are
+    unchanged since their last run are skipped unless --force is given. With --resume,
+    samples the previous (interrupted) run already finished are not revisited. With
+    --batch, samples sharing an amplicon run through a single CRISPRessoBatch call.
+    With --engine direct, ABE samples are counted straight from their fastqs and only
+    reads that cannot be anchored go through CRISPResso. With --engine collapse, CRISPResso
+    sees each unique read once and its counts are scaled back up. With --preflight, samples whose
+    first reads do not support their matched amplicon fail before anything runs.
+    With --validate, every fastq is read in full and invalid samples fail before CRISPResso starts.
+    With --max-reads N, CRISPResso only sees a fixed-seed random sample of N reads per sample.
+    With --shards K, large samples are split over K CRISPResso processes and merged back.
     """
+    args = parse_args(argv)
     error_count = 0
     completed_count = 0
+    cache_hit_count = 0
+    resumed_count = 0
     fastqs_dir = Path("fastqs")
-    amplicon_configs = load_amplicon_list(find_amplicon_list())
+    amplicon_configs = AmpliconIndex(load_amplicon_list(find_amplicon_list()))
+    journal = RunJournal(JOURNAL_PATH, resume=args.resume)
+    kmer_index = KmerIndex(amplicon_configs.configs) if args.preflight else None
 
+    sample_dirs = []
     for sample_dir in fastqs_dir.iterdir():
         if not sample_dir.is_dir():
             continue
         if sample_dir.name in SKIP_DIRS:
             continue
-        try:
-            logging.info(f"Processing {sample_dir.name}")
-            config = identify_amplicon(sample_dir.name, amplicon_configs)
-            run_crispresso(config, sample_dir)
-            logging.info(f"Done: {sample_dir.name}")
-            completed_count += 1
-        except Exception as e:
-            logging.error(f"Error processing {sample_dir.name}: {e}") 
+        if journal.state(sample_dir.name) == CRISPRESSO_DONE:
+            resumed_count += 1
+            continue
+        sample_dirs.append(sample_dir)
+    sample_dirs = order_by_fastq_size(sample_dirs)
+
+    if args.batch:
+        outcomes = run_batched(sample_dirs, amplicon_configs, args, journal, kmer_index)
+    else:
+        outcomes = run_per_sample(sample_dirs, amplicon_configs, args, journal, kmer_index)
+
+    for sample_dir, outcome in outcomes:
+        if isinstance(outcome, Exception):
+            logging.error(f"Error processing {sample_dir.name}: {outcome}")
+            journal.record(sample_dir.name, FAILED, error_type=type(outcome).__name__, error_message=str(outcome))
             error_count += 1
-    
+        elif outcome:
+            completed_count += 1
+        else:
+            cache_hit_count += 1
+
+    if args.resume:
+        logging.info(f"Samples already finished by the previous run: {resumed_count}")
     logging.info(f"Samples processed correctly: {completed_count}")
+    logging.info(f"Samples skipped as cache hits: {cache_hit_count}")
     logging.info(f"Samples encountered with errors: {error_count}")
 
 
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from loaders.amplicon_list import load_amplicon_list, find_amplicon_list
+from pipeline.crispresso import AmpliconIndex, identify_amplicon
+from pipeline.merge import check_amplicon, merge_crispresso_outputs, write_merge_record
+
+#Entry point for merging the CRISPResso outputs of a sample and its top-up sequencing runs
+
+
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),                        #  log to terminal
+        logging.FileHandler(log_dir / "crispresso_merge.log"),
+    ]
+)
+
+CRISPRESSO_PREFIX = "CRISPResso_on_"
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the merge command line options
+    Args:
+        argv: list of arguments, defaults to sys.argv when None
+    Returns:
+        argparse.Namespace: the parsed options
+    """
+    parser = argparse.ArgumentParser(description="Merge CRISPResso_on_* outputs of the same sample and amplicon "
+                                                 "from separate sequencing runs into one output")
+    parser.add_argument("inputs", type=Path, nargs="+", help="two or more CRISPResso_on_* folders to merge")
+    parser.add_argument("--output", type=Path, required=True,
+                        help="the merged CRISPResso_on_* folder to write, e.g. fastqs/<sample>/CRISPResso_on_<sample>")
+    parser.add_argument("--amplicon", default=None,
+                        help="amplicon name from amplicon_list.csv the outputs must belong to "
+                             "(default: matched from the output folder name)")
+    parser.add_argument("--force", action="store_true",
+                        help="replace the output folder if it exists, even when it is one of the inputs")
+    args = parser.parse_args(argv)
+    if len(args.inputs) < 2:
+        parser.error("at least two CRISPResso outputs are needed")
+    if len({path.resolve() for path in args.inputs}) != len(args.inputs):
+        parser.error("the same CRISPResso output is given twice")
+    if not args.output.name.startswith(CRISPRESSO_PREFIX):
+        parser.error(f"--output must be named {CRISPRESSO_PREFIX}<sample> so Stage 2 finds it")
+    return args
+
+def main(argv: list[str] | None = None):
+    """Entry point for merging top-up runs. Checks that every input was run with the amplicon
+    and guide of the sample's amplicon_list.csv entry, then writes an output whose allele table
+    (#Reads summed, %Reads recomputed), mapping statistics, quantification window (weighted by
+    aligned reads) and editing frequencies read as one CRISPResso run over all the reads.
+    Only the new reads need a CRISPResso run; Stage 2 quantifies the merged folder as usual.
+    """
+    args = parse_args(argv)
+    amplicon_configs = AmpliconIndex(load_amplicon_list(find_amplicon_list()))
+    if args.amplicon is not None:
+        config = next((c for c in amplicon_configs.configs if c.name == args.amplicon), None)
+        if config is None:
+            raise SystemExit(f"Amplicon {args.amplicon} is not in amplicon_list.csv")
+    else:
+        config = identify_amplicon(args.output.name[len(CRISPRESSO_PREFIX):], amplicon_configs)
+
+    for path in args.inputs:
+        if not path.is_dir():
+            raise SystemExit(f"{path} is not a CRISPResso output folder")
+    if args.output.exists() and not args.force:
+        raise SystemExit(f"{args.output} already exists, use --force to replace it")
+    check_amplicon(args.inputs, config)
+
+    # written next to the output first, so an input that is also the output is read in full
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="aq_merge_", dir=args.output.parent) as work_dir:
+        merged = Path(work_dir) / args.output.name
+        merge_crispresso_outputs(args.inputs, merged)
+        write_merge_record(merged, args.inputs)
+        if args.output.exists():
+            shutil.rmtree(args.output)
+        shutil.move(str(merged), str(args.output))
+
+    logging.info(f"Merged {len(args.inputs)} CRISPResso outputs for {config.name} into {args.output}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import logging
+from pathlib import Path
+from loaders.amplicon_list import load_amplicon_list, find_amplicon_list
+from pipeline.demultiplex import demultiplex, pool_prefix, UNASSIGNED
+from utils.kmers import KmerIndex
+
+#Entry point for splitting pooled fastqs into per-amplicon sample directories ahead of Stage 1
+
+
+log_dir = Path("logs")
+log_dir.mkdir(exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),                        #  log to terminal
+        logging.FileHandler(log_dir / "demultiplex.log"),
+    ]
+)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the demultiplexing command line options
+    Args:
+        argv: list of arguments, defaults to sys.argv when None
+    Returns:
+        argparse.Namespace: the parsed options
+    """
+    parser = argparse.ArgumentParser(description="Split a pooled fastq into one fastqs/ sample directory per amplicon")
+    parser.add_argument("read1", type=Path, help="pooled R1 fastq (plain or gzipped)")
+    parser.add_argument("read2", type=Path, nargs="?", default=None, help="pooled R2 fastq, for paired end reads")
+    parser.add_argument("--prefix", default=None,
+                        help="sample directory prefix, <prefix>_<amplicon> (default: the R1 file name "
+                             "without _R1_001.fastq.gz)")
+    parser.add_argument("--output", type=Path, default=Path("fastqs"),
+                        help="directory the sample directories are created in (default fastqs)")
+    parser.add_argument("--force", action="store_true",
+                        help="replace fastqs left by an earlier demultiplexing run with the same prefix")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None):
+    """Entry point for demultiplexing. Assigns every read of a pooled fastq (or R1/R2 pair)
+    to an amplicon in amplicon_list.csv by k-mer matching and writes it to
+    <output>/<prefix>_<amplicon>/, ready for Stage 1. Reads that match no amplicon, or an
+    amplicon listed on more than one row, are written to
+    <output>/<prefix>_unassigned_R1_001.fastq.gz.
+    """
+    args = parse_args(argv)
+    prefix = args.prefix or pool_prefix(args.read1)
+    kmer_index = KmerIndex(load_amplicon_list(find_amplicon_list()))
+
+    logging.info(f"Demultiplexing {args.read1}" + (f" and {args.read2}" if args.read2 else ""))
+    counts = demultiplex(args.read1, args.read2, kmer_index, args.output, prefix, force=args.force)
+
+    total = sum(counts.values())
+    assigned = total - counts[UNASSIGNED]
+    logging.info(f"Reads assigned to an amplicon: {assigned} of {total}")
+    logging.info(f"Sample directories written: {len(counts) - (UNASSIGNED in counts)}")
+
+
+
+if __name__ == "__main__":
+    main()
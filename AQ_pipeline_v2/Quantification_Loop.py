@@ -1,10 +1,14 @@
+import argparse
 import logging
 import pandas as pd
 from pathlib import Path
 from loaders.amplicon_list import load_amplicon_list, find_amplicon_list
-from pipeline.crispresso import identify_amplicon
-from pipeline.quantify import quantify_sample
+from pipeline.crispresso import AmpliconIndex, identify_amplicon
+from pipeline.quantify import quantify_samples, summary_sample_name, latest_crispresso_output_mtime
 from loaders.exports import generate_prism_csv, generate_prism_csv_het
+from pipeline.journal import RunJournal, MATCHED, QUANTIFIED, FAILED
+from loaders.table_cache import configure_table_cache, evict_table_cache
+from config import AmpliconConfig
 
 #Entry point for the Quantification stage of the pipeline
 
@@ -43,6 +47,7 @@ CANONICAL_ABE_COLUMNS = [
     "target_locus",
     "perfect_correction",
     "corrected_locus_with_bystanders",
+    "subsampling_factor",
 ]
 
 
@@ -57,61 +62,204 @@ logging.basicConfig(
     ]
 )
 
-def main():
+JOURNAL_PATH = log_dir / "quantification_loop_journal.jsonl"
+TABLE_CACHE_DIR = log_dir / "table_cache"
+SUMMARY_FILES = {
+    "ABE": Path("ABE_Quantification_Summary.csv"),
+    "ONESEQ": Path("ONESEQ_Quantification_Summary.csv"),
+    "NUCLEASE": Path("NUCLEASE_Quantification_Summary.csv"),
+}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the Stage 2 command line options
+    Args:
+        argv: list of arguments, defaults to sys.argv when None
+    Returns:
+        argparse.Namespace: the parsed options
+    """
+    parser = argparse.ArgumentParser(description="Stage 2: quantify CRISPResso output for every fastq subdirectory")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run, reusing results of samples the last run already quantified")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes quantifying samples at once (default 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only quantify samples that are new or whose CRISPResso output is newer than the "
+                             "existing summary files, and merge them into those summaries")
+    parser.add_argument("--table-cache", action="store_true",
+                        help="keep binary copies of the parsed CRISPResso tables in logs/table_cache/, so reruns "
+                             "skip the text parsing")
+    parser.add_argument("--table-cache-size", type=int, default=2048, metavar="MB",
+                        help="size limit of logs/table_cache/, least recently used entries are removed first "
+                             "(default 2048)")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.table_cache_size < 1:
+        parser.error("--table-cache-size must be at least 1")
+    return args
+
+def summary_type(config: AmpliconConfig) -> str:
+    """Returns which summary file ("ABE", "ONESEQ" or "NUCLEASE") a sample's result belongs in"""
+    if config.intended_edit == "ONESEQ":
+        return "ONESEQ"
+    elif config.editor == "NUCLEASE":
+        return "NUCLEASE"
+    return "ABE"
+
+def load_existing_summaries(amplicon_list_path: Path) -> tuple[dict[str, dict[str, dict]], dict[str, float]]:
+    """Reads the summary files written by a previous run, for --incremental
+    Args:
+        amplicon_list_path: the amplicon_list.csv in use; if it changed after a summary was
+            written, every row of that summary is treated as out of date
+    Returns:
+        tuple[dict[str, dict[str, dict]], dict[str, float]]: for each summary type, the existing
+            rows keyed by sample, and the time each summary was written (the time its rows
+            are compared against)
+    """
+    existing_rows = {}
+    written_at = {}
+    for result_type, summary_path in SUMMARY_FILES.items():
+        existing_rows[result_type] = {}
+        if not summary_path.exists():
+            continue
+        summary_mtime = summary_path.stat().st_mtime
+        if amplicon_list_path.stat().st_mtime > summary_mtime:
+            logging.info(f"{amplicon_list_path} changed after {summary_path} was written — requantifying all its samples")
+            continue
+        # round_trip keeps unchanged rows' values bit for bit identical when they are written back
+        summary_df = pd.read_csv(summary_path, dtype={"sample": str}, float_precision="round_trip")
+        existing_rows[result_type] = {row["sample"]: row for row in summary_df.to_dict("records")}
+        written_at[result_type] = summary_mtime
+    return existing_rows, written_at
+
+def fill_subsampling_factor(summary_df: pd.DataFrame) -> pd.DataFrame:
+    """Gives samples run on all their reads a subsampling_factor of 1 in a summary where other
+        samples come from a Stage 1 --max-reads run
+    Args:
+        summary_df: one summary's rows
+    Returns:
+        pd.DataFrame: the summary, unchanged when no sample was subsampled
+    """
+    if "subsampling_factor" in summary_df.columns:
+        summary_df["subsampling_factor"] = summary_df["subsampling_factor"].fillna(1.0)
+    return summary_df
+
+def record_failure(journal: RunJournal, sample_name: str, error: Exception) -> None:
+    """Logs a failed sample and records it in the run journal"""
+    logging.error(f"Error processing {sample_name}: {error}")
+    journal.record(sample_name, FAILED, error_type=type(error).__name__, error_message=str(error))
+
+def main(argv: list[str] | None = None):
     """Entry point for Stage 2. Iterates over all fastq subdirectories, matches each
-    to an AmpliconConfig object, and performs data analysis on each sample"""
+    to an AmpliconConfig object, and performs data analysis on each sample. With
+    --workers N, up to N samples are quantified at once in separate processes. With
+    --resume, results journaled by the previous (interrupted) run are reused. With
+    --incremental, only samples that are new or whose CRISPResso output is newer than
+    the existing summary are quantified, and merged into it. With --table-cache, parsed
+    CRISPResso tables are cached in logs/table_cache/."""
+    args = parse_args(argv)
     failed_samples = []
     error_count = 0
     completed_count = 0
+    resumed_count = 0
+    unchanged_count = 0
     results_by_type = {"ABE": [], "ONESEQ": [], "NUCLEASE": []}
     fastqs_dir = Path("fastqs")
-    amplicon_configs = load_amplicon_list(find_amplicon_list())
-    for sample_dir in fastqs_dir.iterdir():
+    amplicon_list_path = find_amplicon_list()
+    amplicon_configs = AmpliconIndex(load_amplicon_list(amplicon_list_path))
+    journal = RunJournal(JOURNAL_PATH, resume=args.resume)
+    if args.table_cache:
+        configure_table_cache(TABLE_CACHE_DIR, max_bytes=args.table_cache_size * 1024**2)
+    if args.incremental:
+        existing_rows, written_at = load_existing_summaries(amplicon_list_path)
+    else:
+        existing_rows, written_at = {result_type: {} for result_type in SUMMARY_FILES}, {}
+
+    # outcome of every sample keyed by directory name -> (summary type, result) or the exception
+    outcomes = {}
+    configs = {}
+    jobs = []
+    for sample_dir in sorted(fastqs_dir.iterdir()):
         if not sample_dir.is_dir():
             continue
         if sample_dir.name in SKIP_DIRS:
             continue
+        if journal.state(sample_dir.name) == QUANTIFIED:
+            entry = journal.entries[sample_dir.name]
+            outcomes[sample_dir.name] = (entry["summary_type"], entry["result"])
+            # the journaled result replaces the sample's --incremental row, whatever its type was
+            for rows in existing_rows.values():
+                rows.pop(summary_sample_name(sample_dir.name), None)
+            resumed_count += 1
+            continue
         try:
             config = identify_amplicon(sample_dir.name, amplicon_configs)
-            logging.info(f"Processing {sample_dir.name}")
-            result = quantify_sample(config, sample_dir)
-            if config.intended_edit == "ONESEQ":
-                results_by_type["ONESEQ"].append(result)
-            elif config.editor == "NUCLEASE":
-                results_by_type["NUCLEASE"].append(result)
-            else:
-                results_by_type["ABE"].append(result)
-            logging.info(f"Done: {sample_dir.name}")
-            completed_count += 1
         except Exception as e:
-            logging.error(f"Error processing {sample_dir.name}: {e}")
+            record_failure(journal, sample_dir.name, e)
+            outcomes[sample_dir.name] = e
+            continue
+        result_type = summary_type(config)
+        existing_row = existing_rows[result_type].pop(summary_sample_name(sample_dir.name), None)
+        if existing_row is not None:
+            output_mtime = latest_crispresso_output_mtime(sample_dir)
+            if output_mtime is not None and output_mtime <= written_at[result_type]:
+                outcomes[sample_dir.name] = (result_type, existing_row)
+                unchanged_count += 1
+                continue
+        journal.record(sample_dir.name, MATCHED, amplicon=config.name)
+        configs[sample_dir.name] = config
+        jobs.append((sample_dir, config))
+
+    for sample_dir, result in quantify_samples(jobs, args.workers):
+        if isinstance(result, Exception):
+            record_failure(journal, sample_dir.name, result)
+            outcomes[sample_dir.name] = result
+            continue
+        result_type = summary_type(configs[sample_dir.name])
+        journal.record(sample_dir.name, QUANTIFIED, summary_type=result_type, result=result)
+        logging.info(f"Done: {sample_dir.name}")
+        completed_count += 1
+        outcomes[sample_dir.name] = (result_type, result)
+    evict_table_cache()
+
+    # collected in sample order so the output does not depend on which worker finished first
+    for sample_name in sorted(outcomes):
+        outcome = outcomes[sample_name]
+        if isinstance(outcome, Exception):
             error_count += 1
             failed_samples.append({
-                "sample": sample_dir.name,
-                "error_type": type(e).__name__,
-                "error_message": str(e),
+                "sample": sample_name,
+                "error_type": type(outcome).__name__,
+                "error_message": str(outcome),
             })
+        else:
+            result_type, result = outcome
+            results_by_type[result_type].append(result)
+    # rows of samples no longer in fastqs/ are kept as they are
+    for result_type, rows in existing_rows.items():
+        results_by_type[result_type].extend(rows.values())
 
     abe_df = None
     for each in results_by_type:
         if results_by_type[each]:
             if each == "ABE":
                 abe_df = pd.DataFrame(results_by_type["ABE"])
-                abe_df = abe_df.sort_values(by="sample")
+                abe_df = fill_subsampling_factor(abe_df.sort_values(by="sample"))
                 known = [c for c in CANONICAL_ABE_COLUMNS if c in abe_df.columns]
                 unknown = [c for c in abe_df.columns if c not in CANONICAL_ABE_COLUMNS]
                 if unknown:
                     logging.warning(f"Unexpected columns not in canonical order, appended at end: {unknown}")
                 abe_df = abe_df.reindex(columns=known + unknown)
-                abe_df.to_csv("ABE_Quantification_Summary.csv", index=False)
+                abe_df.to_csv(SUMMARY_FILES["ABE"], index=False)
             elif each == "ONESEQ":
                 oneseq_df = pd.DataFrame(results_by_type["ONESEQ"])
-                oneseq_df = oneseq_df.sort_values(by="sample")
-                oneseq_df.to_csv("ONESEQ_Quantification_Summary.csv", index=False)
+                oneseq_df = fill_subsampling_factor(oneseq_df.sort_values(by="sample"))
+                oneseq_df.to_csv(SUMMARY_FILES["ONESEQ"], index=False)
             elif each == "NUCLEASE":
                 nuclease_df = pd.DataFrame(results_by_type["NUCLEASE"])
-                nuclease_df = nuclease_df.sort_values(by="sample")
-                nuclease_df.to_csv("NUCLEASE_Quantification_Summary.csv", index=False)
+                nuclease_df = fill_subsampling_factor(nuclease_df.sort_values(by="sample"))
+                nuclease_df.to_csv(SUMMARY_FILES["NUCLEASE"], index=False)
             else:
                 raise ValueError(f"Unknown editor type")
     if results_by_type["ABE"]:
@@ -145,6 +293,10 @@ def main():
         for f in failed_samples:
             logging.info(f"  FAILED: {f['sample']} — {f['error_type']}: {f['error_message']}")
 
+    if args.resume:
+        logging.info(f"Samples reused from the previous run: {resumed_count}")
+    if args.incremental:
+        logging.info(f"Samples unchanged since the existing summaries: {unchanged_count}")
     logging.info(f"Samples processed correctly: {completed_count}")
     logging.info(f"Samples encountered with errors: {error_count}")
 
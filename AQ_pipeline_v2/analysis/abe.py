@@ -1,88 +1,143 @@
+import numpy as np
 import pandas as pd
-import logging
-from utils.sequences import reverse_complement
+from collections.abc import Iterable
+from analysis.alleles import (ALLELE1, ALLELE2, UNSORTED, allele_sums, protospacer_masks, search_masks,
+                              split_het_alleles, warn_alignment_shift, warn_unsorted)
+from analysis.counts import add_read_sums, allele_table_chunks, read_counts, to_pct, weight_sum
+from utils.allele_matrix import AlleleMatrix
 
 # ABE-specific metric: correction rate with/without bystanders, any A-to-G, any change
 
-def calculate_correction(allele_table: pd.DataFrame,
-                        search_sequences: list[str]) -> tuple[float, float]:
-    """Parses Allele_frequency_table dataframe for a sample and sums correction
-        percentage for perfect correction and correction with tolerated bystanders
+# the sample-wide ABE metrics, and the per-allele metrics of heterozygous samples
+ABE_METRICS = ("correction_without_bystanders", "correction_with_tolerated_bystanders",
+               "correction_with_any_AtoG_change", "correction_with_any_change_in_protospacer")
+HET_METRICS = ("correction_wo_bystanders", "correction_w_bystanders",
+               "correction_with_any_AtoG_change", "correction_with_any_change_in_protospacer")
+
+def abe_read_sums(allele_table: pd.DataFrame,
+                  search_sequences: list[str],
+                  protospacer: str,
+                  intended_edit: int,
+                  orientation: str,
+                  het_pos: list[int] | None = None,
+                  base1: str | None = None,
+                  base2: str | None = None,
+                  use_counts: bool = False) -> dict[str, int | float]:
+    """Sums the reads behind every ABE metric over an allele table, or one chunk of it. The
+        sums of several chunks add up (add_read_sums()) to the sums of the whole table.
     Args:
-        allele_table: dataframe containing read data for a given sample's allele 
-            frequency table
-        search_sequences: list of sequences that are used for exact 
-            match (search_sequences[0]) and matches with tolerated 
-            bystanders (search_sequences[1:])
+        allele_table: the allele frequency table, or a chunk of it
+        search_sequences: the perfect correction (search_sequences[0]) followed by the
+            corrections with tolerated bystanders
+        protospacer: the user's protospacer string
+        intended_edit: the user's intended edit location
+        orientation: the user's protospacer's orientation relative to the amplicon
+        het_pos: the heterozygous positions in the protospacer, None for non-heterozygous samples
+        base1: nt at primary het_pos for allele 1
+        base2: nt at primary het_pos for allele 2
+        use_counts: sum #Reads rather than %Reads
     Returns:
-        tuple[float, float]: a tuple containing perfect correction percentage and
-            tolerated correction percentage respectively"""
+        dict[str, int | float]: the reads of each ABE_METRICS metric and of alignment shifted
+            alleles. For heterozygous samples also the unsorted reads, and the reads of each
+            HET_METRICS metric and in total (total_pct) per allele
+    Raises:
+        ValueError: orientation is neither forward or reverse
+    """
+    matrix = AlleleMatrix.from_table(allele_table, len(protospacer), use_counts)
+    weights = matrix.weights
+
+    exact_mask, search_mask = search_masks(matrix, search_sequences)
+    intended_mask, only_AtoG_mask = protospacer_masks(matrix, protospacer, intended_edit, orientation)
+    masks = (exact_mask, search_mask, only_AtoG_mask, intended_mask)
+    read_sums = {metric: weight_sum(weights, mask) for metric, mask in zip(ABE_METRICS, masks)}
+    read_sums["alignment_shift"] = weight_sum(weights, ~matrix.length_ok)
+
+    if not het_pos:
+        return read_sums
 
-    exact_match_mask = allele_table["Aligned_Sequence"] == search_sequences[0]
-    pct_without_bystanders = allele_table[exact_match_mask]["%Reads"].sum()
+    labels = split_het_alleles(matrix, het_pos[0], base1, base2)
+    het_intended_mask, het_only_AtoG_mask = protospacer_masks(
+        matrix, protospacer, intended_edit, orientation, ignored_positions=het_pos
+    )
+    per_allele = {metric: allele_sums(labels, weights, mask) for metric, mask in
+                  zip(HET_METRICS, (exact_mask, search_mask, het_only_AtoG_mask, het_intended_mask))}
+    per_allele["total_pct"] = allele_sums(labels, weights)
+    if use_counts:                              # bincount sums in float64, exact for read counts
+        per_allele = {metric: sums.astype(np.int64) for metric, sums in per_allele.items()}
 
-    any_match_mask = allele_table["Aligned_Sequence"].isin(search_sequences)
-    pct_with_bystanders = allele_table[any_match_mask]["%Reads"].sum()
-        
-    return (pct_without_bystanders, pct_with_bystanders)
+    read_sums["unsorted"] = per_allele["total_pct"][UNSORTED].item()
+    for suffix, label in (("allele1", ALLELE1), ("allele2", ALLELE2)):
+        for metric, sums in per_allele.items():
+            read_sums[f"{metric}_{suffix}"] = sums[label].item()
+    return read_sums
 
-def calculate_protospacer_metrics(allele_table: pd.DataFrame,
-                                  protospacer: str,
-                                  intended_edit: int,
-                                  orientation: str) -> tuple[float, float]:
-    """Parses Allele_frequency_table dataframe for a sample and sums correction percentage
-        for correction with A to G change and correction with any change in protospacer
+def abe_metrics_from_sums(read_sums: dict[str, int | float],
+                          reads_aligned: int | None,
+                          het_pos: list[int] | None = None,
+                          base1: str | None = None,
+                          base2: str | None = None) -> dict:
+    """Turns the sums of abe_read_sums() into the ABE metrics, warning about alignment shifted
+        and (for heterozygous samples) unsorted reads
+    Args:
+        read_sums: the read sums of the whole allele table
+        reads_aligned: the sample's aligned read count for sums of #Reads, None for sums of %Reads
+        het_pos: the heterozygous positions in the protospacer, None for non-heterozygous samples
+        base1: nt at primary het_pos for allele 1
+        base2: nt at primary het_pos for allele 2
+    Returns:
+        dict: see calculate_abe_metrics()
+    """
+    metrics = {metric: to_pct(read_sums[metric], reads_aligned) for metric in ABE_METRICS}
+    warn_alignment_shift(to_pct(read_sums["alignment_shift"], reads_aligned))
+
+    if not het_pos:
+        return metrics
+
+    warn_unsorted(to_pct(read_sums["unsorted"], reads_aligned), het_pos[0], base1, base2)
+    for suffix in ("allele1", "allele2"):
+        total = read_sums[f"total_pct_{suffix}"]
+        for metric in HET_METRICS:
+            metrics[f"{metric}_{suffix}"] = to_pct(read_sums[f"{metric}_{suffix}"], total)
+        metrics[f"total_pct_{suffix}"] = to_pct(read_sums[f"total_pct_{suffix}"], reads_aligned)
+    return metrics
+
+def calculate_abe_metrics(allele_table: pd.DataFrame | Iterable[pd.DataFrame],
+                          search_sequences: list[str],
+                          protospacer: str,
+                          intended_edit: int,
+                          orientation: str,
+                          het_pos: list[int] | None = None,
+                          base1: str | None = None,
+                          base2: str | None = None,
+                          reads_aligned: int | None = None) -> dict:
+    """Computes every ABE metric for a sample in one pass over the allele table: the table is
+        encoded once and each metric is a masked sum over the same matrix.
     Args:
         allele_table: dataframe containing read data for a given sample's allele frequency
-            table
+            table, or an iterator over its chunks (iter_allele_table()) for tables too large
+            to load at once
+        search_sequences: list of sequences that are used for exact match (search_sequences[0])
+            and matches with tolerated bystanders (search_sequences[1:])
         protospacer: the user's protospacer string
         intended_edit: the user's intended edit location
         orientation: the user's protospacer's orientation relative to the amplicon
+        het_pos: the heterozygous positions in the protospacer, het_pos[0] is the primary het
+            position used to sort alleles. None or empty for non-heterozygous samples.
+        base1: nt at primary het_pos for allele 1
+        base2: nt at primary het_pos for allele 2
+        reads_aligned: the sample's aligned read count. When given, percentages come from the
+            exact #Reads counts instead of the %Reads column
     Returns:
-        tuple[float, float]: a tuple containing correction percentage with any A to G 
-        change and correction percentage with any change in protospacer respectively.
+        dict: correction_without_bystanders, correction_with_tolerated_bystanders,
+            correction_with_any_AtoG_change and correction_with_any_change_in_protospacer. For
+            heterozygous samples also the _allele1/_allele2 variants of each and the
+            total_pct_allele1/total_pct_allele2 read percentages of each allele.
     Raises:
         ValueError: orientation is neither forward or reverse
     """
-    any_change_in_protospacer = 0
-    alignment_shift_reads_pct = 0.0
-    any_AtoG_change_in_protospacer = 0
-    rc_protospacer = reverse_complement(protospacer)
-
-    for _, row in allele_table.iterrows():
-        if len(row["Aligned_Sequence"]) != len(protospacer):
-            alignment_shift_reads_pct += row["%Reads"]
-            continue
-        if orientation == "F":
-            if row["Aligned_Sequence"][intended_edit-1] == "G":
-                any_change_in_protospacer += row["%Reads"]
-                only_AtoG = True
-                for idx, c in enumerate(row["Aligned_Sequence"]):
-                    if c != protospacer[idx]:
-                        if not (protospacer[idx] == "A" and c == "G"):
-                            only_AtoG = False
-                            break
-                if only_AtoG:
-                    any_AtoG_change_in_protospacer += row["%Reads"]
-        elif orientation == "R":
-            if row["Aligned_Sequence"][len(rc_protospacer) - intended_edit] == "C":
-                any_change_in_protospacer += row["%Reads"]
-                only_AtoG = True
-                for idx, c in enumerate(row["Aligned_Sequence"]):
-                    if c != rc_protospacer[idx]:
-                        if not (rc_protospacer[idx] == "T" and c == "C"):
-                            only_AtoG = False
-                            break
-                if only_AtoG:
-                    any_AtoG_change_in_protospacer += row["%Reads"]
-        else:
-            raise ValueError(f"orientation must be 'F' or 'R', got '{orientation}'")
-        
-    if alignment_shift_reads_pct > 3:
-        logging.warning(
-            f"Skipped {alignment_shift_reads_pct:.2f}% of reads with alignment shifts "
-            f"(likely insertions in/near the protospacer region). "
-            f"These reads cannot be reliably analyzed for per-protospacer metrics."
-        )
-
-    return any_AtoG_change_in_protospacer, any_change_in_protospacer
\ No newline at end of file
+    read_sums = None
+    for chunk in allele_table_chunks(allele_table):
+        use_counts = read_counts(chunk, reads_aligned) is not None
+        read_sums = add_read_sums(read_sums, abe_read_sums(chunk, search_sequences, protospacer, intended_edit,
+                                                           orientation, het_pos, base1, base2, use_counts))
+    return abe_metrics_from_sums(read_sums, reads_aligned if use_counts else None, het_pos, base1, base2)
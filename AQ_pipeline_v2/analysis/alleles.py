@@ -0,0 +1,119 @@
+import logging
+import numpy as np
+from utils.allele_matrix import AlleleMatrix
+from utils.sequences import reverse_complement
+
+# Allele classification shared by the ABE and heterozygous calculators: masks of the alleles
+# each metric counts, the per-allele split of heterozygous samples, and the warnings about
+# reads left out of the metrics
+
+def protospacer_masks(matrix: AlleleMatrix,
+                      protospacer: str,
+                      intended_edit: int,
+                      orientation: str,
+                      ignored_positions: list[int] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Builds the per-allele masks behind the any-change and any-A-to-G protospacer metrics
+    Args:
+        matrix: the decoded allele table
+        protospacer: the user's protospacer string
+        intended_edit: the user's intended edit location, 1-indexed
+        orientation: the user's protospacer's orientation relative to the amplicon
+        ignored_positions: 0-indexed columns left out of the A to G check (het positions)
+    Returns:
+        tuple[np.ndarray, np.ndarray]: mask of alleles edited at the intended position, and mask
+            of those whose every other difference from the protospacer is an A to G change
+    Raises:
+        ValueError: orientation is neither forward or reverse
+    Note:
+        In the R orientation the allele table holds the amplicon strand, so an A->G edit on the
+        guide strand is looked for as T->C against the reverse complemented protospacer.
+    """
+    if orientation == "F":
+        reference = protospacer
+        intended_idx = intended_edit - 1
+        from_base, to_base = "A", "G"
+    elif orientation == "R":
+        reference = reverse_complement(protospacer)
+        intended_idx = len(reference) - intended_edit
+        from_base, to_base = "T", "C"
+    else:
+        raise ValueError(f"orientation must be 'F' or 'R', got '{orientation}'")
+
+    alleles = matrix.alleles
+    reference_codes = np.frombuffer(reference.encode("ascii"), dtype=np.uint8)
+    intended_mask = matrix.length_ok & (alleles[:, intended_idx] == ord(to_base))
+    allowed_change = (reference_codes == ord(from_base)) & (alleles == ord(to_base))
+    disallowed_change = (alleles != reference_codes) & ~allowed_change
+    if ignored_positions:
+        disallowed_change[:, ignored_positions] = False
+    only_AtoG_mask = intended_mask & ~disallowed_change.any(axis=1)
+    return intended_mask, only_AtoG_mask
+
+def search_masks(matrix: AlleleMatrix, search_sequences: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Matches encoded alleles against the ABE search sequences
+    Args:
+        matrix: the decoded allele table
+        search_sequences: the perfect correction (search_sequences[0]) followed by the
+            corrections with tolerated bystanders
+    Returns:
+        tuple[np.ndarray, np.ndarray]: mask of exact matches to search_sequences[0], and mask of
+            matches to any of the search sequences
+    """
+    byte_dtype = np.dtype((np.bytes_, matrix.alleles.shape[1]))
+    allele_keys = matrix.alleles.view(byte_dtype).ravel()
+    search_keys = np.array([seq.encode("ascii") for seq in search_sequences], dtype=byte_dtype)
+    return allele_keys == search_keys[0], np.isin(allele_keys, search_keys)
+
+# labels given to each allele by split_het_alleles()
+ALLELE1, ALLELE2, UNSORTED, ALIGNMENT_SHIFTED = 0, 1, 2, 3
+
+def split_het_alleles(matrix: AlleleMatrix,
+                      primary_het_pos: int,
+                      base1: str,
+                      base2: str) -> np.ndarray:
+    """Sorts the alleles of a heterozygous sample by the base at the primary het position,
+        with a single column comparison
+    Args:
+        matrix: the decoded allele table
+        primary_het_pos: 0-indexed het position used to sort alleles
+        base1: nt at primary het_pos for allele 1
+        base2: nt at primary het_pos for allele 2
+    Returns:
+        np.ndarray: one label per allele, ALLELE1, ALLELE2, UNSORTED (any other base) or
+            ALIGNMENT_SHIFTED (wrong length, never sorted)
+    """
+    het_column = matrix.alleles[:, primary_het_pos]
+    labels = np.where(het_column == ord(base1), ALLELE1,
+                      np.where(het_column == ord(base2), ALLELE2, UNSORTED))
+    labels[~matrix.length_ok] = ALIGNMENT_SHIFTED
+    return labels
+
+def allele_sums(labels: np.ndarray, weights: np.ndarray, mask: np.ndarray | None = None) -> np.ndarray:
+    """Sums %Reads (or #Reads) per allele label, optionally only over the alleles in mask.
+        bincount adds rows in table order, so each sum matches weight_sum() to the last bit,
+        and sums of counts are exact.
+    Returns:
+        np.ndarray: the sums, indexed by ALLELE1, ALLELE2, UNSORTED and ALIGNMENT_SHIFTED
+    """
+    weights = weights if mask is None else np.where(mask, weights, 0)
+    return np.bincount(labels, weights=weights, minlength=ALIGNMENT_SHIFTED + 1)
+
+def warn_unsorted(unsorted_reads_pct: float, primary_het_pos: int, base1: str, base2: str) -> None:
+    """Logs reads left out of per-allele metrics because of a third base at the het position"""
+    if unsorted_reads_pct > 3:
+        logging.warning(
+            f"{unsorted_reads_pct:.2f}% of aligned reads had a base other than "
+            f"'{base1}' or '{base2}' at het position {primary_het_pos + 1} — "
+            f"these reads were excluded from per-allele metrics. "
+            f"High values may indicate sequencing errors or a third allele."
+        )
+
+def warn_alignment_shift(alignment_shift_reads_pct: float) -> None:
+    """Logs reads excluded from per-protospacer metrics because their length does not
+        match the protospacer"""
+    if alignment_shift_reads_pct > 3:
+        logging.warning(
+            f"Skipped {alignment_shift_reads_pct:.2f}% of reads with alignment shifts "
+            f"(likely insertions in/near the protospacer region). "
+            f"These reads cannot be reliably analyzed for per-protospacer metrics."
+        )
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from collections.abc import Iterable
+
+# Exact read counts behind the analysis percentages. When the allele table has CRISPResso's
+# #Reads column and the sample's aligned read count is known, a metric is an integer sum of
+# #Reads over reads_aligned, rather than a sum of the rounded %Reads column. Tables without
+# #Reads (e.g. built by hand) fall back to summing %Reads.
+# Integer sums also add up exactly over the chunks of a table too large to load at once, so
+# the calculators accept either a dataframe or an iterator of chunks (iter_allele_table()).
+
+
+def read_counts(allele_table: pd.DataFrame, reads_aligned: int | None) -> np.ndarray | None:
+    """Returns the #Reads column as int64 counts, when percentages can be computed from them
+    Args:
+        allele_table: the allele frequency table of a sample
+        reads_aligned: the sample's aligned read count, the percentage denominator
+    Returns:
+        np.ndarray | None: the counts, None when the table has no #Reads column or
+            reads_aligned is not known
+    """
+    if not reads_aligned or "#Reads" not in allele_table.columns:
+        return None
+    return allele_table["#Reads"].to_numpy(dtype=np.int64)
+
+def weight_sum(weights: np.ndarray, mask: np.ndarray | None = None) -> int | float:
+    """Sums the weights of the masked alleles (all of them without a mask). Counts are summed
+        exactly; %Reads strictly left to right, the same order a python += loop over the allele
+        table would, so results are identical to the last bit. (np.sum uses pairwise summation,
+        which can differ in the final digit.)"""
+    values = weights if mask is None else weights[mask]
+    if values.dtype.kind in "iu":
+        return int(values.sum())
+    if len(values) == 0:
+        return 0.0
+    return float(np.cumsum(values)[-1])
+
+def to_pct(read_sum: int | float, total: int | float | None) -> float:
+    """Turns a read sum into a percentage of total (the aligned reads, or the reads of one
+        allele), 0.0 when total is empty. total is None for sums of %Reads, which already are
+        percentages"""
+    if total is None:
+        return float(read_sum)
+    return (read_sum / total) * 100 if total > 0 else 0.0
+
+def allele_table_chunks(allele_table: pd.DataFrame | Iterable[pd.DataFrame]) -> Iterable[pd.DataFrame]:
+    """Returns the chunks a calculator should sum over: the table itself when it is a
+        dataframe, otherwise the iterator of chunks it was given"""
+    return [allele_table] if isinstance(allele_table, pd.DataFrame) else allele_table
+
+def add_read_sums(totals: dict | None, read_sums: dict) -> dict:
+    """Adds the read sums of one chunk of an allele table to those of the chunks before it
+    Args:
+        totals: the sums so far, None before the first chunk
+        read_sums: the sums of the next chunk, with the same keys
+    Returns:
+        dict: the combined sums
+    """
+    if totals is None:
+        return dict(read_sums)
+    return {key: totals[key] + value for key, value in read_sums.items()}
@@ -1,22 +1,44 @@
 import pandas as pd
+from collections.abc import Iterable
+from analysis.counts import add_read_sums, allele_table_chunks, read_counts, to_pct, weight_sum
+from utils.allele_matrix import table_weights
 
-def calculate_frameshift(allele_table_df: pd.DataFrame) -> dict:
-    """% of aligned reads that are frameshifted (net indel not divisible by 3)
-    vs in-frame indels, from the allele frequency table.
-    net indel per allele = n_inserted - n_deleted; frameshift if net % 3 != 0.
+def frameshift_read_sums(allele_table_df: pd.DataFrame, use_counts: bool = False) -> dict[str, int | float]:
+    """Sums the reads of frameshift and in-frame indel alleles over an allele table, or one
+        chunk of it
     Args:
-        allele_table_df: dataframe containing read data from the sample's allele frequency table
+        allele_table_df: the allele frequency table, or a chunk of it
+        use_counts: sum #Reads rather than %Reads
     Returns:
-        dict: a dictionary matching percentage of in frame and frameshift indels to their values"""
+        dict[str, int | float]: the reads keyed pct_frameshift_indels and pct_inframe_indels"""
     if allele_table_df.empty:
-        return {"pct_frameshift_indels": 0.0, "pct_inframe_indels": 0.0}
+        return {"pct_frameshift_indels": 0, "pct_inframe_indels": 0}
 
     net = allele_table_df["n_inserted"] - allele_table_df["n_deleted"]
     has_indel = (allele_table_df["n_inserted"] != 0) | (allele_table_df["n_deleted"] != 0)
     is_frameshift = (net % 3) != 0                  # net%3!=0 implies an indel exists
     is_inframe_indel = has_indel & ~is_frameshift   # in-frame but still has an indel (e.g. 3bp del)
 
+    weights = table_weights(allele_table_df, use_counts)
     return {
-        "pct_frameshift_indels": round(allele_table_df.loc[is_frameshift, "%Reads"].sum(), 2),
-        "pct_inframe_indels": round(allele_table_df.loc[is_inframe_indel, "%Reads"].sum(), 2),
+        "pct_frameshift_indels": weight_sum(weights, is_frameshift.to_numpy()),
+        "pct_inframe_indels": weight_sum(weights, is_inframe_indel.to_numpy()),
     }
+
+def calculate_frameshift(allele_table_df: pd.DataFrame | Iterable[pd.DataFrame], reads_aligned: int | None = None) -> dict:
+    """% of aligned reads that are frameshifted (net indel not divisible by 3)
+    vs in-frame indels, from the allele frequency table.
+    net indel per allele = n_inserted - n_deleted; frameshift if net % 3 != 0.
+    Args:
+        allele_table_df: dataframe containing read data from the sample's allele frequency table,
+            or an iterator over its chunks (iter_allele_table()) for tables too large to load at once
+        reads_aligned: the sample's aligned read count. When given, percentages come from the
+            exact #Reads counts instead of the %Reads column
+    Returns:
+        dict: a dictionary matching percentage of in frame and frameshift indels to their values"""
+    read_sums = None
+    for chunk in allele_table_chunks(allele_table_df):
+        use_counts = read_counts(chunk, reads_aligned) is not None
+        read_sums = add_read_sums(read_sums, frameshift_read_sums(chunk, use_counts))
+    denominator = reads_aligned if use_counts else None
+    return {key: round(to_pct(read_sum, denominator), 2) for key, read_sum in read_sums.items()}
@@ -1,24 +1,77 @@
+import numpy as np
 import pandas as pd
+from collections.abc import Iterable
+from analysis.counts import add_read_sums, allele_table_chunks, read_counts, to_pct, weight_sum
+from utils.allele_matrix import AlleleMatrix
+from utils.sequences import reverse_complement
 
 # ONESEQ analysis: A-to-G combinations across the first 10bp and full protospacer
 
-def calculate_oneseq(allele_table: pd.DataFrame,
-                     first_10bp_seqs: list[str],
-                     any_bp_seqs: list[str]) -> tuple[float, float]:
-    """calculates the percentage of correction in subsections of the full sequence
+def oneseq_read_sums(allele_table: pd.DataFrame,
+                     protospacer: str,
+                     orientation: str,
+                     use_counts: bool = False) -> dict[str, int | float]:
+    """Sums the reads carrying only A to G edits in the first 10 bp ("first_10bp") and anywhere
+        in the protospacer ("anywhere"), over an allele table or one chunk of it
     Args:
-        allele_table: the allele frequency table from the relevant CRISPResso sample folder.
-        first_10bp_seqs: a list of sequences with correction in the first 10 base pairs.
-        any_bp_seqs: a list of sequences with correction anywhere in the protospacer.
+        allele_table: the allele frequency table, or a chunk of it
+        protospacer: the users guide sequence
+        orientation: the orientation of the guide sequence relative to the amplicon
+        use_counts: sum #Reads rather than %Reads
     Returns:
-        tuple[float, float]: returns a tuple of floats containing the percentage of editing in
-        the first 10 bp anywhere in the protospacer respectively
+        dict[str, int | float]: the two read sums
+    Raises:
+        ValueError: orientation is neither forward nor reverse
     """
-        
-    first_10_mask = allele_table["Aligned_Sequence"].isin(first_10bp_seqs)
-    pct_first_10_bp_editing = allele_table[first_10_mask]["%Reads"].sum()
+    if orientation == "F":
+        reference = protospacer.upper()
+        from_base, to_base = "A", "G"
+        outside_first_10 = slice(10, None)
+    elif orientation == "R":
+        reference = reverse_complement(protospacer)
+        from_base, to_base = "T", "C"
+        outside_first_10 = slice(0, max(len(reference) - 10, 0))
+    else:
+        raise ValueError(f"orientation must be 'F' or 'R', got '{orientation}'")
+
+    matrix = AlleleMatrix.from_table(allele_table, len(reference), use_counts)
+    reference_codes = np.frombuffer(reference.encode("ascii"), dtype=np.uint8)
 
-    any_bp_mask = allele_table["Aligned_Sequence"].isin(any_bp_seqs)
-    pct_any_bp_editing = allele_table[any_bp_mask]["%Reads"].sum()
+    changed = matrix.alleles != reference_codes
+    allowed_change = (reference_codes == ord(from_base)) & (matrix.alleles == ord(to_base))
+    any_bp_mask = matrix.length_ok & changed.any(axis=1) & ~(changed & ~allowed_change).any(axis=1)
+    first_10_mask = any_bp_mask & ~changed[:, outside_first_10].any(axis=1)
 
-    return(pct_first_10_bp_editing, pct_any_bp_editing)
+    return {"first_10bp": weight_sum(matrix.weights, first_10_mask), "anywhere": weight_sum(matrix.weights, any_bp_mask)}
+
+def calculate_oneseq_edits(allele_table: pd.DataFrame | Iterable[pd.DataFrame],
+                           protospacer: str,
+                           orientation: str,
+                           reads_aligned: int | None = None) -> tuple[float, float]:
+    """calculates the percentage of reads carrying only A to G edits, in the first 10 bp and
+        anywhere in the protospacer. Each allele is classified directly, rather than matched
+        against the 2^(number of A's) - 1 edited sequences.
+    Args:
+        allele_table: the allele frequency table from the relevant CRISPResso sample folder, or
+            an iterator over its chunks (iter_allele_table()) for tables too large to load at once
+        protospacer: the users guide sequence
+        orientation: the orientation of the guide sequence relative to the amplicon
+        reads_aligned: the sample's aligned read count. When given, percentages come from the
+            exact #Reads counts instead of the %Reads column
+    Returns:
+        tuple[float, float]: returns a tuple of floats containing the percentage of editing in
+        the first 10 bp anywhere in the protospacer respectively
+    Raises:
+        ValueError: orientation is neither forward nor reverse
+    Note:
+        An allele passes if it differs from the protospacer and every difference is an A to G
+        at an A position (T to C against the reverse complement for R orientation). For the first
+        10 bp metric every difference must also fall within the first 10 bp of the guide, which
+        are the last 10 columns of the allele table in the R orientation.
+    """
+    read_sums = None
+    for chunk in allele_table_chunks(allele_table):
+        use_counts = read_counts(chunk, reads_aligned) is not None
+        read_sums = add_read_sums(read_sums, oneseq_read_sums(chunk, protospacer, orientation, use_counts))
+    denominator = reads_aligned if use_counts else None
+    return (to_pct(read_sums["first_10bp"], denominator), to_pct(read_sums["anywhere"], denominator))
@@ -1,22 +1,27 @@
 import pandas as pd
+from collections.abc import Iterator
+from functools import partial
+from importlib.util import find_spec
 from pathlib import Path
+from loaders.table_cache import cached_dataframe, cached_ints
 
 
 # Reads CRISPResso output files: allele frequency tables, mapping statistics
+# Parsed tables are served from the sidecar cache in loaders/table_cache.py when it is enabled
 
-def read_mapping_stats(path: Path) -> tuple[int, int]:
-    """Opens the CRISPResso_mapping_statistics file and collects the total and
-    aligned read number
-    Args: 
-        path: Path to the CRISPResso_mapping_statistics file
-    Returns:
-        tuple[int, int]: returns a tuple containing total reads and aligned reads for a given sample
-    Raises:
-        ValueError: total reads value is 0 in the file
-        ValueError: aligned reads exceeds total reads.
-        ValueError: aligned reads below 10% of total reads
-        FileNotFoundError: if the 'open' function fails
-    """
+# allele tables are parsed with pyarrow's multithreaded reader when it is installed
+ALLELE_TABLE_ENGINE = "pyarrow" if find_spec("pyarrow") is not None else "c"
+# compact dtypes for the numeric allele table columns, the rest are left to pandas
+ALLELE_TABLE_DTYPES = {"n_deleted": "int32", "n_inserted": "int32", "n_mutated": "int32",
+                       "#Reads": "int64", "%Reads": "float64"}
+# the allele table columns each analysis reads, see read_allele_table()
+ABE_ALLELE_COLUMNS = ("Aligned_Sequence", "#Reads", "%Reads")
+NUCLEASE_ALLELE_COLUMNS = ("n_deleted", "n_inserted", "#Reads", "%Reads")
+# rows per chunk when an allele table is streamed with iter_allele_table()
+ALLELE_CHUNK_ROWS = 250_000
+
+def _parse_mapping_stats(path: Path) -> tuple[int, int]:
+    """Reads READS AFTER PREPROCESSING and READS ALIGNED from the CRISPResso_mapping_statistics file"""
     with open(path, encoding="utf-8") as f:
         headers = f.readline().strip().split("\t")
         values = f.readline().strip().split("\t")
@@ -34,8 +39,61 @@ def read_mapping_stats(path: Path) -> tuple[int, int]:
     # }
     # We only use READS AFTER PREPROCESSING and READS ALIGNED.
 
-    reads_total = int(row["READS AFTER PREPROCESSING"])
-    reads_aligned = int(row["READS ALIGNED"])
+    return int(row["READS AFTER PREPROCESSING"]), int(row["READS ALIGNED"])
+
+def _parse_input_reads(path: Path) -> tuple[int]:
+    """Reads READS IN INPUTS from the CRISPResso_mapping_statistics file"""
+    with open(path, encoding="utf-8") as f:
+        row = dict(zip(f.readline().strip().split("\t"), f.readline().strip().split("\t")))
+    return (int(row["READS IN INPUTS"]),)
+
+def _allele_table_columns(path: Path, columns: tuple[str, ...] | None) -> tuple[list[str], dict[str, str]]:
+    """Returns which columns of an allele table to read (the requested ones the file has, all of
+        them for None) and their dtypes, from the header line"""
+    with open(path, encoding="utf-8") as f:
+        header = f.readline().rstrip("\r\n").split("\t")
+    usecols = [column for column in header if columns is None or column in columns]
+    return usecols, {column: dtype for column, dtype in ALLELE_TABLE_DTYPES.items() if column in usecols}
+
+def _parse_allele_table(path: Path, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+    """Parses the allele_frequency_table text file, with #Reads as int64 counts
+    Args:
+        path: file path to the allele_frequency_table
+        columns: the columns to read, those the file does not have are skipped. None for all
+    """
+    usecols, dtypes = _allele_table_columns(path, columns)
+    return pd.read_csv(path, sep="\t", usecols=usecols, dtype=dtypes, engine=ALLELE_TABLE_ENGINE)
+
+def _parse_quant_window(path: Path) -> pd.DataFrame:
+    """Parses the quantification window text file, with every cell as a float"""
+    df = pd.read_csv(path, sep="\t", index_col=0)
+    return df.astype(float)
+
+def read_mapping_counts(path: Path) -> tuple[int, int]:
+    """Returns the total (after preprocessing) and aligned read counts of a
+        CRISPResso_mapping_statistics file without the sanity checks of read_mapping_stats,
+        e.g. for a partial run where a low aligned fraction is expected"""
+    return cached_ints(path, _parse_mapping_stats)
+
+def read_input_reads(path: Path) -> int:
+    """Returns READS IN INPUTS, the number of reads CRISPResso read from the fastqs, from a
+        CRISPResso_mapping_statistics file"""
+    return cached_ints(path, _parse_input_reads)[0]
+
+def read_mapping_stats(path: Path) -> tuple[int, int]:
+    """Opens the CRISPResso_mapping_statistics file and collects the total and
+    aligned read number
+    Args: 
+        path: Path to the CRISPResso_mapping_statistics file
+    Returns:
+        tuple[int, int]: returns a tuple containing total reads and aligned reads for a given sample
+    Raises:
+        ValueError: total reads value is 0 in the file
+        ValueError: aligned reads exceeds total reads.
+        ValueError: aligned reads below 10% of total reads
+        FileNotFoundError: if the 'open' function fails
+    """
+    reads_total, reads_aligned = read_mapping_counts(path)
 
     if reads_total == 0:
         raise ValueError(f"No reads found in {path} — file may be corrupt or empty")
@@ -54,18 +112,44 @@ def read_mapping_stats(path: Path) -> tuple[int, int]:
 
     return reads_total, reads_aligned
 
-def read_allele_table(path: Path) -> pd.DataFrame:
+def read_allele_table(path: Path, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
     """Creates a dataframe for the allele_frequency_table
     Args:
         path: file path to the allele_frequency_table
+        columns: only read these columns (e.g. ABE_ALLELE_COLUMNS), which keeps deep samples'
+            tables small. Columns the file does not have are skipped. None reads every column
     Returns:
-        pd.DataFrame: a pandas dataframe of the allele_frequency_table_data
+        pd.DataFrame: a pandas dataframe of the allele_frequency_table_data. #Reads is int64, so
+            the analysis modules can compute percentages from exact counts
     Raises:
-        FileNotFoundError: if read_csv's open() call fails
-        ValueError: df.astype(float) interacts with non-numeric value
+        FileNotFoundError: if the file cannot be opened
+        ValueError: a #Reads value is not an integer
     """
-    df = pd.read_csv(path, sep="\t")
-    return df
+    if columns is None:
+        return cached_dataframe(path, _parse_allele_table)
+    return cached_dataframe(path, partial(_parse_allele_table, columns=columns),
+                            kind=f"_parse_allele_table:{','.join(columns)}")
+
+def iter_allele_table(path: Path,
+                      columns: tuple[str, ...] | None = None,
+                      chunk_rows: int = ALLELE_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Streams an allele frequency table in chunks of chunk_rows rows, so tables of any size
+        are read in the same memory. Chunks are not cached, unlike read_allele_table()
+    Args:
+        path: file path to the allele_frequency_table
+        columns: only read these columns, as for read_allele_table(). None reads every column
+        chunk_rows: the number of rows per chunk
+    Yields:
+        pd.DataFrame: the chunks, in file order, with the dtypes read_allele_table() uses. A
+            table without rows yields one empty chunk
+    Raises:
+        FileNotFoundError: if the file cannot be opened
+        ValueError: a #Reads value is not an integer
+    """
+    usecols, dtypes = _allele_table_columns(path, columns)
+    # pyarrow reads whole files only, chunks come from pandas' own reader
+    with pd.read_csv(path, sep="\t", usecols=usecols, dtype=dtypes, chunksize=chunk_rows) as reader:
+        yield from reader
 
 def read_quant_window(path: Path) -> pd.DataFrame:
     """Reads the CRISPResso quantification to create a dataframe for downstream use
@@ -75,8 +159,7 @@ def read_quant_window(path: Path) -> pd.DataFrame:
         pd.DataFrame: a pandas dataframe of the quantification window
     Raises:
         FileNotFoundError: if read_csv's open() call fails"""
-    df = pd.read_csv(path, sep="\t", index_col=0)
-    df = df.astype(float)
+    df = cached_dataframe(path, _parse_quant_window)
     return df
 
 def read_editing_frequency(path: Path) -> dict:
@@ -112,4 +195,72 @@ def read_editing_frequency(path: Path) -> dict:
         "insertions": int(row["Insertions"]),
         "deletions": int(row["Deletions"]),
         "substitutions": int(row["Substitutions"]),
-    }
\ No newline at end of file
+    }
+
+def read_mapping_table(path: Path) -> dict[str, int]:
+    """Reads every column of a CRISPResso_mapping_statistics file, e.g. to combine the
+        statistics of several runs
+    Args:
+        path: Path to the CRISPResso_mapping_statistics file
+    Returns:
+        dict[str, int]: column name -> value
+    """
+    with open(path, encoding="utf-8") as f:
+        headers = f.readline().strip().split("\t")
+        values = f.readline().strip().split("\t")
+    return {header: int(value) for header, value in zip(headers, values)}
+
+def read_editing_frequency_table(path: Path) -> pd.DataFrame:
+    """Reads the whole CRISPResso_quantification_of_editing_frequency file, e.g. to combine
+        the counts of several runs (read_editing_frequency() picks out what Stage 2 uses)
+    Args:
+        path: Path to the CRISPResso_quantification_of_editing_frequency.txt file
+    Returns:
+        pd.DataFrame: one row per amplicon
+    """
+    return pd.read_csv(path, sep="\t")
+
+def write_mapping_stats(path: Path,
+                        reads_in_inputs: int,
+                        reads_total: int,
+                        reads_aligned: int,
+                        alignment_counts: list[int] | None = None) -> None:
+    """Writes a CRISPResso_mapping_statistics file, for outputs the pipeline builds itself
+    Args:
+        path: Path of the CRISPResso_mapping_statistics file to write
+        reads_in_inputs: reads in the input fastqs
+        reads_total: reads after preprocessing
+        reads_aligned: reads aligned to the amplicon
+        alignment_counts: N_COMPUTED_ALN, N_CACHED_ALN, N_COMPUTED_NOTALN and N_CACHED_NOTALN,
+            all 0 when None
+    """
+    headers = ["READS IN INPUTS", "READS AFTER PREPROCESSING", "READS ALIGNED",
+               "N_COMPUTED_ALN", "N_CACHED_ALN", "N_COMPUTED_NOTALN", "N_CACHED_NOTALN"]
+    values = [reads_in_inputs, reads_total, reads_aligned, *(alignment_counts or [0, 0, 0, 0])]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\t".join(headers) + "\n")
+        f.write("\t".join(str(value) for value in values) + "\n")
+
+def write_allele_table(path: Path, allele_table: pd.DataFrame) -> None:
+    """Writes an allele frequency table in CRISPResso's tab separated layout
+    Args:
+        path: Path of the Alleles_frequency_table_around_sgRNA_*.txt file to write
+        allele_table: the table, with at least the Aligned_Sequence, #Reads and %Reads columns
+    """
+    allele_table.to_csv(path, sep="\t", index=False)
+
+def write_quant_window(path: Path, quant_window: pd.DataFrame) -> None:
+    """Writes a Quantification_window_nucleotide_percentage_table file
+    Args:
+        path: Path of the quantification table to write
+        quant_window: fraction of reads with each base (rows) at each window position (columns)
+    """
+    quant_window.to_csv(path, sep="\t")
+
+def write_editing_frequency_table(path: Path, editing_frequency: pd.DataFrame) -> None:
+    """Writes a CRISPResso_quantification_of_editing_frequency file
+    Args:
+        path: Path of the file to write
+        editing_frequency: the table, as read by read_editing_frequency_table()
+    """
+    editing_frequency.to_csv(path, sep="\t", index=False)
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import zipfile
+from collections.abc import Callable
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Binary (npz) sidecar cache for parsed CRISPResso tables, so reruns of Stage 2 skip the
+# text parsing. Sidecars live in one cache directory, are keyed on the source file's path,
+# size and mtime, and the least recently used ones are evicted to keep the directory under
+# a size limit. The cache is disabled until configure_table_cache() is called.
+
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024**3
+SIDECAR_SUFFIX = ".npz"
+
+_cache_dir = None
+_max_bytes = DEFAULT_MAX_CACHE_BYTES
+_bytes_since_eviction = 0
+
+
+def configure_table_cache(cache_dir: Path | None, max_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> None:
+    """Turns the sidecar cache on (or off) for this process
+    Args:
+        cache_dir: directory the sidecars are kept in, None disables the cache
+        max_bytes: total size the cache directory is kept under by LRU eviction
+    """
+    global _cache_dir, _max_bytes, _bytes_since_eviction
+    _cache_dir = Path(cache_dir) if cache_dir is not None else None
+    _max_bytes = max_bytes
+    _bytes_since_eviction = 0
+    if _cache_dir is not None:
+        _cache_dir.mkdir(parents=True, exist_ok=True)
+
+def table_cache_settings() -> tuple[Path | None, int]:
+    """Returns the current (cache_dir, max_bytes), e.g. to configure worker processes the same way"""
+    return _cache_dir, _max_bytes
+
+def _sidecar_path(path: Path, kind: str) -> Path:
+    """Returns where the sidecar of a given source file and parser lives"""
+    key = hashlib.sha256(f"{kind}\0{Path(path).resolve()}".encode("utf-8")).hexdigest()
+    return _cache_dir / f"{key}{SIDECAR_SUFFIX}"
+
+def _source_key(path: Path) -> np.ndarray:
+    """Returns the size and mtime of the source file, which a sidecar must match to be used"""
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def _load_sidecar(path: Path, kind: str) -> dict[str, np.ndarray] | None:
+    """Loads the arrays stored for a source file
+    Returns:
+        dict[str, np.ndarray] | None: the stored arrays, None when there is no sidecar or it
+            is stale (the source file changed since it was written) or unreadable
+    """
+    sidecar = _sidecar_path(path, kind)
+    try:
+        with np.load(sidecar, allow_pickle=False) as data:
+            if not np.array_equal(data["__source__"], _source_key(path)):
+                return None
+            arrays = {name: data[name] for name in data.files}
+        os.utime(sidecar)                       # bump mtime, the LRU eviction order
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        logging.warning(f"Ignoring unreadable table cache entry {sidecar}: {e}")
+        return None
+    return arrays
+
+def _write_sidecar(path: Path, kind: str, source_key: np.ndarray, arrays: dict[str, np.ndarray]) -> None:
+    """Writes the sidecar for a source file, then evicts old sidecars if the cache has grown
+        by a sixteenth of its size limit since this process last checked"""
+    global _bytes_since_eviction
+    sidecar = _sidecar_path(path, kind)
+    tmp_path = sidecar.with_name(f"{sidecar.stem}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, __source__=source_key, **arrays)
+        os.replace(tmp_path, sidecar)           # concurrent workers never see a half written file
+    except OSError as e:
+        logging.warning(f"Could not write table cache entry for {path}: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return
+    _bytes_since_eviction += sidecar.stat().st_size
+    if _bytes_since_eviction > _max_bytes // 16:
+        evict_table_cache()
+
+def evict_table_cache() -> None:
+    """Deletes the least recently used sidecars until the cache is under its size limit"""
+    global _bytes_since_eviction
+    _bytes_since_eviction = 0
+    if _cache_dir is None:
+        return
+    entries = []
+    for sidecar in _cache_dir.glob(f"*{SIDECAR_SUFFIX}"):
+        try:
+            stat = sidecar.stat()
+        except FileNotFoundError:               # evicted by another worker
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, sidecar))
+    total = sum(size for _, size, _ in entries)
+    for _, size, sidecar in sorted(entries):
+        if total <= _max_bytes:
+            break
+        sidecar.unlink(missing_ok=True)
+        total -= size
+
+def _frame_to_arrays(df: pd.DataFrame) -> dict[str, np.ndarray] | None:
+    """Converts a dataframe into plain numpy arrays that np.savez can store without pickling
+    Returns:
+        dict[str, np.ndarray] | None: the arrays, None if a column cannot be stored this way
+            (e.g. a text column with missing values)
+    """
+    arrays = {
+        "__columns__": np.array(df.columns, dtype=str),
+        "__dtypes__": np.array([str(dtype) for dtype in df.dtypes], dtype=str),
+    }
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        if df.index.hasnans:
+            return None
+        arrays["__index__"] = df.index.to_numpy(dtype=str)
+        arrays["__index_meta__"] = np.array([df.index.name or "", str(df.index.dtype)], dtype=str)
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        if values.dtype.kind in "biuf":
+            arrays[f"col_{i}"] = values.to_numpy()
+        elif values.hasnans:
+            return None
+        else:
+            try:                                # sequences are ASCII, stored at 1 byte per character
+                arrays[f"col_{i}"] = np.array(values.tolist(), dtype="S")
+            except UnicodeEncodeError:
+                arrays[f"col_{i}"] = values.to_numpy(dtype=str)
+    return arrays
+
+def _arrays_to_frame(arrays: dict[str, np.ndarray]) -> pd.DataFrame:
+    """Rebuilds the dataframe stored by _frame_to_arrays, with the original column dtypes"""
+    columns = arrays["__columns__"].tolist()
+    dtypes = arrays["__dtypes__"].tolist()
+    data = {}
+    for i, (column, dtype) in enumerate(zip(columns, dtypes)):
+        values = arrays[f"col_{i}"]
+        data[column] = values if values.dtype.kind in "biuf" else pd.Series(values.astype(str).tolist(), dtype=dtype)
+    df = pd.DataFrame(data, columns=pd.Index(columns))
+    if "__index__" in arrays:
+        index_name, index_dtype = arrays["__index_meta__"].tolist()
+        df.index = pd.Index(arrays["__index__"].astype(object), name=index_name or None).astype(index_dtype)
+    return df
+
+def cached_dataframe(path: Path, parse: Callable[[Path], pd.DataFrame], kind: str | None = None) -> pd.DataFrame:
+    """Returns parse(path), from the sidecar cache when the source file is unchanged
+    Args:
+        path: the source text file
+        parse: the function that parses the text file into a dataframe
+        kind: what the sidecar is stored under, defaults to the parser's name. Parsers that
+            read the same file differently (e.g. other columns) need their own kind
+    Returns:
+        pd.DataFrame: the parsed table
+    """
+    if _cache_dir is None:
+        return parse(path)
+    kind = kind or parse.__name__
+    arrays = _load_sidecar(path, kind)
+    if arrays is not None:
+        return _arrays_to_frame(arrays)
+    source_key = _source_key(path)
+    df = parse(path)
+    arrays = _frame_to_arrays(df)
+    if arrays is not None:
+        _write_sidecar(path, kind, source_key, arrays)
+    return df
+
+def cached_ints(path: Path, parse: Callable[[Path], tuple[int, ...]]) -> tuple[int, ...]:
+    """Returns parse(path) for parsers that return a tuple of integers, from the sidecar
+        cache when the source file is unchanged
+    Args:
+        path: the source text file
+        parse: the function that parses the text file into a tuple of integers
+    Returns:
+        tuple[int, ...]: the parsed values
+    """
+    if _cache_dir is None:
+        return parse(path)
+    kind = parse.__name__
+    arrays = _load_sidecar(path, kind)
+    if arrays is not None:
+        return tuple(int(value) for value in arrays["values"])
+    source_key = _source_key(path)
+    values = parse(path)
+    _write_sidecar(path, kind, source_key, {"values": np.array(values, dtype=np.int64)})
+    return values
@@ -0,0 +1,169 @@
+import logging
+import shutil
+from collections import Counter
+from glob import glob
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from config import AmpliconConfig
+from loaders.crispresso_output import (read_allele_table, read_mapping_counts, read_quant_window, write_allele_table,
+                                       write_mapping_stats, write_quant_window)
+from pipeline.crispresso import crispresso_output_dir, resolve_fastq_reads, run_crispresso, run_engine
+from pipeline.direct import QUANT_WINDOW_BASES, window_nucleotide_fractions
+from utils.fastq import open_fastq, read_fastq_lanes, write_fastq_record
+
+# Stage 1 collapse engine -> identical reads are collapsed into one read per unique sequence
+# before CRISPResso runs, and CRISPResso's counts are scaled back up to the original depth
+# using CRISPResso's full allele table, where every unique read is one row
+
+COLLAPSE_DIR = "collapsed"
+FULL_ALLELE_TABLE = "Alleles_frequency_table.zip"
+UNCOLLAPSED_EDITORS = {"NUCLEASE"}      # quantified from CRISPResso's own editing frequencies
+
+
+def collapse_reads(read1_files: list[str], collapsed_path: Path) -> Counter:
+    """Writes one read per unique sequence, keeping the name and qualities of its first copy
+    Args:
+        read1_files: the sample's fastq files, in lane order
+        collapsed_path: the collapsed fastq to write
+    Returns:
+        Counter: sequence -> number of reads with that sequence
+    """
+    counts = Counter()
+    with open_fastq(collapsed_path, "wt") as f:
+        for header, sequence, quality in read_fastq_lanes(read1_files):
+            if sequence not in counts:
+                write_fastq_record(f, header, sequence, quality)
+            counts[sequence] += 1
+    return counts
+
+def window_alleles(full_table: pd.DataFrame, window_start: int, window_end: int) -> list[tuple[str, str]]:
+    """Cuts each row of CRISPResso's full allele table down to a window of the amplicon
+    Args:
+        full_table: CRISPResso's Alleles_frequency_table, Aligned_Sequence and
+            Reference_Sequence aligned over the whole amplicon
+        window_start: first amplicon position of the window
+        window_end: amplicon position just past the window
+    Returns:
+        list[tuple[str, str]]: the aligned and reference window of every row, insertions
+            inside the window included
+    """
+    windows = []
+    for aligned, reference in zip(full_table["Aligned_Sequence"], full_table["Reference_Sequence"]):
+        columns = [column for column, base in enumerate(reference) if base != "-"]
+        first, last = columns[window_start], columns[window_end - 1] + 1
+        windows.append((aligned[first:last], reference[first:last]))
+    return windows
+
+def rescale_output(crispresso_subfolder: Path, counts: Counter, amplicon: str) -> bool:
+    """Rewrites the allele table, mapping statistics and quantification window of a
+        CRISPResso run on collapsed reads at the original read depth. Every check is made
+        against CRISPResso's own (collapsed) tables first, and nothing is written unless
+        rebuilding them from the full allele table reproduces them exactly.
+    Args:
+        crispresso_subfolder: the CRISPResso_on_<sample> folder of the collapsed run
+        counts: sequence -> read count, from collapse_reads()
+        amplicon: the amplicon sequence
+    Returns:
+        bool: True if the output was rescaled, False if it could not be matched to the
+            collapsed reads (and was left untouched)
+    """
+    allele_file, = glob(str(crispresso_subfolder / "Alleles_frequency_table_around_sgRNA_*.txt"))
+    window_table = read_allele_table(Path(allele_file))
+    full_table = pd.read_csv(crispresso_subfolder / FULL_ALLELE_TABLE, sep="\t", compression="zip")
+    reads_total, reads_aligned = read_mapping_counts(crispresso_subfolder / "CRISPResso_mapping_statistics.txt")
+    quant_window = read_quant_window(crispresso_subfolder / "Quantification_window_nucleotide_percentage_table.txt")
+
+    # every unique read must be one row of the full table, aligned over the whole amplicon,
+    # and none may have been filtered out
+    reads = full_table["Aligned_Sequence"].str.replace("-", "", regex=False)
+    references = full_table["Reference_Sequence"].str.replace("-", "", regex=False)
+    if reads_total != len(counts) or reads_aligned != len(full_table) or (full_table["#Reads"] != 1).any():
+        return False
+    if not reads.isin(counts.keys()).all() or (references != amplicon.upper()).any():
+        return False
+
+    reference_window = window_table["Reference_Sequence"].iloc[0].replace("-", "")
+    window_start = amplicon.upper().find(reference_window)
+    if window_start == -1 or amplicon.upper().find(reference_window, window_start + 1) != -1:
+        return False
+    keys = ["Aligned_Sequence", "Reference_Sequence"]
+    rebuilt = pd.DataFrame(window_alleles(full_table, window_start, window_start + len(reference_window)), columns=keys)
+    rebuilt["collapsed_reads"] = 1
+    rebuilt["#Reads"] = reads.map(counts).to_numpy(dtype=np.int64)
+    rebuilt = rebuilt.groupby(keys).sum()
+
+    # the unweighted rebuild must give back CRISPResso's own table before the weights are trusted
+    collapsed_reads = window_table.set_index(keys)["#Reads"]
+    if not rebuilt.index.sort_values().equals(collapsed_reads.index.sort_values()):
+        return False
+    if not (rebuilt["collapsed_reads"].reindex(collapsed_reads.index) == collapsed_reads).all():
+        return False
+
+    original_total = int(sum(counts.values()))
+    original_aligned = int(rebuilt["#Reads"].sum())
+    window_table["#Reads"] = rebuilt["#Reads"].reindex(collapsed_reads.index).to_numpy()
+    window_table["%Reads"] = window_table["#Reads"] / max(original_aligned, 1) * 100
+    window_table = window_table.sort_values(by="#Reads", ascending=False, kind="stable", ignore_index=True)
+
+    # quantification window: inserted bases have no reference position, so they are dropped.
+    # It is rebuilt at the collapsed depth first and checked against CRISPResso's
+    projected = pd.DataFrame({
+        "Aligned_Sequence": [
+            "".join(base for base, reference_base in zip(aligned, reference) if reference_base != "-")
+            for aligned, reference in zip(window_table["Aligned_Sequence"], window_table["Reference_Sequence"])
+        ],
+        "#Reads": collapsed_reads.reindex(pd.MultiIndex.from_frame(window_table[keys])).to_numpy(),
+    })
+    expected = quant_window.reindex(QUANT_WINDOW_BASES).fillna(0.0).to_numpy()
+    rebuilt_window = window_nucleotide_fractions(projected, reference_window, reads_aligned).to_numpy()
+    if expected.shape != rebuilt_window.shape or not np.allclose(expected, rebuilt_window, atol=1e-6):
+        return False
+    projected["#Reads"] = window_table["#Reads"]
+
+    write_allele_table(Path(allele_file), window_table)
+    write_mapping_stats(crispresso_subfolder / "CRISPResso_mapping_statistics.txt",
+                        original_total, original_total, original_aligned)
+    write_quant_window(crispresso_subfolder / "Quantification_window_nucleotide_percentage_table.txt",
+                       window_nucleotide_fractions(projected, reference_window, original_aligned))
+    return True
+
+def run_collapsed(amplicon_list_row: AmpliconConfig,
+                  sample_dir: Path,
+                  log_path: Path | None = None,
+                  force: bool = False) -> bool:
+    """Runs CRISPResso on a sample's unique reads only, then scales the allele table, mapping
+        statistics and quantification window back up to the original depth. Paired end and
+        NUCLEASE samples, and samples whose output cannot be rescaled exactly, are run
+        through CRISPResso on the full reads instead.
+    Args:
+        amplicon_list_row: the AmpliconConfig object that was associated with the sample
+        sample_dir: the directory path of the current sample
+        log_path: where CRISPResso's own output is written, None for the terminal
+        force: rerun even when the saved fingerprint matches
+    Returns:
+        bool: True if the sample was run, False if it was a cache hit
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out R1/R2 and lanes from the fastq file names
+    """
+    _, _, read2_files = resolve_fastq_reads(sample_dir)
+    if read2_files or amplicon_list_row.editor in UNCOLLAPSED_EDITORS:
+        logging.info(f"Read collapsing does not apply to {sample_dir.name} — running CRISPResso on all reads")
+        return run_crispresso(amplicon_list_row, sample_dir, log_path, force=force)
+
+    def produce(collapse_dir: Path, read1_files: list[str], read2_files: list[str], fingerprint: dict) -> Path | None:
+        counts = collapse_reads(read1_files, collapse_dir / "collapsed.fastq.gz")
+        logging.info(f"{sample_dir.name}: {sum(counts.values())} reads collapsed to {len(counts)} unique sequences")
+
+        run_crispresso(amplicon_list_row, collapse_dir, log_path, force=True)
+        crispresso_subfolder = crispresso_output_dir(collapse_dir)
+        if rescale_output(crispresso_subfolder, counts, amplicon_list_row.amplicon):
+            return crispresso_subfolder
+        logging.warning(f"CRISPResso output for the collapsed reads of {sample_dir.name} could not be "
+                        f"rescaled — running CRISPResso on all reads")
+        shutil.rmtree(collapse_dir)
+        run_crispresso(amplicon_list_row, sample_dir, log_path, force=True)
+        return None
+
+    return run_engine(amplicon_list_row, sample_dir, produce, COLLAPSE_DIR, engine="collapse", force=force)
@@ -1,15 +1,23 @@
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Callable
 from config import AmpliconConfig
 from glob import glob
+import hashlib
+import json
+import re
+import shutil
 import subprocess
 import logging
+from utils.fastq import concatenated_fastq
 
 
 #stage 1 -> finds FASTQs, matches each to an amplicon config, runs CRISPResso
 
-def by_name_length(config) -> int:
-    """Sort key - return the length of the amplicon's name"""
-    return len(config.name)
+FINGERPRINT_FILE = "crispresso_fingerprint.json"
+RUN_DIR = "crispresso_run"      # scratch directory run_crispresso() writes CRISPResso's output to
+PARTIAL_HASH_BYTES = 1 << 20    # bytes hashed from each end of a fastq
+LANE_PATTERN = re.compile(r"_L(\d{3})(?=[_.])", re.IGNORECASE)   # Illumina lane tag, e.g. _L001_
 
 def pair_fastq_files(fastq_files: list[str]) -> tuple[str, str]:
     """Identifies R1 and R2 from a list of exactly two fastq file paths.
@@ -29,6 +37,56 @@ def pair_fastq_files(fastq_files: list[str]) -> tuple[str, str]:
         raise ValueError(f"could not unambiguously identify R1/R2 in {fastq_files}")
     return read1, read2
 
+def group_fastq_lanes(fastq_files: list[str]) -> tuple[list[str], list[str]]:
+    """Sorts a sample's fastq files into read 1 and read 2, lane by lane, for samples that a
+        NextSeq run split across lanes (_L001 ... _L004)
+    Args:
+        fastq_files: the sample's fastq file paths
+    Returns:
+        tuple[list[str], list[str]]: the R1 files and the R2 files (empty for single end
+            reads), each in lane order
+    Raises:
+        ValueError: files without a lane tag are mixed with lane files, or more than two of them
+        ValueError: a lane does not hold exactly one R1 (and R2) file, or lanes disagree on
+            whether reads are paired
+        ValueError: gzipped and plain fastqs are mixed, so the lanes cannot be concatenated
+    """
+    if len(fastq_files) == 1:
+        return list(fastq_files), []
+
+    by_lane = {}
+    for f in fastq_files:
+        lane = LANE_PATTERN.search(Path(f).name)
+        by_lane.setdefault(int(lane.group(1)) if lane else None, []).append(f)
+
+    if None in by_lane:
+        if len(by_lane) > 1:
+            raise ValueError(f"fastqs with and without lane numbers (_L001) are mixed in {fastq_files}")
+        if len(fastq_files) > 2:
+            raise ValueError(f"More than two FASTQ files found without lane numbers (_L001) in {fastq_files}")
+        read1, read2 = pair_fastq_files(fastq_files)
+        return [read1], [read2]
+
+    if len({f.endswith(".gz") for f in fastq_files}) > 1:
+        raise ValueError(f"gzipped and plain fastqs cannot be merged across lanes: {fastq_files}")
+    if len({len(lane_files) for lane_files in by_lane.values()}) > 1:
+        raise ValueError(f"lanes disagree on single or paired end reads: {fastq_files}")
+
+    read1_files, read2_files = [], []
+    for lane in sorted(by_lane):
+        lane_files = by_lane[lane]
+        if len(lane_files) > 2:
+            raise ValueError(f"More than two FASTQ files found for lane L{lane:03d}: {lane_files}")
+        if len(lane_files) == 1:
+            if "_R2" in Path(lane_files[0]).name.upper():
+                raise ValueError(f"lane L{lane:03d} has an R2 file but no R1: {lane_files}")
+            read1_files.append(lane_files[0])
+        else:
+            read1, read2 = pair_fastq_files(lane_files)
+            read1_files.append(read1)
+            read2_files.append(read2)
+    return read1_files, read2_files
+
 def build_window_args(amplicon_list_row: AmpliconConfig) -> list[str]:
     """checks editor and creates the correct window arguments for the CRISPResso command, 
         based on the editor.
@@ -51,27 +109,68 @@ def build_window_args(amplicon_list_row: AmpliconConfig) -> list[str]:
             '--quantification_window_size', str((proto_len + 1) // 2),
         ]
 
-def identify_amplicon(directory_name: str, amplicon_configs: list[AmpliconConfig]) -> AmpliconConfig:
+class AmpliconIndex:
+    """Index of amplicon names for matching sample directories, built once per run from
+        load_amplicon_list(). Names are bucketed by length, so matching a directory checks
+        each substring of the directory name with a dict lookup, longest names first, instead
+        of testing every amplicon name against it.
+    Attributes:
+        configs: the AmpliconConfig objects, in amplicon_list.csv order
+    """
+
+    def __init__(self, amplicon_configs: list[AmpliconConfig]):
+        """Builds the index
+        Args:
+            amplicon_configs: list of all AmpliconConfig objects from amplicon_list.csv
+        """
+        self.configs = list(amplicon_configs)
+        # name length -> upper case name -> (position in amplicon_list.csv, config); the first
+        # config of a given name is kept, matching the stable sort identify_amplicon used
+        self._by_length = {}
+        for position, config in enumerate(self.configs):
+            bucket = self._by_length.setdefault(len(config.name), {})
+            bucket.setdefault(config.name.upper(), (position, config))
+        self._lengths = sorted(self._by_length, reverse=True)
+
+    def match(self, directory_name: str) -> AmpliconConfig | None:
+        """Finds the amplicon whose name is the longest substring of the directory name
+            (ignoring case and anything after the first "."). Between equally long names that
+            both match, the one listed first in amplicon_list.csv wins.
+        Args:
+            directory_name: the name of the sample directory
+        Returns:
+            AmpliconConfig | None: the matching amplicon, None if no name matches
+        """
+        directory_upper = directory_name.split(".")[0].upper()
+        for length in self._lengths:
+            if length > len(directory_upper):
+                continue
+            bucket = self._by_length[length]
+            matches = [
+                bucket[directory_upper[start:start + length]]
+                for start in range(len(directory_upper) - length + 1)
+                if directory_upper[start:start + length] in bucket
+            ]
+            if matches:
+                return min(matches, key=lambda match: match[0])[1]
+        return None
+
+def identify_amplicon(directory_name: str, amplicon_configs: list[AmpliconConfig] | AmpliconIndex) -> AmpliconConfig:
     """matches the correct amplicon to the given sample
     Args:
         directory_name: the name of the sample directory
-        amplicon_configs: list of all AmpliconConfig objects from amplicon_list.csv
+        amplicon_configs: an AmpliconIndex, or the list of all AmpliconConfig objects from
+            amplicon_list.csv (indexed on every call, so pass an AmpliconIndex when matching
+            many directories)
     Returns:
         AmpliconConfig: the amplicon that matches the sample directory
     Raises:
         ValueError: no amplicon config object matches the sample directory
     """
-    
-    matched_name = None
+    if not isinstance(amplicon_configs, AmpliconIndex):
+        amplicon_configs = AmpliconIndex(amplicon_configs)
 
-    clean_name = directory_name.split(".")[0]
-
-    directory_upper = clean_name.upper()
-
-    for config in sorted(amplicon_configs, key=by_name_length, reverse=True):        
-        if config.name.upper() in directory_upper:            
-            matched_name = config
-            break
+    matched_name = amplicon_configs.match(directory_name)
     
     if not matched_name:
         error_msg = f"No valid amplicon match found for directory: {directory_name}"
@@ -80,44 +179,330 @@ def identify_amplicon(directory_name: str, amplicon_configs: list[AmpliconConfig
     logging.info(f"Matched {directory_name} to amplicon {matched_name.name}")
     return matched_name
 
-def run_crispresso(amplicon_list_row: AmpliconConfig, sample_dir: Path) -> None:
+def find_fastq_files(sample_dir: Path) -> list[str]:
+    """Collects every fastq file (gzipped or plain) in a sample directory
+    Args:
+        sample_dir: the directory path of the sample
+    Returns:
+        list[str]: sorted list of fastq file paths, empty if none are found
+    """
+    return sorted(glob(str(sample_dir / "*.fastq.gz")) + glob(str(sample_dir / "*.fastq")))
+
+def fastq_size(sample_dir: Path) -> int:
+    """Sort key - returns the combined size in bytes of a sample's fastq files"""
+    return sum(Path(f).stat().st_size for f in find_fastq_files(sample_dir))
+
+def order_by_fastq_size(sample_dirs: list[Path]) -> list[Path]:
+    """Orders sample directories largest input first, so that when samples are run in
+        parallel the slowest sample starts early instead of running alone at the end
+    Args:
+        sample_dirs: the sample directories to be scheduled
+    Returns:
+        list[Path]: the sample directories sorted by combined fastq size, largest first.
+            Ties are broken by directory name so the order is deterministic.
+    """
+    by_name = sorted(sample_dirs, key=lambda d: d.name)
+    return sorted(by_name, key=fastq_size, reverse=True)
+
+def partial_file_hash(path: Path) -> str:
+    """Hashes the first and last PARTIAL_HASH_BYTES of a file. Cheap on multi-GB fastqs,
+        and together with size and mtime catches a file being replaced or rewritten.
+    Args:
+        path: path of the file to hash
+    Returns:
+        str: hex digest of the sampled bytes
+    """
+    digest = hashlib.sha256()
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES:
+            f.seek(max(PARTIAL_HASH_BYTES, size - PARTIAL_HASH_BYTES))
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+    return digest.hexdigest()
+
+def compute_fingerprint(amplicon_list_row: AmpliconConfig,
+                        fastq_files: list[str],
+                        window_args: list[str],
+                        engine: str = "crispresso") -> dict:
+    """Builds the fingerprint of everything that determines a sample's CRISPResso output
+    Args:
+        amplicon_list_row: the AmpliconConfig object used for the CRISPResso call
+        fastq_files: the fastq files passed to CRISPResso
+        window_args: the editor specific arguments from build_window_args()
+        engine: which engine produced the output, "crispresso" or "direct"
+    Returns:
+        dict: the fingerprint inputs along with their combined digest under "digest"
+    """
+    inputs = {
+        "fastqs": [
+            {
+                "name": Path(f).name,
+                "size": Path(f).stat().st_size,
+                "mtime_ns": Path(f).stat().st_mtime_ns,
+                "partial_sha256": partial_file_hash(Path(f)),
+            }
+            for f in fastq_files
+        ],
+        "amplicon": amplicon_list_row.amplicon,
+        "protospacer": amplicon_list_row.protospacer,
+        "window_args": window_args,
+    }
+    if engine != "crispresso":      # left out for CRISPResso so existing fingerprints stay valid
+        inputs["engine"] = engine
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+    return {"digest": digest, **inputs}
+
+def crispresso_output_dir(sample_dir: Path) -> Path:
+    """Returns the CRISPResso_on_<sample> folder every Stage 1 engine writes a sample's output to"""
+    return sample_dir / f"CRISPResso_on_{sample_dir.name}"
+
+def clear_crispresso_output(sample_dir: Path) -> None:
+    """Removes every CRISPResso_on_* folder of a sample, including ones an older run named
+        after its fastq, so quantify_sample() never finds more than one"""
+    for old_output in glob(str(sample_dir / "CRISPResso_on_*")):
+        shutil.rmtree(old_output)
+
+def fingerprint_matches(sample_dir: Path, fingerprint: dict) -> bool:
+    """Checks whether a sample already has CRISPResso output built from the same inputs
+    Args:
+        sample_dir: the directory path of the sample
+        fingerprint: the freshly computed fingerprint from compute_fingerprint()
+    Returns:
+        bool: True if the saved fingerprint matches and a CRISPResso_on_* folder exists
+    """
+    fingerprint_path = sample_dir / FINGERPRINT_FILE
+    if not fingerprint_path.exists() or not glob(str(sample_dir / "CRISPResso_on_*")):
+        return False
+    try:
+        saved = json.loads(fingerprint_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return saved.get("digest") == fingerprint["digest"]
+
+def install_crispresso_output(sample_dir: Path, output: Path, fingerprint: dict) -> None:
+    """Makes a finished run's output the sample's only CRISPResso_on_* folder, then saves the
+        fingerprint of the inputs it was built from
+    Args:
+        sample_dir: the directory path of the sample
+        output: the finished CRISPResso_on_* folder, anywhere outside the sample's own
+            CRISPResso_on_* folders
+        fingerprint: the fingerprint from compute_fingerprint() the output was built from
+    """
+    clear_crispresso_output(sample_dir)
+    shutil.move(str(output), str(crispresso_output_dir(sample_dir)))
+    (sample_dir / FINGERPRINT_FILE).write_text(json.dumps(fingerprint, indent=2), encoding="utf-8")
+
+def run_engine(amplicon_list_row: AmpliconConfig,
+               sample_dir: Path,
+               produce: Callable[[Path, list[str], list[str], dict], Path | None],
+               scratch_name: str,
+               engine: str = "crispresso",
+               force: bool = False) -> bool:
+    """The steps every Stage 1 engine shares - fingerprint the sample's inputs, skip it on a
+        cache hit, build the output in a scratch directory, and install it as the sample's
+        only CRISPResso_on_<sample> folder along with the new fingerprint
+    Args:
+        amplicon_list_row: the AmpliconConfig object that was associated with the sample
+        sample_dir: the directory path of the current sample
+        produce: builds the output - called with the (emptied) scratch directory, the R1 and
+            R2 files from resolve_fastq_reads() and the fingerprint, and returns the finished
+            CRISPResso_on_* folder, or None when it already installed the output itself
+        scratch_name: name of the scratch directory inside the sample directory, removed once
+            the output is installed and left behind for inspection if produce fails
+        engine: the engine recorded in the fingerprint, see compute_fingerprint()
+        force: rerun even when the saved fingerprint matches
+    Returns:
+        bool: True if the sample was run, False if it was a cache hit
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out read 1, read 2 and lanes from the fastq file names
+    """
+    fastq_files, read1_files, read2_files = resolve_fastq_reads(sample_dir)
+    fingerprint = compute_fingerprint(amplicon_list_row, fastq_files, build_window_args(amplicon_list_row), engine=engine)
+    if not force and fingerprint_matches(sample_dir, fingerprint):
+        return False
+    # a stale fingerprint must not survive a failed rerun
+    (sample_dir / FINGERPRINT_FILE).unlink(missing_ok=True)
+
+    scratch_dir = sample_dir / scratch_name
+    if scratch_dir.exists():
+        shutil.rmtree(scratch_dir)
+    scratch_dir.mkdir()
+    output = produce(scratch_dir, read1_files, read2_files, fingerprint)
+    if output is not None:
+        install_crispresso_output(sample_dir, output, fingerprint)
+    else:
+        (sample_dir / FINGERPRINT_FILE).write_text(json.dumps(fingerprint, indent=2), encoding="utf-8")
+    if scratch_dir.exists():
+        shutil.rmtree(scratch_dir)
+    return True
+
+def resolve_fastq_reads(sample_dir: Path) -> tuple[list[str], list[str], list[str]]:
+    """Finds a sample's fastq files and works out which are read 1 and read 2
+    Args:
+        sample_dir: the directory path of the sample
+    Returns:
+        tuple[list[str], list[str], list[str]]: all fastq files found, the R1 files and the
+            R2 files (empty for single end reads). There is one R1/R2 file per lane when the
+            sample was split across lanes, in lane order.
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out read 1, read 2 and lanes from the file names,
+            see group_fastq_lanes()
+    """
+    fastq_files = find_fastq_files(sample_dir)
+
+    if not fastq_files:
+        raise FileNotFoundError(f"No FASTQ files found in {sample_dir}")
+    read1_files, read2_files = group_fastq_lanes(fastq_files)
+    return fastq_files, read1_files, read2_files
+
+def run_logged(cmd: list[str], log_path: Path | None) -> None:
+    """Runs a CRISPResso command, sending its output to the terminal or to a log file
+    Args:
+        cmd: the command to run
+        log_path: file that stdout/stderr is written to, None for the terminal
+    Raises:
+        subprocess.CalledProcessError: the command failed while writing to the terminal
+        RuntimeError: the command failed while writing to a log file
+    """
+    if log_path is None:
+        subprocess.run(cmd, check=True)
+        return
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        result = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} exited with status {result.returncode} — see {log_path}")
+
+def run_crispresso(amplicon_list_row: AmpliconConfig,
+                   sample_dir: Path,
+                   log_path: Path | None = None,
+                   force: bool = False) -> bool:
     """Runs the CRISPResso command line function using information from the matched amplicon
         config file
     Args:
         amplicon_list_row: the AmpliconConfig object that was associated with the sample
         sample_dir: the directory path of the current sample analysis is being run on
+        log_path: optional file that CRISPResso's stdout/stderr is written to. When None the
+            output goes to the terminal, which is only readable when samples run one at a time.
+        force: rerun CRISPResso even when the saved fingerprint matches
     Returns:
-        None: the purpose of the function is to run the CRISPResso command, no return value
+        bool: True if CRISPResso was run, False if the sample was a cache hit (its fastqs,
+            amplicon, protospacer and window arguments are unchanged since the last run)
     Raises:
         FileNotFoundError: no fastq files found in the sample directory
-        ValueError: unable to distinguish read 1 and read 2 in paired end reads
-        ValueError: more than 2 fastq files found in the sample directory
+        ValueError: unable to work out read 1, read 2 and lanes from the fastq file names
+        RuntimeError: CRISPResso exited cleanly without writing CRISPResso_on_<sample>
     """
-    fastq_files = sorted(glob(str(sample_dir / "*.fastq.gz")) + glob(str(sample_dir / "*.fastq")))
+    def produce(run_dir: Path, read1_files: list[str], read2_files: list[str], fingerprint: dict) -> Path:
+        ####Static Args the crispresso command need regardless of editor
+        common_args = [
+            'CRISPResso',
+            '--amplicon_seq', amplicon_list_row.amplicon, #amplicon sequence from amplicon config object
+            '--guide_seq', amplicon_list_row.protospacer, #protospacer sequence from amplicon config object
+            '--output_folder', str(run_dir), #output folder for the crispresso run
+            '--name', sample_dir.name, #so the output is always CRISPResso_on_<sample>, whatever the fastqs are called
+        ]
 
-    if not fastq_files:
-        raise FileNotFoundError(f"No FASTQ files found in {sample_dir}")
+        # lanes are streamed to CRISPResso through a named pipe rather than merged on disk
+        with ExitStack() as stack:
+            fastq_cmd_section = ['--fastq_r1', stack.enter_context(concatenated_fastq(read1_files))]
+            if read2_files:
+                fastq_cmd_section += ['--fastq_r2', stack.enter_context(concatenated_fastq(read2_files))]
+            run_logged(common_args + fastq_cmd_section + build_window_args(amplicon_list_row), log_path)
 
-    elif len(fastq_files) == 1:
-        fastq_cmd_section = ['--fastq_r1', fastq_files[0]]
-    elif len(fastq_files) == 2:
-        read1, read2 = pair_fastq_files(fastq_files)
-        fastq_cmd_section = ['--fastq_r1', read1, '--fastq_r2', read2]
-    else:
-        raise ValueError(f"More than two FASTQ files found in {sample_dir}")
-
-    ####Static Args the crispresso command need regardless of editor
-    common_args = [
-        'CRISPResso',
-        *fastq_cmd_section,
-        '--amplicon_seq', amplicon_list_row.amplicon, #amplicon sequence from amplicon config object
-        '--guide_seq', amplicon_list_row.protospacer, #protospacer sequence from amplicon config object
-        '--output_folder', str(sample_dir), #output folder for the crispresso run
-    ]
+        output = run_dir / crispresso_output_dir(sample_dir).name
+        if not output.is_dir():
+            raise RuntimeError(f"CRISPResso produced no output for {sample_dir.name}" + (f" — see {log_path}" if log_path else ""))
+        return output
+
+    return run_engine(amplicon_list_row, sample_dir, produce, RUN_DIR, force=force)
 
-    #helper funtion that populates the remaining window args based on editor
+def run_crispresso_batch(amplicon_list_row: AmpliconConfig,
+                         sample_dirs: list[Path],
+                         batch_root: Path,
+                         log_path: Path | None = None,
+                         n_processes: int = 1,
+                         force: bool = False) -> dict[Path, bool | Exception]:
+    """Runs every sample matched to the same amplicon through a single CRISPRessoBatch call,
+        so the CRISPResso startup and import cost is paid once per amplicon instead of once
+        per sample. Each sample's CRISPResso_on_* folder is then moved back into its own
+        sample directory, exactly where run_crispresso() would have written it.
+    Args:
+        amplicon_list_row: the AmpliconConfig object shared by all the samples
+        sample_dirs: the sample directories matched to the amplicon
+        batch_root: working directory for the batch settings file and CRISPRessoBatch output,
+            removed once every output has been split back into its sample directory
+        log_path: optional file that CRISPRessoBatch's stdout/stderr is written to
+        n_processes: number of processes CRISPRessoBatch may use (its -p option)
+        force: rerun samples even when their saved fingerprint matches
+    Returns:
+        dict[Path, bool | Exception]: per sample directory, True if it was run, False if it was
+            a cache hit, or the exception that prevented it from running
+    Raises:
+        subprocess.CalledProcessError / RuntimeError: the CRISPRessoBatch call itself failed
+    """
     window_args = build_window_args(amplicon_list_row)
+    outcomes = {}
+    batch_rows = []
+    fingerprints = {}
+    for sample_dir in sample_dirs:
+        try:
+            fastq_files, read1_files, read2_files = resolve_fastq_reads(sample_dir)
+        except (FileNotFoundError, ValueError) as e:
+            outcomes[sample_dir] = e
+            continue
+        fingerprint = compute_fingerprint(amplicon_list_row, fastq_files, window_args)
+        if not force and fingerprint_matches(sample_dir, fingerprint):
+            outcomes[sample_dir] = False
+            continue
+        (sample_dir / FINGERPRINT_FILE).unlink(missing_ok=True)
+        fingerprints[sample_dir] = fingerprint
+        batch_rows.append((sample_dir, read1_files, read2_files))
+
+    if not batch_rows:
+        return outcomes
+
+    batch_dir = batch_root / amplicon_list_row.name
+    if batch_dir.exists():
+        shutil.rmtree(batch_dir)
+    batch_dir.mkdir(parents=True)
+
+    settings_file = batch_dir / "batch_settings.tsv"
+    cmd = [
+        'CRISPRessoBatch',
+        '--batch_settings', str(settings_file),
+        '--amplicon_seq', amplicon_list_row.amplicon,
+        '--guide_seq', amplicon_list_row.protospacer,
+        '--output_folder', str(batch_dir),
+        '--name', amplicon_list_row.name,
+        '--n_processes', str(n_processes),
+        '--skip_failed',    # one bad sample must not take down the rest of the batch
+        *window_args,
+    ]
+    with ExitStack() as stack:
+        with open(settings_file, "w", encoding="utf-8") as f:
+            f.write("name\tfastq_r1\tfastq_r2\n")
+            for sample_dir, read1_files, read2_files in batch_rows:
+                read1 = Path(stack.enter_context(concatenated_fastq(read1_files))).resolve()
+                read2 = Path(stack.enter_context(concatenated_fastq(read2_files))).resolve() if read2_files else ''
+                f.write(f"{sample_dir.name}\t{read1}\t{read2}\n")
+        run_logged(cmd, log_path)
 
-    cmd = common_args + window_args
-    subprocess.run(cmd, check=True)
+    batch_output = batch_dir / f"CRISPRessoBatch_on_{amplicon_list_row.name}"
+    for sample_dir, _, _ in batch_rows:
+        sample_output = batch_output / f"CRISPResso_on_{sample_dir.name}"
+        if not (sample_output / "CRISPResso_mapping_statistics.txt").exists():
+            outcomes[sample_dir] = RuntimeError(f"CRISPRessoBatch produced no output for {sample_dir.name} — see {log_path}")
+            continue
+        install_crispresso_output(sample_dir, sample_output, fingerprints[sample_dir])
+        outcomes[sample_dir] = True
 
+    # leave the batch folder behind for inspection if any sample failed
+    if all(outcomes[sample_dir] is True for sample_dir, _, _ in batch_rows):
+        shutil.rmtree(batch_dir)
+        if not any(batch_root.iterdir()):
+            batch_root.rmdir()
+    return outcomes
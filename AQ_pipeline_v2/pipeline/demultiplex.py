@@ -0,0 +1,144 @@
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+from itertools import zip_longest
+from pathlib import Path
+from config import AmpliconConfig
+from pipeline.crispresso import AmpliconIndex
+from utils.fastq import open_fastq, read_fastq, write_fastq_record
+from utils.kmers import KmerIndex
+
+# Splits a pooled fastq (reads from many amplicons) into one sample directory per amplicon,
+# so Stage 1 can run the amplicons in parallel
+
+UNASSIGNED = "unassigned"
+
+
+def pool_prefix(read1: str | Path) -> str:
+    """Derives the sample directory prefix from the pooled R1 file name
+    Args:
+        read1: path of the pooled R1 fastq
+    Returns:
+        str: the file name without its read/lane suffix and fastq extension,
+            e.g. "Pool3" for "Pool3_R1_001.fastq.gz"
+    """
+    return re.sub(r"(_R1(_\d{3})?)?\.fastq(\.gz)?$", "", Path(read1).name, flags=re.IGNORECASE)
+
+def demultiplexed_fastq(output_dir: Path, prefix: str, name: str, read: int) -> Path:
+    """Returns the path reads assigned to an amplicon are written to,
+        <output_dir>/<prefix>_<name>/<prefix>_<name>_R<read>_001.fastq.gz. Unassigned reads
+        are written next to the sample directories rather than into one, so Stage 1 skips them.
+    Args:
+        output_dir: the directory the sample directories are created in, usually fastqs/
+        prefix: the sample directory prefix
+        name: the amplicon name, or UNASSIGNED
+        read: 1 or 2
+    Returns:
+        Path: the fastq path
+    """
+    sample = f"{prefix}_{name}"
+    if name == UNASSIGNED:
+        return output_dir / f"{sample}_R{read}_001.fastq.gz"
+    return output_dir / sample / f"{sample}_R{read}_001.fastq.gz"
+
+def check_sample_names(amplicon_configs: list[AmpliconConfig], prefix: str) -> None:
+    """Warns about amplicons whose demultiplexed sample directory would be matched to a
+        different amplicon by Stage 1 (e.g. because the prefix contains a longer amplicon name)
+    Args:
+        amplicon_configs: list of all AmpliconConfig objects from amplicon_list.csv
+        prefix: the sample directory prefix
+    """
+    index = AmpliconIndex(amplicon_configs)
+    for config in index.configs:
+        matched = index.match(f"{prefix}_{config.name}")
+        if matched is not None and matched.name != config.name:
+            logging.warning(f"Sample directory {prefix}_{config.name} will be matched to {matched.name} "
+                            f"in Stage 1; choose a different prefix")
+
+def shared_amplicon_rows(amplicon_configs: list[AmpliconConfig]) -> set[str]:
+    """Finds the rows whose amplicon sequence is listed more than once (e.g. several guides on
+        one amplicon). K-mers cannot tell such rows apart, so their reads cannot be split by
+        row; each group is warned about
+    Args:
+        amplicon_configs: list of all AmpliconConfig objects from amplicon_list.csv
+    Returns:
+        set[str]: names of the rows sharing their amplicon with another row
+    """
+    rows_by_amplicon = {}
+    for config in amplicon_configs:
+        rows_by_amplicon.setdefault(config.amplicon.upper(), []).append(config.name)
+    shared = set()
+    for names in rows_by_amplicon.values():
+        if len(names) > 1:
+            logging.warning(f"Amplicon rows {', '.join(names)} share one amplicon sequence; their reads "
+                            f"cannot be told apart and are written to the {UNASSIGNED} fastq")
+            shared.update(names)
+    return shared
+
+def demultiplex(read1: str | Path,
+                read2: str | Path | None,
+                kmer_index: KmerIndex,
+                output_dir: Path,
+                prefix: str,
+                force: bool = False) -> Counter:
+    """Streams a pooled fastq (or R1/R2 pair) and writes each read to the gzipped fastq of the
+        amplicon its k-mers match. Reads of amplicons listed on more than one row
+        (shared_amplicon_rows()) are written to the UNASSIGNED fastq. Reads are handled one record at a time and every output file
+        is written as it goes, so memory does not grow with the size of the input - only with
+        the number of amplicons that receive reads (one open file per amplicon and read).
+    Args:
+        read1: path of the pooled R1 fastq
+        read2: path of the pooled R2 fastq, None for single end reads
+        kmer_index: KmerIndex of all amplicons from amplicon_list.csv
+        output_dir: the directory the sample directories are created in, usually fastqs/
+        prefix: the sample directory prefix, see pool_prefix()
+        force: replace the fastqs left by an earlier demultiplexing run
+    Returns:
+        Counter: amplicon name (or UNASSIGNED) -> number of reads (pairs) written
+    Raises:
+        FileExistsError: an output fastq already exists and force is False
+        ValueError: R1 and R2 hold different numbers of reads, or a record is malformed
+    """
+    names = [config.name for config in kmer_index.configs] + [UNASSIGNED]
+    existing = [
+        path for name in names for read in (1, 2)
+        if (path := demultiplexed_fastq(output_dir, prefix, name, read)).exists()
+    ]
+    if existing and not force:
+        raise FileExistsError(f"{existing[0]} already exists, use --force to overwrite it")
+    for path in existing:
+        path.unlink()               # amplicons that get no reads this time must not keep old ones
+        if path.parent != output_dir and not any(path.parent.iterdir()):
+            path.parent.rmdir()
+    check_sample_names(kmer_index.configs, prefix)
+    shared = shared_amplicon_rows(kmer_index.configs)
+
+    counts = Counter()
+    with ExitStack() as stack:
+        writers = {}
+
+        def writer(name: str, read: int):
+            if (name, read) not in writers:
+                path = demultiplexed_fastq(output_dir, prefix, name, read)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                writers[name, read] = stack.enter_context(open_fastq(path, "wt"))
+            return writers[name, read]
+
+        records2 = read_fastq(read2) if read2 is not None else iter(())
+        for record1, record2 in zip_longest(read_fastq(read1), records2):
+            if record1 is None or (read2 is not None and record2 is None):
+                raise ValueError(f"{read1} and {read2} hold different numbers of reads")
+            config = kmer_index.assign_read(record1[1].upper())
+            if config is None and record2 is not None:
+                config = kmer_index.assign_read(record2[1].upper())
+            name = config.name if config is not None and config.name not in shared else UNASSIGNED
+            write_fastq_record(writer(name, 1), *record1)
+            if record2 is not None:
+                write_fastq_record(writer(name, 2), *record2)
+            counts[name] += 1
+
+    total = sum(counts.values())
+    for name, count in sorted(counts.items()):
+        logging.info(f"{prefix}_{name}: {count} reads ({count / total:.1%})")
+    return counts
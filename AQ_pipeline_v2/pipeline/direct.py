@@ -0,0 +1,276 @@
+import logging
+from collections import Counter
+from glob import glob
+from itertools import zip_longest
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from config import AmpliconConfig
+from loaders.crispresso_output import (read_allele_table, read_mapping_counts, write_allele_table,
+                                       write_mapping_stats, write_quant_window)
+from pipeline.crispresso import crispresso_output_dir, run_crispresso, run_engine
+from utils.allele_matrix import AlleleMatrix
+from utils.fastq import open_fastq, read_fastq_lanes, write_fastq_record
+from utils.sequences import encode_sequences, reverse_complement
+
+# Stage 1 direct engine -> for substitution-only (ABE) amplicons, reads are anchored on the
+# amplicon bases flanking the protospacer and the window between the anchors is tallied
+# directly. Only reads that cannot be anchored are aligned by CRISPResso.
+
+FLANK_LENGTH = 10               # bp of amplicon on each side of the protospacer used as anchors
+FALLBACK_DIR = "direct_fallback"
+DIRECT_DIR = "direct_run"       # scratch directory the output is built in
+DIRECT_EDITORS = {"ABE"}
+QUANT_WINDOW_BASES = ["A", "C", "G", "T", "N", "-"]
+READ_COMPLEMENT = str.maketrans("ACGTN", "TGCAN")
+ALLELE_TABLE_COLUMNS = ["Aligned_Sequence", "Reference_Sequence", "Unedited", "n_deleted",
+                        "n_inserted", "n_mutated", "#Reads", "%Reads"]
+
+
+def occurs_once(sequence: str, subsequence: str) -> bool:
+    """Returns True if subsequence occurs exactly once in sequence, overlapping matches included"""
+    first = sequence.find(subsequence)
+    return first != -1 and sequence.find(subsequence, first + 1) == -1
+
+def protospacer_anchors(amplicon_list_row: AmpliconConfig) -> tuple[str, str, str] | None:
+    """Finds the protospacer window on the amplicon strand and the flanking anchor sequences
+    Args:
+        amplicon_list_row: the AmpliconConfig object for the sample
+    Returns:
+        tuple[str, str, str] | None: the left anchor, the reference window (the protospacer, or
+            its reverse complement for R orientation) and the right anchor. None when the direct
+            engine cannot be used: an editor that makes indels, a protospacer or anchor that is
+            not found exactly once in the amplicon, or fewer than FLANK_LENGTH bp on either side.
+    """
+    if amplicon_list_row.editor not in DIRECT_EDITORS:
+        return None
+    amplicon = amplicon_list_row.amplicon.upper()
+    reference = amplicon_list_row.protospacer.upper()
+    if amplicon_list_row.orientation == "R":
+        reference = reverse_complement(reference)
+    if not occurs_once(amplicon, reference):
+        return None
+    start = amplicon.find(reference)
+    end = start + len(reference)
+    if start < FLANK_LENGTH or end + FLANK_LENGTH > len(amplicon):
+        return None
+    left_anchor = amplicon[start - FLANK_LENGTH:start]
+    right_anchor = amplicon[end:end + FLANK_LENGTH]
+    # a repeated anchor (e.g. a homopolymer run) could place the window at the wrong offset
+    if not occurs_once(amplicon, left_anchor) or not occurs_once(amplicon, right_anchor):
+        return None
+    return left_anchor, reference, right_anchor
+
+def anchor_window(read: str, left_anchor: str, right_anchor: str, window_length: int) -> str | None:
+    """Extracts the protospacer window from a read that carries both anchors the expected
+        distance apart, i.e. with no insertion or deletion in the window
+    Args:
+        read: the read sequence, on the amplicon strand
+        left_anchor: amplicon bases immediately before the window
+        right_anchor: amplicon bases immediately after the window
+        window_length: length of the window
+    Returns:
+        str | None: the window bases, None if the read cannot be anchored
+    """
+    spacing = len(left_anchor) + window_length
+    position = read.find(left_anchor)
+    while position != -1:
+        if read.startswith(right_anchor, position + spacing):
+            return read[position + len(left_anchor):position + spacing]
+        position = read.find(left_anchor, position + 1)
+    return None
+
+def tally_windows(read1: list[str],
+                  read2: list[str],
+                  anchors: tuple[str, str, str],
+                  fallback_dir: Path) -> tuple[Counter, int, int]:
+    """Streams a sample's reads, counting the window allele of every read that can be anchored
+        and writing the others to fastqs in fallback_dir for CRISPResso
+    Args:
+        read1: the R1 fastq files, one per lane
+        read2: the R2 fastq files, one per lane, empty for single end reads
+        anchors: the left anchor, reference window and right anchor from protospacer_anchors()
+        fallback_dir: directory the unanchored reads are written to
+    Returns:
+        tuple[Counter, int, int]: the read count of each window allele, the number of reads
+            (read pairs) in the input, and the number written out for CRISPResso
+    Raises:
+        ValueError: R1 and R2 contain different numbers of reads
+    """
+    left_anchor, reference, right_anchor = anchors
+    window_length = len(reference)
+    counts = Counter()
+    reads_in_inputs = 0
+    unanchored = 0
+    fallback_files = None
+
+    if not read2:
+        records = ((record, None) for record in read_fastq_lanes(read1))
+    else:
+        records = zip_longest(read_fastq_lanes(read1), read_fastq_lanes(read2))
+    try:
+        for record1, record2 in records:
+            if record1 is None or (read2 and record2 is None):
+                raise ValueError(f"{read1} and {read2} contain different numbers of reads")
+            reads_in_inputs += 1
+            window = anchor_window(record1[1], left_anchor, right_anchor, window_length)
+            if record2 is not None:
+                # R2 reads the amplicon's other strand; mates that disagree go to CRISPResso
+                read2_sequence = record2[1][::-1].translate(READ_COMPLEMENT)
+                window2 = anchor_window(read2_sequence, left_anchor, right_anchor, window_length)
+                if window is None:
+                    window = window2
+                elif window2 is not None and window2 != window:
+                    window = None
+            if window is not None:
+                counts[window] += 1
+                continue
+
+            unanchored += 1
+            if fallback_files is None:
+                fallback_dir.mkdir(parents=True, exist_ok=True)
+                names = ["fallback.fastq.gz"] if not read2 else ["fallback_R1.fastq.gz", "fallback_R2.fastq.gz"]
+                fallback_files = [open_fastq(fallback_dir / name, "wt") for name in names]
+            write_fastq_record(fallback_files[0], *record1)
+            if record2 is not None:
+                write_fastq_record(fallback_files[1], *record2)
+    finally:
+        for f in fallback_files or []:
+            f.close()
+    return counts, reads_in_inputs, unanchored
+
+def build_allele_table(counts: Counter, reference: str) -> pd.DataFrame:
+    """Builds a CRISPResso style allele table from window allele counts. %Reads is left for
+        the caller to fill in once the aligned read total is known.
+    Args:
+        counts: the read count of each window allele
+        reference: the reference window
+    Returns:
+        pd.DataFrame: one row per allele, most common first
+    """
+    alleles = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    sequences = [allele for allele, _ in alleles]
+    encoded, _ = encode_sequences(sequences, len(reference))
+    reference_codes = np.frombuffer(reference.encode("ascii"), dtype=np.uint8)
+    return pd.DataFrame({
+        "Aligned_Sequence": sequences,
+        "Reference_Sequence": reference,
+        "Unedited": [allele == reference for allele in sequences],
+        "n_deleted": 0,
+        "n_inserted": 0,
+        "n_mutated": (encoded != reference_codes).sum(axis=1).astype(np.int64),
+        "#Reads": np.array([count for _, count in alleles], dtype=np.int64),
+        "%Reads": 0.0,
+    }, columns=ALLELE_TABLE_COLUMNS)
+
+def run_fallback(amplicon_list_row: AmpliconConfig,
+                 fallback_dir: Path,
+                 log_path: Path | None) -> tuple[pd.DataFrame | None, int, int]:
+    """Runs CRISPResso on the reads the direct engine could not anchor
+    Args:
+        amplicon_list_row: the AmpliconConfig object for the sample
+        fallback_dir: directory holding the unanchored reads, CRISPResso writes its output here
+        log_path: where CRISPResso's own output is written, None for the terminal
+    Returns:
+        tuple[pd.DataFrame | None, int, int]: CRISPResso's allele table, its reads after
+            preprocessing and its reads aligned. (None, 0, 0) if CRISPResso failed, e.g.
+            because none of the reads align
+    """
+    try:
+        run_crispresso(amplicon_list_row, fallback_dir, log_path, force=True)
+        crispresso_subfolder = crispresso_output_dir(fallback_dir)
+        allele_file = glob(str(crispresso_subfolder / "Alleles_frequency_table_around_sgRNA_*.txt"))[0]
+        reads_total, reads_aligned = read_mapping_counts(crispresso_subfolder / "CRISPResso_mapping_statistics.txt")
+        allele_table = read_allele_table(Path(allele_file))
+    except Exception as e:
+        logging.warning(f"CRISPResso failed on the unanchored reads in {fallback_dir}, "
+                        f"counting them as unaligned: {e}")
+        return None, 0, 0
+    return allele_table, reads_total, reads_aligned
+
+def merge_fallback_table(direct_table: pd.DataFrame, fallback_table: pd.DataFrame) -> pd.DataFrame:
+    """Adds CRISPResso's allele counts for the unanchored reads to the direct engine's table
+    Args:
+        direct_table: table from build_allele_table()
+        fallback_table: CRISPResso's Alleles_frequency_table_around_sgRNA table
+    Returns:
+        pd.DataFrame: one row per Aligned_Sequence with the #Reads of both tables summed,
+            most common first
+    """
+    fallback_table = fallback_table.reindex(columns=ALLELE_TABLE_COLUMNS)
+    combined = pd.concat([direct_table, fallback_table], ignore_index=True)
+    aggregations = {column: "first" for column in ALLELE_TABLE_COLUMNS[1:]}
+    aggregations["#Reads"] = "sum"
+    merged = combined.groupby("Aligned_Sequence", sort=False, as_index=False).agg(aggregations)
+    merged = merged.sort_values(by=["#Reads", "Aligned_Sequence"], ascending=[False, True], ignore_index=True)
+    return merged[ALLELE_TABLE_COLUMNS]
+
+def window_nucleotide_fractions(allele_table: pd.DataFrame, reference: str, reads_aligned: int) -> pd.DataFrame:
+    """Builds the Quantification_window_nucleotide_percentage_table from an allele table
+    Args:
+        allele_table: allele table with Aligned_Sequence and #Reads columns
+        reference: the reference window
+        reads_aligned: reads aligned to the amplicon, the denominator of every fraction
+    Returns:
+        pd.DataFrame: fraction of aligned reads with each base (rows) at each window position
+            (columns, labelled with the reference base as CRISPResso does)
+    """
+    matrix = AlleleMatrix.from_table(allele_table, len(reference), use_counts=True)
+    reads = matrix.weights * matrix.length_ok
+    fractions = [
+        ((matrix.alleles == ord(base)) * reads[:, None]).sum(axis=0) / max(reads_aligned, 1)
+        for base in QUANT_WINDOW_BASES
+    ]
+    return pd.DataFrame(np.array(fractions), index=QUANT_WINDOW_BASES, columns=list(reference))
+
+def run_direct(amplicon_list_row: AmpliconConfig,
+               sample_dir: Path,
+               log_path: Path | None = None,
+               force: bool = False) -> bool:
+    """Runs the direct engine on a sample, writing a CRISPResso_on_<sample> folder with the allele
+        table, mapping statistics and quantification window Stage 2 reads. Samples the engine
+        cannot handle (see protospacer_anchors()) are run through CRISPResso instead.
+    Args:
+        amplicon_list_row: the AmpliconConfig object that was associated with the sample
+        sample_dir: the directory path of the current sample
+        log_path: where the fallback CRISPResso run's output is written, None for the terminal
+        force: rerun even when the saved fingerprint matches
+    Returns:
+        bool: True if the sample was run, False if it was a cache hit
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out R1/R2 and lanes, or R1/R2 read counts differ
+    """
+    anchors = protospacer_anchors(amplicon_list_row)
+    if anchors is None:
+        logging.info(f"Direct engine does not apply to {sample_dir.name} — running CRISPResso")
+        return run_crispresso(amplicon_list_row, sample_dir, log_path, force=force)
+
+    def produce(scratch_dir: Path, read1: list[str], read2: list[str], fingerprint: dict) -> Path:
+        # inside the scratch directory, so the unanchored reads and their CRISPResso run go with it
+        fallback_dir = scratch_dir / FALLBACK_DIR
+        counts, reads_in_inputs, unanchored = tally_windows(read1, read2, anchors, fallback_dir)
+        reference = anchors[1]
+        allele_table = build_allele_table(counts, reference)
+        reads_total = reads_aligned = reads_in_inputs - unanchored
+        logging.info(f"{sample_dir.name}: {reads_aligned} of {reads_in_inputs} reads anchored directly")
+
+        if unanchored:
+            fallback_table, fallback_total, fallback_aligned = run_fallback(amplicon_list_row, fallback_dir, log_path)
+            if fallback_table is None:
+                reads_total += unanchored
+            else:
+                reads_total += fallback_total
+                reads_aligned += fallback_aligned
+                allele_table = merge_fallback_table(allele_table, fallback_table)
+        allele_table["%Reads"] = allele_table["#Reads"] / max(reads_aligned, 1) * 100
+
+        output_dir = crispresso_output_dir(scratch_dir)
+        output_dir.mkdir()
+        write_allele_table(output_dir / f"Alleles_frequency_table_around_sgRNA_{amplicon_list_row.protospacer}.txt", allele_table)
+        write_mapping_stats(output_dir / "CRISPResso_mapping_statistics.txt", reads_in_inputs, reads_total, reads_aligned)
+        write_quant_window(output_dir / "Quantification_window_nucleotide_percentage_table.txt",
+                           window_nucleotide_fractions(allele_table, reference, reads_aligned))
+        return output_dir
+
+    return run_engine(amplicon_list_row, sample_dir, produce, DIRECT_DIR, engine="direct", force=force)
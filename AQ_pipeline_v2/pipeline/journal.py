@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+# Append-only run journal -> one JSON line per sample state change, so an interrupted
+# stage can be resumed from where it stopped
+
+MATCHED = "matched"
+CRISPRESSO_DONE = "crispresso_done"
+QUANTIFIED = "quantified"
+FAILED = "failed"
+
+
+def _to_json_value(value):
+    """json.dumps fallback - converts numpy scalars (np.int64 etc.) to plain python values"""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class RunJournal:
+    """Append-only journal of each sample's progress through a pipeline stage.
+    Every state change is written as one JSON line and flushed to disk straight away,
+    so the journal survives the process being killed (OOM, SSH drop, preemption).
+    Attributes:
+        path: location of the journal file
+        entries: the most recent journal entry for each sample, keyed by sample name
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        """Opens the journal for a run
+        Args:
+            path: location of the journal file
+            resume: when True, existing entries are loaded and new ones appended. When
+                False the journal is started fresh and any previous run's entries are discarded.
+        """
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            self._load()
+        elif not resume:
+            self.path.write_text("", encoding="utf-8")
+
+    def _load(self) -> None:
+        """Reads the existing journal, keeping the last entry for each sample. A partially
+            written final line (the process died mid-write) is ignored."""
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring unreadable line {line_number} in {self.path}")
+                    continue
+                self.entries[entry["sample"]] = entry
+
+    def record(self, sample: str, state: str, **details) -> None:
+        """Appends a state change for a sample
+        Args:
+            sample: the sample directory name
+            state: one of MATCHED, CRISPRESSO_DONE, QUANTIFIED or FAILED
+            **details: any extra JSON-serializable information to keep with the entry
+        """
+        entry = {"sample": sample, "state": state, **details}
+        line = json.dumps(entry, default=_to_json_value) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[sample] = entry
+
+    def state(self, sample: str) -> str | None:
+        """Returns the latest recorded state of a sample, None if it has no entries"""
+        entry = self.entries.get(sample)
+        return entry["state"] if entry else None
@@ -0,0 +1,190 @@
+import hashlib
+import json
+from glob import glob
+from pathlib import Path
+import pandas as pd
+from config import AmpliconConfig
+from loaders.crispresso_output import (read_allele_table, read_editing_frequency_table, read_mapping_table,
+                                       read_quant_window, write_allele_table, write_editing_frequency_table,
+                                       write_mapping_stats, write_quant_window)
+
+# Combines the CRISPResso outputs of several runs over disjoint reads of one sample (shards of a
+# large sample, or a sample and its top-up sequencing) into a single output that reads exactly
+# as if CRISPResso had been run on all the reads at once
+
+ALLELE_TABLE_PATTERN = "Alleles_frequency_table_around_sgRNA_*.txt"
+MAPPING_STATS_FILE = "CRISPResso_mapping_statistics.txt"
+QUANT_WINDOW_FILE = "Quantification_window_nucleotide_percentage_table.txt"
+EDITING_FREQUENCY_FILE = "CRISPResso_quantification_of_editing_frequency.txt"
+MERGE_RECORD_FILE = "merged_from.json"      # written into a merged output by CRISPResso_Merge.py
+ALLELE_KEYS = ["Aligned_Sequence", "Reference_Sequence"]
+
+
+def find_allele_table(crispresso_subfolder: Path) -> Path:
+    """Returns the Alleles_frequency_table_around_sgRNA_*.txt file of a CRISPResso_on_* folder
+    Raises:
+        FileNotFoundError: the folder does not hold exactly one allele table
+    """
+    matches = glob(str(crispresso_subfolder / ALLELE_TABLE_PATTERN))
+    if len(matches) != 1:
+        raise FileNotFoundError(f"Expected exactly one allele table in {crispresso_subfolder}, found {len(matches)}")
+    return Path(matches[0])
+
+def check_amplicon(crispresso_subfolders: list[Path], amplicon_row: AmpliconConfig) -> None:
+    """Checks that every output was run with the guide of amplicon_row and on its amplicon,
+        before outputs are merged
+    Args:
+        crispresso_subfolders: the CRISPResso_on_* folders to be merged
+        amplicon_row: the AmpliconConfig object the outputs should belong to
+    Raises:
+        FileNotFoundError: a folder does not hold exactly one allele table
+        ValueError: an output was run with another guide, or its reference window is not
+            part of the amplicon
+    """
+    prefix = ALLELE_TABLE_PATTERN.split("*")[0]
+    for subfolder in crispresso_subfolders:
+        allele_file = find_allele_table(subfolder)
+        guide = allele_file.stem[len(prefix):]
+        if guide.upper() != amplicon_row.protospacer.upper():
+            raise ValueError(f"{subfolder} was run with guide {guide}, not the {amplicon_row.name} "
+                             f"protospacer {amplicon_row.protospacer}")
+        references = read_allele_table(allele_file)["Reference_Sequence"]
+        if len(references) and references.iloc[0].replace("-", "").upper() not in amplicon_row.amplicon.upper():
+            raise ValueError(f"The reference window of {subfolder} is not part of the {amplicon_row.name} amplicon")
+
+def merge_allele_tables(allele_tables: list[pd.DataFrame], reads_aligned: int) -> pd.DataFrame:
+    """Sums the #Reads of alleles found in several allele tables and recomputes %Reads
+    Args:
+        allele_tables: Alleles_frequency_table_around_sgRNA tables with the same columns
+        reads_aligned: reads aligned over all the runs, the %Reads denominator
+    Returns:
+        pd.DataFrame: one row per (Aligned_Sequence, Reference_Sequence), most common first
+            (ties keep the order they were first seen in), with the columns of the first table
+    """
+    columns = list(allele_tables[0].columns)
+    aggregations = {column: "first" for column in columns if column not in ALLELE_KEYS}
+    aggregations["#Reads"] = "sum"
+    combined = pd.concat(allele_tables, ignore_index=True)
+    merged = combined.groupby(ALLELE_KEYS, sort=False, as_index=False).agg(aggregations)
+    merged["%Reads"] = merged["#Reads"] / max(reads_aligned, 1) * 100
+    merged = merged.sort_values(by="#Reads", ascending=False, kind="stable", ignore_index=True)
+    return merged[columns]
+
+def merge_mapping_stats(mapping_stats: list[dict[str, int]]) -> dict[str, int]:
+    """Sums the columns of several mapping statistics, as read by read_mapping_table()"""
+    return {column: sum(stats[column] for stats in mapping_stats) for column in mapping_stats[0]}
+
+def merge_quant_windows(quant_windows: list[pd.DataFrame], reads_aligned: list[int]) -> pd.DataFrame:
+    """Averages quantification windows weighted by each run's aligned reads, which is what the
+        window of a single run on all the reads holds (each cell is a fraction of aligned reads)
+    Args:
+        quant_windows: Quantification_window_nucleotide_percentage_table tables
+        reads_aligned: the aligned reads of each run, in the same order
+    Returns:
+        pd.DataFrame: the combined window
+    Raises:
+        ValueError: the windows do not cover the same bases and positions
+    """
+    first = quant_windows[0]
+    for quant_window in quant_windows[1:]:
+        if not (quant_window.index.equals(first.index) and list(quant_window.columns) == list(first.columns)):
+            raise ValueError("Quantification windows of the runs being merged do not match")
+    weighted = sum(quant_window.to_numpy() * aligned for quant_window, aligned in zip(quant_windows, reads_aligned))
+    return pd.DataFrame(weighted / max(sum(reads_aligned), 1), index=first.index, columns=first.columns)
+
+def merge_editing_frequencies(editing_frequencies: list[pd.DataFrame]) -> pd.DataFrame:
+    """Sums the read counts of several CRISPResso_quantification_of_editing_frequency tables
+        per amplicon and recomputes Unmodified% and Modified% from them
+    Args:
+        editing_frequencies: the tables, as read by read_editing_frequency_table()
+    Returns:
+        pd.DataFrame: the combined table, with the columns of the first table
+    """
+    columns = list(editing_frequencies[0].columns)
+    combined = pd.concat(editing_frequencies, ignore_index=True)
+    keys = ["Amplicon"] if "Amplicon" in columns else []
+    counts = [column for column in columns if column not in keys and not column.endswith("%")]
+    if keys:
+        merged = combined.groupby(keys, sort=False, as_index=False)[counts].sum()
+    else:
+        merged = combined[counts].sum().to_frame().T
+    aligned = merged["Reads_aligned"] if "Reads_aligned" in merged else merged["Unmodified"] + merged["Modified"]
+    for column in ("Unmodified", "Modified"):
+        if f"{column}%" in columns:
+            merged[f"{column}%"] = (merged[column] / aligned.clip(lower=1) * 100).round(8)
+    return merged[columns]
+
+def merge_crispresso_outputs(crispresso_subfolders: list[Path], output_dir: Path) -> None:
+    """Writes the allele table, mapping statistics, quantification window and (when present)
+        editing frequencies of several CRISPResso_on_* folders, combined, into output_dir.
+        These are the files quantify_sample() reads; CRISPResso's plots and other reports
+        are not merged.
+    Args:
+        crispresso_subfolders: the CRISPResso_on_* folders of runs over disjoint reads of one
+            sample, with the same amplicon and guide
+        output_dir: the folder the combined files are written to, created if needed
+    Raises:
+        FileNotFoundError: a folder is missing one of the files
+        ValueError: the folders hold allele tables for different guides, or windows that do
+            not match
+    """
+    allele_files = [find_allele_table(subfolder) for subfolder in crispresso_subfolders]
+    if len({path.name for path in allele_files}) != 1:
+        raise ValueError(f"Allele tables of the runs being merged are for different guides: "
+                         f"{sorted({path.name for path in allele_files})}")
+
+    mapping_stats = [read_mapping_table(subfolder / MAPPING_STATS_FILE) for subfolder in crispresso_subfolders]
+    merged_stats = merge_mapping_stats(mapping_stats)
+    reads_aligned = [stats["READS ALIGNED"] for stats in mapping_stats]
+    allele_table = merge_allele_tables([read_allele_table(path) for path in allele_files], merged_stats["READS ALIGNED"])
+    quant_window = merge_quant_windows([read_quant_window(subfolder / QUANT_WINDOW_FILE)
+                                        for subfolder in crispresso_subfolders], reads_aligned)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    write_allele_table(output_dir / allele_files[0].name, allele_table)
+    write_mapping_stats(output_dir / MAPPING_STATS_FILE,
+                        merged_stats["READS IN INPUTS"], merged_stats["READS AFTER PREPROCESSING"],
+                        merged_stats["READS ALIGNED"],
+                        [merged_stats.get(column, 0) for column in
+                         ("N_COMPUTED_ALN", "N_CACHED_ALN", "N_COMPUTED_NOTALN", "N_CACHED_NOTALN")])
+    write_quant_window(output_dir / QUANT_WINDOW_FILE, quant_window)
+    if all((subfolder / EDITING_FREQUENCY_FILE).exists() for subfolder in crispresso_subfolders):
+        write_editing_frequency_table(output_dir / EDITING_FREQUENCY_FILE, merge_editing_frequencies(
+            [read_editing_frequency_table(subfolder / EDITING_FREQUENCY_FILE) for subfolder in crispresso_subfolders]))
+
+def mapping_stats_digest(crispresso_subfolder: Path) -> str:
+    """Returns the sha256 of a CRISPResso_on_* folder's mapping statistics, which any later run
+        writing into the folder replaces"""
+    return hashlib.sha256((crispresso_subfolder / MAPPING_STATS_FILE).read_bytes()).hexdigest()
+
+def write_merge_record(output_dir: Path, crispresso_subfolders: list[Path]) -> None:
+    """Records which outputs a merged output was built from, with their read counts and the
+        digest of the merged mapping statistics
+    Args:
+        output_dir: the merged CRISPResso_on_* folder, already holding its mapping statistics
+        crispresso_subfolders: the CRISPResso_on_* folders that were merged
+    """
+    inputs = []
+    for subfolder in crispresso_subfolders:
+        stats = read_mapping_table(subfolder / MAPPING_STATS_FILE)
+        inputs.append({"path": str(subfolder.resolve()), "reads_in_inputs": stats["READS IN INPUTS"],
+                       "reads_aligned": stats["READS ALIGNED"]})
+    record = {"inputs": inputs, "digest": mapping_stats_digest(output_dir)}
+    (output_dir / MERGE_RECORD_FILE).write_text(json.dumps(record, indent=2), encoding="utf-8")
+
+def merge_record(crispresso_subfolder: Path) -> dict | None:
+    """Returns the merged_from.json written by write_merge_record(). The record only counts
+        while the mapping statistics are still the merged ones, so one left behind in a folder
+        that a later run wrote into is ignored.
+    Args:
+        crispresso_subfolder: the CRISPResso_on_* folder of the sample
+    Returns:
+        dict | None: the merged inputs, or None when the output is not a merge
+    """
+    record_path = crispresso_subfolder / MERGE_RECORD_FILE
+    if not record_path.exists() or not (crispresso_subfolder / MAPPING_STATS_FILE).exists():
+        return None
+    record = json.loads(record_path.read_text(encoding="utf-8"))
+    if record.get("digest") != mapping_stats_digest(crispresso_subfolder):
+        return None
+    return record
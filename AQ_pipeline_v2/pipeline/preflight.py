@@ -0,0 +1,84 @@
+import logging
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+from config import AmpliconConfig
+from pipeline.crispresso import AmpliconIndex, resolve_fastq_reads
+from utils.fastq import read_fastq_lanes
+from utils.kmers import KmerIndex
+
+# Pre-flight check that a sample's reads come from the amplicon its directory name matched,
+# run before Stage 1 spends any time on CRISPResso
+
+DEFAULT_PREFLIGHT_READS = 2000
+MIN_PREFLIGHT_FRACTION = 0.5    # share of the sampled reads that must support an amplicon
+
+
+def sample_read_support(sample_dir: Path,
+                        kmer_index: KmerIndex,
+                        n_reads: int) -> tuple[Counter, Counter, int]:
+    """Scores the first reads of a sample against every amplicon
+    Args:
+        sample_dir: the directory path of the sample
+        kmer_index: the KmerIndex of all amplicons in amplicon_list.csv
+        n_reads: how many reads to take from the start of read 1 (the first lane, mostly)
+    Returns:
+        tuple[Counter, Counter, int]: amplicon name -> reads for which it is a best scoring
+            candidate, amplicon name -> reads assigned to it alone, and the number of reads
+            sampled
+    """
+    _, read1_files, _ = resolve_fastq_reads(sample_dir)
+    supported = Counter()
+    assigned = Counter()
+    sampled = 0
+    for _, sequence, _ in islice(read_fastq_lanes(read1_files), n_reads):
+        sampled += 1
+        candidates = kmer_index.candidates(sequence.upper())
+        supported.update({config.name for config in candidates})
+        if candidates and len({config.amplicon.upper() for config in candidates}) == 1:
+            assigned[candidates[0].name] += 1           # same rule as KmerIndex.assign_read
+    return supported, assigned, sampled
+
+def preflight_amplicon(sample_dir: Path,
+                       amplicon_configs: AmpliconIndex,
+                       kmer_index: KmerIndex,
+                       n_reads: int = DEFAULT_PREFLIGHT_READS) -> AmpliconConfig:
+    """Matches a sample directory to its amplicon by name and confirms the match against
+        the sample's first reads, proposing the amplicon the reads come from otherwise. Each
+        of the first n_reads reads of read 1 is sampled at every READ_STRIDE-th k-mer, and the
+        k-mers are looked up in kmer_index, which holds both strands of every amplicon.
+    Args:
+        sample_dir: the directory path of the sample
+        amplicon_configs: index of all AmpliconConfig objects from amplicon_list.csv
+        kmer_index: the KmerIndex of the same amplicons
+        n_reads: how many reads to check
+    Returns:
+        AmpliconConfig: the name matched amplicon, once at least MIN_PREFLIGHT_FRACTION of
+            the sampled reads support it
+    Raises:
+        ValueError: no reads, or the name match is missing or not supported by the reads.
+            The message names the amplicon most reads were assigned to, if any
+    """
+    name_match = amplicon_configs.match(sample_dir.name)
+    supported, assigned, sampled = sample_read_support(sample_dir, kmer_index, n_reads)
+    if sampled == 0:
+        raise ValueError(f"Pre-flight: no reads found for {sample_dir.name}")
+
+    if name_match is not None:
+        support = supported[name_match.name] / sampled
+        if support >= MIN_PREFLIGHT_FRACTION:
+            logging.info(f"Pre-flight: {sample_dir.name} confirmed as {name_match.name} "
+                         f"({support:.0%} of {sampled} reads)")
+            return name_match
+        matched = f"matched {name_match.name} by name, but only {support:.0%} of {sampled} reads support it"
+    else:
+        matched = "matched no amplicon by name"
+
+    proposal = None
+    if assigned:
+        proposed_name, count = assigned.most_common(1)[0]
+        if count / sampled >= MIN_PREFLIGHT_FRACTION:
+            proposal = f"; reads look like {proposed_name} ({count / sampled:.0%}), rename the directory to include it"
+    if proposal is None:
+        proposal = f"; no amplicon is supported by at least {MIN_PREFLIGHT_FRACTION:.0%} of reads"
+    raise ValueError(f"Pre-flight: {sample_dir.name} {matched}{proposal}")
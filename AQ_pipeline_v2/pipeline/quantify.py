@@ -3,19 +3,51 @@ from glob import glob
 import pandas as pd
 import re
 import logging
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from config import AmpliconConfig
-from loaders.crispresso_output import read_mapping_stats, read_allele_table, read_quant_window, read_editing_frequency
-from utils.sequences import generate_search_sequences, generate_oneseq_search_sequences, reverse_complement
-from analysis.abe import calculate_correction, calculate_protospacer_metrics
-from analysis.oneseq import calculate_oneseq
-from analysis.heterozygous import calculate_het_correction, calculate_het_protospacer_metrics, find_het_position
+from loaders.crispresso_output import (ABE_ALLELE_COLUMNS, NUCLEASE_ALLELE_COLUMNS, iter_allele_table, read_mapping_stats,
+                                       read_allele_table, read_quant_window, read_editing_frequency)
+from loaders.table_cache import configure_table_cache, table_cache_settings
+from utils.sequences import generate_search_sequences, oneseq_search_pattern, reverse_complement
+from analysis.abe import calculate_abe_metrics
+from analysis.oneseq import calculate_oneseq_edits
+from analysis.heterozygous import find_het_position
 from analysis.nuclease import calculate_frameshift
+from pipeline.subsample import subsampling_factor
+from pipeline.validate import check_input_reads
 
 # Stage 2 -> parses CRISPResso outputs, calls analysis modules,
 # assembles final result
+
+# allele tables at least this large are streamed in chunks instead of loaded whole
+STREAM_ALLELE_TABLE_BYTES = 256 * 1024**2
+
+
+def summary_sample_name(sample_name: str) -> str:
+    """Returns the name a sample is reported under in the summary files - the fastq directory
+        name without any lane (_L001) and BaseSpace download (-ds.<id>) suffix"""
+    return re.sub(r'(_L\d{3})?-ds\..*', '', sample_name)
+
+def latest_crispresso_output_mtime(crispresso_dir: Path) -> float | None:
+    """Returns when the CRISPResso output a sample is quantified from last changed
+    Args:
+        crispresso_dir: the path to the crispresso directory
+    Returns:
+        float | None: the newest modification time of the files in the CRISPResso_on_* folder,
+            None if there is no such folder
+    """
+    mtimes = [
+        path.stat().st_mtime
+        for folder in crispresso_dir.glob("CRISPResso_on_*")
+        for path in folder.iterdir()
+        if path.is_file()
+    ]
+    return max(mtimes) if mtimes else None
+
 def quantify_abe_sample(amplicon_row: AmpliconConfig, 
                         sample_name: str,
-                        allele_table_df: pd.DataFrame,
+                        allele_table_df: pd.DataFrame | Iterable[pd.DataFrame],
                         reads_total: int,
                         reads_aligned: int) -> dict:
     """creates the dictionary for samples with ABE editing
@@ -23,6 +55,7 @@ def quantify_abe_sample(amplicon_row: AmpliconConfig,
         amplicon_row: the AmpliconConfig object for the given CRISPResso sample
         sample_name: name of the CRISPResso sample
         allele_table_df: the dataframe containing the allele frequency table information
+            (or an iterator over its chunks for a streamed table)
         reads_total: the number of total reads for a sample
         reads_aligned: the number of reads aligned to the given amplicon
     Returns:
@@ -36,17 +69,21 @@ def quantify_abe_sample(amplicon_row: AmpliconConfig,
         orientation=amplicon_row.orientation
     )
 
-    without_bystanders, with_bystanders = calculate_correction(allele_table_df, search_seqs)
-
-    any_AtoG, any_change = calculate_protospacer_metrics(
+    metrics = calculate_abe_metrics(
         allele_table_df,
+        search_seqs,
         amplicon_row.protospacer,
         amplicon_row.intended_edit,
-        amplicon_row.orientation
+        amplicon_row.orientation,
+        reads_aligned=reads_aligned
     )
+    without_bystanders = metrics["correction_without_bystanders"]
+    with_bystanders = metrics["correction_with_tolerated_bystanders"]
+    any_AtoG = metrics["correction_with_any_AtoG_change"]
+    any_change = metrics["correction_with_any_change_in_protospacer"]
 
     return {
-        "sample": re.sub(r'(_L\d{3})?-ds\..*', '', sample_name),
+        "sample": summary_sample_name(sample_name),
         "reads_total": reads_total, #B
         "reads_aligned": reads_aligned, #C
         "correction_without_bystanders": without_bystanders, #D
@@ -63,7 +100,7 @@ def quantify_abe_sample(amplicon_row: AmpliconConfig,
 
 def quantify_het_sample(amplicon_row: AmpliconConfig,
                         sample_name: str,
-                        allele_table_df: pd.DataFrame,
+                        allele_table_df: pd.DataFrame | Iterable[pd.DataFrame],
                         reads_total: int,
                         reads_aligned: int,
                         het_pos: list[int],
@@ -74,6 +111,7 @@ def quantify_het_sample(amplicon_row: AmpliconConfig,
         amplicon_row: the AmpliconConfig object for a given sample
         sample_name: the name of the current sample
         allele_table_df: the dataframe for the current sample's allele frequency table
+            (or an iterator over its chunks for a streamed table)
         reads_total: total number of reads in the current sample's fastq
         reads_aligned: total number of ALIGNED reads in the current sample's fastq
         het_pos: positions of the heterozygous differences, het_pos[0] is the primary het_pos,
@@ -112,36 +150,46 @@ def quantify_het_sample(amplicon_row: AmpliconConfig,
         orientation=amplicon_row.orientation
     )
 
-    het_correction_dict = calculate_het_correction(allele_table_df,
-                                                    search_seqs,
-                                                    het_pos,
-                                                    het_base1,
-                                                    het_base2)
-    
-    total_pct_allele1 = het_correction_dict.pop("total_pct_allele1")
-    total_pct_allele2 = het_correction_dict.pop("total_pct_allele2")
+    # one pass over the allele table for both the sample-wide and the per-allele metrics
+    metrics = calculate_abe_metrics(allele_table_df,
+                                    search_seqs,
+                                    amplicon_row.protospacer,
+                                    amplicon_row.intended_edit,
+                                    amplicon_row.orientation,
+                                    het_pos,
+                                    het_base1,
+                                    het_base2,
+                                    reads_aligned=reads_aligned)
+
+    total_pct_allele1 = metrics.pop("total_pct_allele1")
+    total_pct_allele2 = metrics.pop("total_pct_allele2")
     reads_aligned_allele1 = round(total_pct_allele1 / 100 * reads_aligned)
     reads_aligned_allele2 = round(total_pct_allele2 / 100 * reads_aligned)
 
-    het_protospacer_metrics_dict = calculate_het_protospacer_metrics(allele_table_df,
-                                                                     amplicon_row.protospacer,
-                                                                     amplicon_row.intended_edit,
-                                                                     amplicon_row.orientation,
-                                                                     het_pos,
-                                                                     het_base1,
-                                                                     het_base2)
+    without_bystanders = metrics.pop("correction_without_bystanders")
+    with_bystanders = metrics.pop("correction_with_tolerated_bystanders")
+    any_AtoG = metrics.pop("correction_with_any_AtoG_change")
+    any_change = metrics.pop("correction_with_any_change_in_protospacer")
 
-    without_bystanders, with_bystanders = calculate_correction(allele_table_df, search_seqs)
-
-    any_AtoG, any_change = calculate_protospacer_metrics(
-        allele_table_df,
-        amplicon_row.protospacer,
-        amplicon_row.intended_edit,
-        amplicon_row.orientation
-    )
+    het_correction_dict = {
+        key: metrics[key] for key in (
+            "correction_wo_bystanders_allele1",
+            "correction_w_bystanders_allele1",
+            "correction_wo_bystanders_allele2",
+            "correction_w_bystanders_allele2",
+        )
+    }
+    het_protospacer_metrics_dict = {
+        key: metrics[key] for key in (
+            "correction_with_any_AtoG_change_allele1",
+            "correction_with_any_change_in_protospacer_allele1",
+            "correction_with_any_AtoG_change_allele2",
+            "correction_with_any_change_in_protospacer_allele2",
+        )
+    }
 
     return {
-        "sample": re.sub(r'(_L\d{3})?-ds\..*', '', sample_name),
+        "sample": summary_sample_name(sample_name),
         "reads_total": reads_total, #B
         "reads_aligned": reads_aligned, #C
         "correction_without_bystanders": without_bystanders, #D
@@ -170,7 +218,7 @@ def quantify_het_sample(amplicon_row: AmpliconConfig,
 
 def quantify_oneseq_sample(amplicon_row: AmpliconConfig, 
                             sample_name: str,
-                            allele_table_df: pd.DataFrame,
+                            allele_table_df: pd.DataFrame | Iterable[pd.DataFrame],
                             reads_total: int,
                             reads_aligned: int) -> dict:
     """creates a dictionary containing relevant analytics about a given CRISPResso sample.
@@ -178,31 +226,33 @@ def quantify_oneseq_sample(amplicon_row: AmpliconConfig,
         amplicon_row: the AmpliconConfig object for the specific sample
         sample_name: the name of the sample analysis is being performed on
         allele_table_df: the dataframe containing the information from the Allele Frequency Table from a sample
+            (or an iterator over its chunks for a streamed table)
         reads_total: the number of total reads in a fastq
         reads_aligned: the number of reads that aligned in the fastq
     Returns:
         dict: returns a dictionary of all information from a given ONESEQ sample"""
-    first_10_seqs, full_seqs = generate_oneseq_search_sequences(
-        protospacer=amplicon_row.protospacer,
-        orientation=amplicon_row.orientation
+    # alleles are classified directly, the 2^n A to G combinations are never enumerated
+    first_10_pct, full_sequence_pct = calculate_oneseq_edits(
+        allele_table_df,
+        amplicon_row.protospacer,
+        amplicon_row.orientation,
+        reads_aligned=reads_aligned
     )
-
-    first_10_pct, full_sequence_pct = calculate_oneseq(allele_table_df, first_10_seqs, full_seqs)
     
     return {
-        "sample": re.sub(r'(_L\d{3})?-ds\..*', '', sample_name),
+        "sample": summary_sample_name(sample_name),
         "reads_total": reads_total,
         "reads_aligned": reads_aligned,
         "pct_AtoG_first_10bp": first_10_pct,
         "pct_AtoG_anywhere": full_sequence_pct,
         "guide_seq": amplicon_row.protospacer,
-        "search_sequences_first_10bp": ";".join(first_10_seqs),
-        "search_sequences_any": ";".join(full_seqs)
+        "search_sequences_first_10bp": oneseq_search_pattern(amplicon_row.protospacer, amplicon_row.orientation, first_n=10),
+        "search_sequences_any": oneseq_search_pattern(amplicon_row.protospacer, amplicon_row.orientation)
     }
 
 def quantify_nuclease_sample(amplicon_row: AmpliconConfig,
                              sample_name: str,
-                             allele_table_df: pd.DataFrame,
+                             allele_table_df: pd.DataFrame | Iterable[pd.DataFrame],
                              reads_total: int,
                              reads_aligned: int,
                              editing_freq: dict) -> dict:
@@ -211,13 +261,14 @@ def quantify_nuclease_sample(amplicon_row: AmpliconConfig,
         amplicon_row: the AmpliconConfig object for the specific sample
         sample_name: the name of the sample analysis is being performed on
         allele_table_df: the dataframe containing the information from the Allele Frequency Table from a sample
+            (or an iterator over its chunks for a streamed table)
         reads_total: the number of total reads in a fastq
         reads_aligned: the number of reads that aligned in the fastq
         editing_freq: the editing frequency data for the given CRISPResso sample
     Returns:
         dict: returns a dictionary of relevant information about the given nuclease sample"""
     
-    frameshift_states = calculate_frameshift(allele_table_df)
+    frameshift_states = calculate_frameshift(allele_table_df, reads_aligned)
     
     pct_frameshift_indels = frameshift_states["pct_frameshift_indels"]
     pct_inframe_indels = frameshift_states["pct_inframe_indels"]
@@ -229,7 +280,7 @@ def quantify_nuclease_sample(amplicon_row: AmpliconConfig,
     pct_substitution = round(editing_freq["substitutions"] / reads_aligned * 100, 2)
     
     return {
-        "sample": re.sub(r'(_L\d{3})?-ds\..*', '', sample_name),
+        "sample": summary_sample_name(sample_name),
         "reads_total": reads_total,
         "reads_aligned": reads_aligned,
         "pct_modified": pct_modified,
@@ -243,21 +294,30 @@ def quantify_nuclease_sample(amplicon_row: AmpliconConfig,
     }
 
 
-def quantify_sample(amplicon_row: AmpliconConfig, crispresso_dir: Path) -> dict:
+def quantify_sample(amplicon_row: AmpliconConfig,
+                    crispresso_dir: Path,
+                    stream_min_bytes: int = STREAM_ALLELE_TABLE_BYTES) -> dict:
     """the guiding path for the sample quantification, determined by what kind of editor
     Args:
         amplicon_row: the AmpliconConfig object for the given CRISPResso sample
         crispresso_dir: the path to the crispresso directory
+        stream_min_bytes: allele tables of at least this many bytes are streamed in chunks,
+            so peak memory does not grow with the table
     Returns:
         dict: the result dictionary passed through from the relevent analysis branch
     Raises:
         FileNotFoundError: no CRISPResso output folder found in the directory
+        ValueError: more than one CRISPResso output folder found in the directory
         ValueError: multiple allele tables found in the CRISPResso subfolder
+        ValueError: CRISPResso read fewer or more reads than Stage 1 validation counted
         ValueError: unknown editor type"""
     
     matches = glob(str(crispresso_dir / "CRISPResso_on_*"))
     if not matches:
         raise FileNotFoundError(f"No CRISPResso output folder found in {crispresso_dir}")
+    if len(matches) > 1:
+        raise ValueError(f"Expected one CRISPResso output folder in {crispresso_dir}, found "
+                         f"{', '.join(sorted(Path(match).name for match in matches))} — rerun Stage 1 with --force")
     crispresso_subfolder = Path(matches[0])
 
     allele_file_matches = glob(str(crispresso_subfolder / "Alleles_frequency_table_around_sgRNA_*.txt"))
@@ -269,8 +329,15 @@ def quantify_sample(amplicon_row: AmpliconConfig, crispresso_dir: Path) -> dict:
     stats_file = crispresso_subfolder / "CRISPResso_mapping_statistics.txt"
     
     reads_total, reads_aligned = read_mapping_stats(stats_file)
+    check_input_reads(crispresso_dir, stats_file)
 
-    allele_table_df = read_allele_table(allele_file)
+    # only the columns the editor's analysis reads are parsed
+    is_nuclease = amplicon_row.editor == "NUCLEASE" and amplicon_row.intended_edit != "ONESEQ"
+    columns = NUCLEASE_ALLELE_COLUMNS if is_nuclease else ABE_ALLELE_COLUMNS
+    if allele_file.stat().st_size >= stream_min_bytes:
+        allele_table_df = iter_allele_table(allele_file, columns)
+    else:
+        allele_table_df = read_allele_table(allele_file, columns)
 
     if amplicon_row.intended_edit == "ONESEQ":
         results_dict = quantify_oneseq_sample(amplicon_row, crispresso_dir.name, allele_table_df, reads_total, reads_aligned)
@@ -287,4 +354,43 @@ def quantify_sample(amplicon_row: AmpliconConfig, crispresso_dir: Path) -> dict:
     else:
         raise ValueError(f"Unknown editor type: {amplicon_row.editor}")
 
+    # reads_total of a --max-reads run counts the sampled reads only
+    factor = subsampling_factor(crispresso_subfolder)
+    if factor is not None:
+        results_dict["subsampling_factor"] = round(factor, 4)
     return results_dict
+
+
+def quantify_samples(jobs: list[tuple[Path, AmpliconConfig]],
+                     workers: int = 1) -> Iterator[tuple[Path, dict | Exception]]:
+    """Runs quantify_sample over many samples, fanning them out over a process pool
+        when workers > 1. Each sample is independent, so the pool scales with cores.
+    Args:
+        jobs: (sample directory, matched AmpliconConfig) pairs to quantify
+        workers: number of worker processes, 1 runs every sample in this process
+    Yields:
+        tuple[Path, dict | Exception]: each sample directory as it finishes, with its
+            result dictionary or the exception it failed with. With workers > 1 samples
+            finish in no particular order, callers sort the results themselves.
+    """
+    if workers == 1:
+        for sample_dir, config in jobs:
+            logging.info(f"Processing {sample_dir.name}")
+            try:
+                yield sample_dir, quantify_sample(config, sample_dir)
+            except Exception as e:
+                yield sample_dir, e
+        return
+
+    # workers use the same table cache as this process, whatever the multiprocessing start method
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure_table_cache,
+                             initargs=table_cache_settings()) as executor:
+        futures = {}
+        for sample_dir, config in jobs:
+            logging.info(f"Processing {sample_dir.name}")
+            futures[executor.submit(quantify_sample, config, sample_dir)] = sample_dir
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
@@ -0,0 +1,90 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import zip_longest
+from pathlib import Path
+from config import AmpliconConfig
+from pipeline.crispresso import crispresso_output_dir, resolve_fastq_reads, run_crispresso, run_engine
+from pipeline.merge import merge_crispresso_outputs
+from utils.fastq import open_fastq, read_fastq_lanes, write_fastq_record
+
+# Stage 1 sharding -> a large sample is split into K shards that CRISPResso runs on in parallel,
+# and the shards' outputs are merged back into one CRISPResso_on_<sample> folder
+
+SHARD_DIR = "shards"
+
+
+def shard_sample(sample_dir: Path, shard_root: Path, n_shards: int) -> list[Path]:
+    """Deals a sample's reads (read pairs, kept together) round robin into n_shards sample
+        directories, <shard_root>/shard_<i>/<sample>_shard_<i>_R1_001.fastq.gz, in one pass
+    Args:
+        sample_dir: the directory path of the sample
+        shard_root: the directory the shard directories are created in
+        n_shards: how many shards to write
+    Returns:
+        list[Path]: the shard directories
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: R1 and R2 hold different numbers of reads, or a record is malformed
+    """
+    _, read1_files, read2_files = resolve_fastq_reads(sample_dir)
+    shard_dirs = [shard_root / f"shard_{i}" for i in range(1, n_shards + 1)]
+    with ExitStack() as stack:
+        writers = []
+        for shard_dir in shard_dirs:
+            shard_dir.mkdir(parents=True)
+            writers.append([
+                stack.enter_context(open_fastq(shard_dir / f"{sample_dir.name}_{shard_dir.name}_R{read}_001.fastq.gz", "wt"))
+                for read in ((1, 2) if read2_files else (1,))
+            ])
+        records2 = read_fastq_lanes(read2_files) if read2_files else iter(())
+        for index, (record1, record2) in enumerate(zip_longest(read_fastq_lanes(read1_files), records2)):
+            if record1 is None or (read2_files and record2 is None):
+                raise ValueError(f"R1 and R2 of {sample_dir.name} hold different numbers of reads")
+            shard_writers = writers[index % n_shards]
+            write_fastq_record(shard_writers[0], *record1)
+            if record2 is not None:
+                write_fastq_record(shard_writers[1], *record2)
+    return shard_dirs
+
+def run_sharded(amplicon_list_row: AmpliconConfig,
+                sample_dir: Path,
+                log_path: Path | None = None,
+                force: bool = False,
+                n_shards: int = 2) -> bool:
+    """Splits a sample into n_shards, runs CRISPResso on all shards at once, and merges their
+        allele tables, mapping statistics, quantification windows and editing frequencies
+        into CRISPResso_on_<sample>, so quantify_sample() reads it like any other run
+    Args:
+        amplicon_list_row: the AmpliconConfig object that was associated with the sample
+        sample_dir: the directory path of the current sample
+        log_path: where CRISPResso's own output is written; each shard writes to its own
+            file next to it (<log>.shard_<i>.log). None for the terminal
+        force: rerun even when the saved fingerprint matches
+        n_shards: how many CRISPResso processes to split the sample over
+    Returns:
+        bool: True if the sample was run, False if it was a cache hit
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out R1/R2 and lanes from the fastq file names, R1 and R2
+            hold different numbers of reads, or a record is malformed
+        RuntimeError / subprocess.CalledProcessError: CRISPResso failed on a shard
+    """
+    def shard_log(shard_dir: Path) -> Path | None:
+        return log_path.with_name(f"{log_path.stem}.{shard_dir.name}.log") if log_path is not None else None
+
+    def produce(shard_root: Path, read1_files: list[str], read2_files: list[str], fingerprint: dict) -> Path:
+        shard_dirs = shard_sample(sample_dir, shard_root, n_shards)
+        logging.info(f"{sample_dir.name}: split into {n_shards} shards")
+
+        with ThreadPoolExecutor(max_workers=n_shards) as executor:
+            futures = [executor.submit(run_crispresso, amplicon_list_row, shard_dir, shard_log(shard_dir), True)
+                       for shard_dir in shard_dirs]
+            for future in futures:
+                future.result()
+
+        output = crispresso_output_dir(shard_root)
+        merge_crispresso_outputs([crispresso_output_dir(shard_dir) for shard_dir in shard_dirs], output)
+        return output
+
+    return run_engine(amplicon_list_row, sample_dir, produce, SHARD_DIR, engine=f"shards:{n_shards}", force=force)
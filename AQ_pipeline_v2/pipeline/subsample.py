@@ -0,0 +1,162 @@
+import json
+import logging
+import math
+import random
+import shutil
+from itertools import zip_longest
+from pathlib import Path
+from config import AmpliconConfig
+from pipeline.crispresso import (FINGERPRINT_FILE, crispresso_output_dir, resolve_fastq_reads, run_crispresso,
+                                 run_engine)
+from utils.fastq import open_fastq, read_fastq_lanes, write_fastq_record
+
+# Stage 1 --max-reads mode -> a fixed size random sample of each sample's reads is run through
+# CRISPResso for quick-look QC, and the sampling is recorded so Stage 2 can report it
+
+SUBSAMPLE_DIR = "subsampled"
+SUBSAMPLE_FILE = "subsample.json"       # written into the CRISPResso_on_* folder it describes
+SUBSAMPLE_SEED = 20240601               # fixed, so a rerun picks the same reads
+
+
+def reservoir_sample(records, max_reads: int, seed: int = SUBSAMPLE_SEED) -> tuple[list, int]:
+    """Draws a uniform random sample of max_reads items from a stream in a single pass,
+        holding no more than max_reads of them at a time (Li's Algorithm L, which skips ahead
+        between replacements instead of drawing a random number for every item)
+    Args:
+        records: any iterable, e.g. fastq records or (R1, R2) record pairs
+        max_reads: the sample size
+        seed: seed of the random number generator
+    Returns:
+        tuple[list, int]: the sampled items in their original order, and the number of items
+            in the stream
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    next_pick = None                # set once the reservoir is full
+    weight = math.exp(math.log(rng.random()) / max_reads)
+    total = 0
+    for index, record in enumerate(records):
+        total = index + 1
+        if index < max_reads:
+            reservoir.append((index, record))
+        elif index == next_pick:
+            reservoir[rng.randrange(max_reads)] = (index, record)
+            weight *= math.exp(math.log(rng.random()) / max_reads)
+            next_pick += math.floor(math.log(rng.random()) / math.log(1 - weight)) + 1
+        if index == max_reads - 1:
+            next_pick = index + math.floor(math.log(rng.random()) / math.log(1 - weight)) + 1
+    reservoir.sort(key=lambda item: item[0])
+    return [record for _, record in reservoir], total
+
+def subsample_sample(sample_dir: Path, output_dir: Path, max_reads: int) -> tuple[int, int]:
+    """Writes a random sample of a sample's reads (read pairs for paired end samples, which
+        stay together) to <output_dir>/<sample>_R1_001.fastq.gz and _R2_001.fastq.gz
+    Args:
+        sample_dir: the directory path of the sample
+        output_dir: the directory the sampled fastqs are written to
+        max_reads: how many reads (pairs) to keep
+    Returns:
+        tuple[int, int]: the number of reads kept and the number of reads in the sample
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: R1 and R2 hold different numbers of reads, or a record is malformed
+    """
+    _, read1_files, read2_files = resolve_fastq_reads(sample_dir)
+
+    def pairs():
+        if not read2_files:
+            yield from ((record, None) for record in read_fastq_lanes(read1_files))
+            return
+        for record1, record2 in zip_longest(read_fastq_lanes(read1_files), read_fastq_lanes(read2_files)):
+            if record1 is None or record2 is None:
+                raise ValueError(f"R1 and R2 of {sample_dir.name} hold different numbers of reads")
+            yield record1, record2
+
+    sampled, total = reservoir_sample(pairs(), max_reads)
+    reads = [1, 2] if read2_files else [1]
+    for read in reads:
+        with open_fastq(output_dir / f"{sample_dir.name}_R{read}_001.fastq.gz", "wt") as f:
+            for pair in sampled:
+                write_fastq_record(f, *pair[read - 1])
+    return len(sampled), total
+
+def subsample_record(crispresso_subfolder: Path) -> dict | None:
+    """Returns the subsample.json written by run_subsampled(). The record only counts while
+        the sample's fingerprint is still the one of the subsampled run, so one left behind in
+        a folder that a later run (e.g. from before outputs were named after the sample) wrote
+        into is ignored.
+    Args:
+        crispresso_subfolder: the CRISPResso_on_* folder of the sample
+    Returns:
+        dict | None: max_reads, seed, reads_sampled and reads_in_sample, or None when the
+            output is from a run on all reads
+    """
+    record_path = crispresso_subfolder / SUBSAMPLE_FILE
+    fingerprint_path = crispresso_subfolder.parent / FINGERPRINT_FILE
+    if not record_path.exists() or not fingerprint_path.exists():
+        return None
+    record = json.loads(record_path.read_text(encoding="utf-8"))
+    if record.get("digest") != json.loads(fingerprint_path.read_text(encoding="utf-8")).get("digest"):
+        return None
+    return record
+
+def subsampling_factor(crispresso_subfolder: Path) -> float | None:
+    """Returns how many of the sample's reads each read CRISPResso saw stands for in a
+        --max-reads run, i.e. reads in the sample / reads sampled
+    Args:
+        crispresso_subfolder: the CRISPResso_on_* folder of the sample
+    Returns:
+        float | None: the factor, or None when the output is from a run on all reads
+    """
+    record = subsample_record(crispresso_subfolder)
+    if record is None:
+        return None
+    return record["reads_in_sample"] / record["reads_sampled"]
+
+def run_subsampled(amplicon_list_row: AmpliconConfig,
+                   sample_dir: Path,
+                   log_path: Path | None = None,
+                   force: bool = False,
+                   max_reads: int = 10000) -> bool:
+    """Runs CRISPResso on a random sample of at most max_reads of a sample's reads, drawn with
+        a fixed seed, and records the sampling in subsample.json next to CRISPResso's output
+    Args:
+        amplicon_list_row: the AmpliconConfig object that was associated with the sample
+        sample_dir: the directory path of the current sample
+        log_path: where CRISPResso's own output is written, None for the terminal
+        force: rerun even when the saved fingerprint matches
+        max_reads: how many reads (pairs) CRISPResso gets
+    Returns:
+        bool: True if the sample was run, False if it was a cache hit
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: unable to work out R1/R2 and lanes from the fastq file names, R1 and R2
+            hold different numbers of reads, or a record is malformed
+        FileExistsError: the sample already has output from a run on all of its reads, which
+            is only replaced with force
+    """
+    for existing in sample_dir.glob("CRISPResso_on_*"):
+        if not force and subsample_record(existing) is None:
+            raise FileExistsError(f"{existing} holds a run on all reads of {sample_dir.name} — "
+                                  f"rerun with --force to replace it with a subsampled run")
+
+    def produce(subsample_dir: Path, read1_files: list[str], read2_files: list[str], fingerprint: dict) -> Path:
+        sampled, total = subsample_sample(sample_dir, subsample_dir, max_reads)
+        if total == 0:
+            shutil.rmtree(subsample_dir)
+            raise ValueError(f"No reads found in the fastqs of {sample_dir.name}")
+        logging.info(f"{sample_dir.name}: {sampled} of {total} reads sampled for CRISPResso")
+
+        run_crispresso(amplicon_list_row, subsample_dir, log_path, force=True)
+        crispresso_subfolder = crispresso_output_dir(subsample_dir)
+        (crispresso_subfolder / SUBSAMPLE_FILE).write_text(json.dumps({
+            "max_reads": max_reads,
+            "seed": SUBSAMPLE_SEED,
+            "reads_sampled": sampled,
+            "reads_in_sample": total,
+            "digest": fingerprint["digest"],
+        }, indent=2), encoding="utf-8")
+        return crispresso_subfolder
+
+    return run_engine(amplicon_list_row, sample_dir, produce, SUBSAMPLE_DIR,
+                      engine=f"subsample:{max_reads}:{SUBSAMPLE_SEED}", force=force)
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+from pathlib import Path
+from loaders.crispresso_output import read_input_reads
+from pipeline.crispresso import resolve_fastq_reads
+from pipeline.merge import merge_record
+from pipeline.subsample import subsample_record
+from utils.fastq import count_fastq_records
+
+# Stage 1 pre-flight validation of a sample's fastqs: every record is checked and counted
+# before CRISPResso starts, and the counts are kept so Stage 2 can check CRISPResso read them all
+
+READ_COUNTS_FILE = "read_counts.json"
+
+
+def _file_key(path: str | Path) -> dict:
+    """Size and modification time of a fastq, to tell whether its recorded count still applies"""
+    stat = os.stat(path)
+    return {"name": Path(path).name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def validate_sample(sample_dir: Path) -> int:
+    """Checks every record of a sample's fastqs, counts its reads, and saves the counts to
+        read_counts.json in the sample directory
+    Args:
+        sample_dir: the directory path of the sample
+    Returns:
+        int: the number of reads (read pairs for paired end samples)
+    Raises:
+        FileNotFoundError: no fastq files found in the sample directory
+        ValueError: a fastq is truncated or malformed, R1 and R2 hold different numbers of
+            reads, or the sample has no reads at all
+    """
+    _, read1_files, read2_files = resolve_fastq_reads(sample_dir)
+    files = []
+    reads = 0
+    for read1, read2 in zip(read1_files, read2_files or [None] * len(read1_files)):
+        count = count_fastq_records(read1)
+        files.append({**_file_key(read1), "reads": count})
+        if read2 is not None:
+            count2 = count_fastq_records(read2)
+            if count2 != count:
+                raise ValueError(f"{Path(read1).name} holds {count} reads but {Path(read2).name} holds {count2}")
+            files.append({**_file_key(read2), "reads": count2})
+        reads += count
+    if reads == 0:
+        raise ValueError(f"No reads found in the fastqs of {sample_dir.name}")
+
+    (sample_dir / READ_COUNTS_FILE).write_text(json.dumps({"reads": reads, "fastqs": files}, indent=2), encoding="utf-8")
+    logging.info(f"Validated {sample_dir.name}: {reads} reads in {len(files)} fastq files")
+    return reads
+
+def recorded_read_count(sample_dir: Path) -> int | None:
+    """Returns the read count saved by validate_sample()
+    Args:
+        sample_dir: the directory path of the sample
+    Returns:
+        int | None: the number of reads, or None when the sample was not validated or its
+            fastqs have changed since
+    """
+    try:
+        recorded = json.loads((sample_dir / READ_COUNTS_FILE).read_text(encoding="utf-8"))
+        for entry in recorded["fastqs"]:
+            key = {k: entry[k] for k in ("name", "size", "mtime_ns")}
+            if _file_key(sample_dir / entry["name"]) != key:
+                return None
+        return int(recorded["reads"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def check_input_reads(sample_dir: Path, stats_file: Path) -> None:
+    """Cross-checks CRISPResso's READS IN INPUTS against the validated read count, so a run
+        that stopped reading its input early is not quantified as if it were complete.
+        Samples that were not validated pass unchecked. For a --max-reads run, the reads
+        counted while sampling are checked instead, and CRISPResso must have read the sample.
+        Outputs merged by CRISPResso_Merge.py hold reads from other fastqs and pass unchecked,
+        as long as their mapping statistics are still the merged ones.
+    Args:
+        sample_dir: the directory path of the sample
+        stats_file: the sample's CRISPResso_mapping_statistics.txt
+    Raises:
+        ValueError: CRISPResso read a different number of reads than the fastqs hold
+    """
+    expected = recorded_read_count(sample_dir)
+    if expected is None or merge_record(stats_file.parent) is not None:
+        return
+    subsample = subsample_record(stats_file.parent)
+    if subsample is not None:
+        if subsample["reads_in_sample"] != expected:
+            raise ValueError(f"{subsample['reads_in_sample']} reads were sampled from for {sample_dir.name}, "
+                             f"but its fastqs hold {expected} — rerun Stage 1 with --force")
+        expected = subsample["reads_sampled"]
+    reads_in_inputs = read_input_reads(stats_file)
+    if reads_in_inputs != expected:
+        raise ValueError(f"CRISPResso read {reads_in_inputs} reads for {sample_dir.name}, "
+                         f"but its fastqs hold {expected} — rerun Stage 1 with --force")
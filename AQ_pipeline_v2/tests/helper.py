@@ -1,7 +1,11 @@
 import pandas as pd
 from utils.sequences import reverse_complement
 from pathlib import Path
+from collections import Counter
 import gzip
+import zipfile
+from config import AmpliconConfig
+from pipeline.direct import window_nucleotide_fractions
 
 
 def make_quant_window(protospacer: str, 
@@ -174,4 +178,125 @@ def make_nuclease_fastq_gz(path: Path,
                 f.write(f"{edited}\n")
                 f.write("+\n")
                 f.write(f"{'I' * len(edited)}\n")
-                read_counter += 1
\ No newline at end of file
+                read_counter += 1
+
+# Stage 1 engine fixtures - the TEST1 amplicon, reads of each kind of edit, and a stand-in for
+# run_crispresso that writes the tables Stage 2 reads
+
+LEFT = "CCTTTTTTTAGATGGCGCTCATTGTGCCTGGCAACTGGTAGCTGGAGGACAGTAC"
+RIGHT = "TGGGCTTGGATCCATGTCTGATGTACTGTGTGCAGCAAGACCTCAATCCTTTGGGTGTATGGGTCG"
+PROTOSPACER = "TGTATACCCCCGAACTGTGA"
+AMPLICON = LEFT + PROTOSPACER + RIGHT
+EDITED = PROTOSPACER[:5] + "G" + PROTOSPACER[6:]
+
+
+def make_config(orientation: str = "F",
+                editor: str = "ABE",
+                amplicon: str | None = None,
+                name: str = "TEST1",
+                protospacer: str = PROTOSPACER,
+                intended_edit: int = 6,
+                tolerated_edits: list[int] | None = None) -> AmpliconConfig:
+    """helper function for tests, makes an AmpliconConfig. By default the TEST1 ABE amplicon,
+    LEFT + protospacer + RIGHT, with the protospacer reverse complemented for R orientation
+    Returns:
+        AmpliconConfig: the config"""
+    if amplicon is None:
+        amplicon = LEFT + (protospacer if orientation == "F" else reverse_complement(protospacer)) + RIGHT
+    return AmpliconConfig(name=name, protospacer=protospacer, editor=editor, orientation=orientation,
+                          amplicon=amplicon, intended_edit=intended_edit,
+                          tolerated_edits=[14] if tolerated_edits is None else tolerated_edits, note="")
+
+def write_fastq(path: Path, sequences: list[str]) -> Path:
+    """helper function for tests, writes sequences as a gzipped fastq with read_<i> names
+    Returns:
+        Path: the fastq path"""
+    with gzip.open(path, "wt") as f:
+        for i, sequence in enumerate(sequences):
+            f.write(f"@read_{i}\n{sequence}\n+\n{'I' * len(sequence)}\n")
+    return path
+
+# (aligned, reference) over the whole amplicon for each kind of read, as CRISPResso would align it
+ALIGNMENTS = {
+    "unedited": (AMPLICON, AMPLICON),
+    "edited": (LEFT + EDITED + RIGHT, AMPLICON),
+    "bystander": (LEFT + EDITED[:13] + "G" + EDITED[14:] + RIGHT, AMPLICON),
+    "deletion": (LEFT + PROTOSPACER[:8] + "---" + PROTOSPACER[11:] + RIGHT, AMPLICON),
+    "insertion": (LEFT + PROTOSPACER[:10] + "AA" + PROTOSPACER[10:] + RIGHT, LEFT + PROTOSPACER[:10] + "--" + PROTOSPACER[10:] + RIGHT),
+}
+UNALIGNED = "ACGT" * 30
+
+def read_of(kind: str) -> str:
+    """helper function for tests, the read sequenced for one of the ALIGNMENTS"""
+    return ALIGNMENTS[kind][0].replace("-", "")
+
+def write_fake_output(fastq: Path, output: Path, break_window_table: bool = False) -> None:
+    """helper function for tests, 'aligns' the reads of a fastq through ALIGNMENTS and writes the
+    tables Stage 2 reads plus the full allele table into output, at whatever depth the fastq has"""
+    by_read = {aligned.replace("-", ""): (aligned, reference) for aligned, reference in ALIGNMENTS.values()}
+    with gzip.open(fastq, "rt") as f:
+        reads = f.read().splitlines()[1::4]
+    aligned = Counter(by_read[read] for read in reads if read in by_read)
+    output.mkdir()
+    (output / "CRISPResso_mapping_statistics.txt").write_text(
+        "READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n"
+        f"{len(reads)}\t{len(reads)}\t{sum(aligned.values())}\n")
+    full = pd.DataFrame([(a, r, n) for (a, r), n in aligned.items()], columns=["Aligned_Sequence", "Reference_Sequence", "#Reads"])
+    with zipfile.ZipFile(output / "Alleles_frequency_table.zip", "w") as z:
+        z.writestr("Alleles_frequency_table.txt", full.to_csv(sep="\t", index=False))
+
+    windows = Counter()
+    for (a, r), n in aligned.items():
+        columns = [c for c, base in enumerate(r) if base != "-"]
+        first, last = columns[len(LEFT)], columns[len(LEFT) + len(PROTOSPACER) - 1] + 1
+        windows[a[first:last], r[first:last]] += n
+    if break_window_table:
+        windows[PROTOSPACER, PROTOSPACER] += 1
+    total = sum(aligned.values())
+    table = pd.DataFrame([
+        (a, r, a == r, a.count("-"), r.count("-"), sum(x != y for x, y in zip(a, r) if "-" not in (x, y)), n, n / total * 100)
+        for (a, r), n in sorted(windows.items(), key=lambda item: -item[1])
+    ], columns=["Aligned_Sequence", "Reference_Sequence", "Unedited", "n_deleted", "n_inserted", "n_mutated", "#Reads", "%Reads"])
+    table.to_csv(output / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt", sep="\t", index=False)
+
+    projected = pd.DataFrame({
+        "Aligned_Sequence": ["".join(x for x, y in zip(a, r) if y != "-") for a, r in windows],
+        "#Reads": list(windows.values()),
+    })
+    window_nucleotide_fractions(projected, PROTOSPACER, total).to_csv(
+        output / "Quantification_window_nucleotide_percentage_table.txt", sep="\t")
+
+def fake_crispresso(calls: list, break_window_table: bool = False):
+    """stands in for run_crispresso - writes the output of write_fake_output() for the sample's
+    only fastq into CRISPResso_on_<sample>"""
+    def run(amplicon_list_row, sample_dir, log_path=None, force=False):
+        calls.append(sample_dir)
+        fastq, = sample_dir.glob("*.fastq.gz")
+        write_fake_output(fastq, sample_dir / f"CRISPResso_on_{sample_dir.name}", break_window_table)
+        return True
+    return run
+
+def write_sample(root: Path, name: str, reads: list[str], paired: bool = False) -> Path:
+    """helper function for tests, makes a Stage 1 sample directory holding the reads as
+    <name>_R1_001.fastq.gz (and an identical R2 when paired)
+    Returns:
+        Path: the sample directory"""
+    sample_dir = root / name
+    sample_dir.mkdir()
+    for read in (1, 2) if paired else (1,):
+        write_fastq(sample_dir / f"{name}_R{read}_001.fastq.gz", reads)
+    return sample_dir
+
+SAMPLE_READS = (
+    [read_of("unedited")] * 400 + [read_of("edited")] * 250 + [read_of("bystander")] * 150
+    + [read_of("deletion")] * 60 + [read_of("insertion")] * 40 + [UNALIGNED] * 100
+)
+
+def crispresso_output(sample_dir: Path):
+    """helper function for tests, reads back the allele table, mapping statistics and
+    quantification window of a sample's only CRISPResso_on_* folder"""
+    output, = sample_dir.glob("CRISPResso_on_*")
+    table = pd.read_csv(output / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt", sep="\t")
+    stats = pd.read_csv(output / "CRISPResso_mapping_statistics.txt", sep="\t")
+    quant_window = pd.read_csv(output / "Quantification_window_nucleotide_percentage_table.txt", sep="\t", index_col=0)
+    return table, stats, quant_window
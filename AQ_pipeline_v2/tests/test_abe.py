@@ -1,11 +1,29 @@
 import pandas as pd
 import pytest
-from analysis.abe import calculate_correction, calculate_protospacer_metrics
+from analysis.abe import calculate_abe_metrics
 import logging
+import random
+from utils.sequences import reverse_complement
 
 
-"""Tests for analysis/abe.py - covers perfect and tolerated analysis in the 
-forward and reverse orientation"""
+"""Tests for analysis/abe.py - covers calculate_abe_metrics: perfect and tolerated analysis,
+any A to G and any change in the forward and reverse orientation, alignment shifted alleles
+skipped and warned, a row-by-row reference in F and R, percentages from exact #Reads counts
+(row order independent, het totals included), chunked tables giving the same metrics as whole
+ones, and invalid orientation FORCED FAIL"""
+
+
+def _correction(table, search_sequences, reads_aligned=None):
+    """correction without and with tolerated bystanders. Only the search sequences matter to
+        these two, so the perfect correction stands in for the protospacer"""
+    metrics = calculate_abe_metrics(table, search_sequences, search_sequences[0], 1, "F", reads_aligned=reads_aligned)
+    return metrics["correction_without_bystanders"], metrics["correction_with_tolerated_bystanders"]
+
+def _protospacer_metrics(table, protospacer, intended_edit, orientation, reads_aligned=None):
+    """correction with any A to G change and with any change in the protospacer"""
+    metrics = calculate_abe_metrics(table, [protospacer], protospacer, intended_edit, orientation,
+                                    reads_aligned=reads_aligned)
+    return metrics["correction_with_any_AtoG_change"], metrics["correction_with_any_change_in_protospacer"]
 
 
 def test_perfect_correction():
@@ -15,7 +33,7 @@ def test_perfect_correction():
     })
     search_sequences = ["GATCGAACGT"]
 
-    without, with_ = calculate_correction(table, search_sequences)
+    without, with_ = _correction(table, search_sequences)
 
     assert without == 60.0
     assert with_ == 60.0
@@ -27,12 +45,12 @@ def test_perfect_and_tolerated_correction():
     })
     search_sequences = ["GATCGAACGT", "GATCGGACGT"]
 
-    without, with_ = calculate_correction(table, search_sequences)
+    without, with_ = _correction(table, search_sequences)
 
     assert without == 35.0
     assert with_ == 60.0
 
-def test_calculate_protospacer_metrics_forward():
+def test_protospacer_metrics_forward():
     table = pd.DataFrame({
         "Aligned_Sequence": ["GTTTTTTT",   # intended A→G only → both metrics
                             "GTTTCTTT",   # intended A→G + T→C elsewhere → any_change only
@@ -41,12 +59,12 @@ def test_calculate_protospacer_metrics_forward():
     })
     protospacer = "ATTTTTTT"   # A at pos 1
 
-    any_AtoG, any_change = calculate_protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
+    any_AtoG, any_change = _protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
 
     assert any_AtoG == 40.0
     assert any_change == 70.0
 
-def test_calculate_protospacer_metrics_reverse():
+def test_protospacer_metrics_reverse():
     table = pd.DataFrame({
         "Aligned_Sequence": ["AAAAAAAC",   # intended A→G only → both metrics
                             "AAAAGAAC",   # intended A→G + T→C elsewhere → any_change only
@@ -55,42 +73,31 @@ def test_calculate_protospacer_metrics_reverse():
     })
     protospacer = "ATTTTTTT"
 
-    any_AtoG, any_change = calculate_protospacer_metrics(table, protospacer, intended_edit=1, orientation="R")
+    any_AtoG, any_change = _protospacer_metrics(table, protospacer, intended_edit=1, orientation="R")
 
     assert any_AtoG == 40.0
     assert any_change == 70.0
 
-def test_protospacer_metrics_invalid_orientation_FORCED_FAIL():
-    with pytest.raises(ValueError):
-        table = pd.DataFrame({
-            "Aligned_Sequence": ["AAAAAAAC",   # intended A→G only → both metrics
-                                "AAAAGAAC",   # intended A→G + T→C elsewhere → any_change only
-                                "AAAAAAAT"],  # no intended edit → neither
-            "%Reads": [40.0, 30.0, 30.0]
-        })
-        protospacer = "ATTTTTTT"
-        calculate_protospacer_metrics(table, protospacer, intended_edit=1, orientation="X")
-
-def test_calculate_correction_no_matches():
+def test_correction_no_matches():
     table = pd.DataFrame({
         "Aligned_Sequence": ["GATCGAACGT", "GATCGGACGT" ,"AATCGAACGT"],
         "%Reads": [35.0, 25.0, 40.0]
     })
     search_sequences = ["AGTCAGTCAG", "AGTCAGTCAG"]
 
-    without, with_ = calculate_correction(table, search_sequences)
+    without, with_ = _correction(table, search_sequences)
 
     assert without == 0
     assert with_ == 0
 
-def test_calculate_correction_deletion_at_intended_edit_position():
+def test_correction_deletion_at_intended_edit_position():
     table = pd.DataFrame({
         "Aligned_Sequence": ["GATCG-ACGT", "GATCGGACGT" ,"AATCGAACGT"],
         "%Reads": [35.0, 25.0, 40.0]
     })
     search_sequences = ["GATCGAACGT", "GATCGGACGT"]
 
-    without, with_ = calculate_correction(table, search_sequences)
+    without, with_ = _correction(table, search_sequences)
     
     assert without == 0.0
     assert with_ == 25.0
@@ -104,7 +111,7 @@ def test_protospacer_metrics_deletion_at_intended_position():
     })
     protospacer = "ATTTTTTT"
 
-    any_AtoG, any_change = calculate_protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
+    any_AtoG, any_change = _protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
 
     assert any_AtoG == 40.0
     assert any_change == 40.0
@@ -119,7 +126,7 @@ def test_single_insertion_F_skipped_and_warned(caplog):
     protospacer = "ATTTTTTT"   # A at pos 1
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="F"
         )
 
@@ -137,7 +144,7 @@ def test_single_insertion_R_skipped_and_warned(caplog):
     protospacer = "ATTTTTTT"
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="R"
         )
 
@@ -156,7 +163,7 @@ def test_multiple_insertions_cumulative_warning(caplog):
     protospacer = "ATTTTTTT"   # A at pos 1
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="F"
         )
 
@@ -176,7 +183,7 @@ def test_deletion_NOT_skipped(caplog):
     protospacer = "ATTTTTTT"   # A at pos 1
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="F"
         )
 
@@ -195,7 +202,7 @@ def test_all_rows_are_insertions(caplog):
     protospacer = "ATTTTTTT"   # A at pos 1
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="F"
         )
 
@@ -215,7 +222,7 @@ def test_aligned_shorter_than_protospacer_also_skipped(caplog):
     protospacer = "ATTTTTTTTT"   # A at pos 1
 
     with caplog.at_level(logging.WARNING):
-        any_AtoG, any_change = calculate_protospacer_metrics(
+        any_AtoG, any_change = _protospacer_metrics(
             table, protospacer, intended_edit=1, orientation="F"
         )
 
@@ -233,10 +240,116 @@ def test_warning_message_content(caplog):
     })
     protospacer = "ATTTTTTT"   # A at pos 1
 
-    any_AtoG, any_change = calculate_protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
+    any_AtoG, any_change = _protospacer_metrics(table, protospacer, intended_edit=1, orientation="F")
 
     assert any_AtoG == 40.0
     assert any_change == 92.5
     assert "alignment shift" in caplog.text
     assert "7.5" in caplog.text
 
+
+
+def _protospacer_metrics_reference(table, protospacer, intended_edit, orientation):
+    """row-by-row reference implementation the vectorized version must match exactly"""
+    ref = protospacer if orientation == "F" else reverse_complement(protospacer)
+    from_base, to_base = ("A", "G") if orientation == "F" else ("T", "C")
+    idx = intended_edit - 1 if orientation == "F" else len(ref) - intended_edit
+    any_AtoG, any_change = 0, 0
+    for seq, pct in zip(table["Aligned_Sequence"], table["%Reads"]):
+        if len(seq) != len(ref) or seq[idx] != to_base:
+            continue
+        any_change += pct
+        if all(c == r or (r == from_base and c == to_base) for c, r in zip(seq, ref)):
+            any_AtoG += pct
+    return any_AtoG, any_change
+
+@pytest.mark.parametrize("orientation", ["F", "R"])
+def test_protospacer_metrics_matches_row_by_row_reference(orientation):
+    rng = random.Random(7)
+    protospacer = "TCACAGTTCGGGGGTATACA"
+    ref = protospacer if orientation == "F" else reverse_complement(protospacer)
+    seqs = []
+    for _ in range(2000):
+        seq = list(ref)
+        for _ in range(rng.randint(0, 3)):
+            seq[rng.randrange(len(seq))] = rng.choice("ACGT-")
+        if rng.random() < 0.02:
+            seq.insert(rng.randrange(len(seq)), "A")
+        seqs.append("".join(seq))
+    table = pd.DataFrame({
+        "Aligned_Sequence": seqs,
+        "%Reads": [round(rng.random(), 2) for _ in seqs]
+    })
+
+    result = _protospacer_metrics(table, protospacer, intended_edit=5, orientation=orientation)
+
+    assert result == _protospacer_metrics_reference(table, protospacer, 5, orientation)
+
+def test_protospacer_metrics_empty_table():
+    table = pd.DataFrame({"Aligned_Sequence": [], "%Reads": []})
+
+    any_AtoG, any_change = _protospacer_metrics(table, "ATTTTTTT", intended_edit=1, orientation="F")
+
+    assert any_AtoG == 0
+    assert any_change == 0
+
+
+def _random_allele_table(rng, reference, n_rows=1000):
+    seqs = []
+    for _ in range(n_rows):
+        seq = list(reference)
+        for _ in range(rng.randint(0, 3)):
+            seq[rng.randrange(len(seq))] = rng.choice("ACGT-")
+        if rng.random() < 0.02:
+            seq.insert(rng.randrange(len(seq)), "A")
+        seqs.append("".join(seq))
+    return pd.DataFrame({"Aligned_Sequence": seqs, "%Reads": [round(rng.random(), 2) for _ in seqs]})
+
+def test_abe_metrics_invalid_orientation_FORCED_FAIL():
+    table = pd.DataFrame({"Aligned_Sequence": ["ATTTTTTT"], "%Reads": [100.0]})
+    with pytest.raises(ValueError):
+        calculate_abe_metrics(table, ["GTTTTTTT"], "ATTTTTTT", 1, "X")
+
+def _counted_table():
+    # %Reads rounded the way CRISPResso writes them, 3 aligned reads in total
+    return pd.DataFrame({
+        "Aligned_Sequence": ["GTTTTTTT", "ATTTTTTT", "GTTTTTTC"],
+        "#Reads": [1, 1, 1],
+        "%Reads": [33.33, 33.33, 33.33],
+    })
+
+def test_correction_from_read_counts():
+    table = _counted_table()
+    assert _correction(table, ["GTTTTTTT", "GTTTTTTC"]) == (33.33, 66.66)
+    assert _correction(table, ["GTTTTTTT", "GTTTTTTC"], reads_aligned=3) == (1 / 3 * 100, 2 / 3 * 100)
+    assert _protospacer_metrics(table, "ATTTTTTT", 1, "F", reads_aligned=3) == (1 / 3 * 100, 2 / 3 * 100)
+
+def test_abe_metrics_from_read_counts_ignore_row_order():
+    table = _random_allele_table(random.Random(19), "TCACAGTTCGGGGGTATACA")
+    table["#Reads"] = [random.Random(i).randint(1, 500) for i in range(len(table))]
+    reads_aligned = int(table["#Reads"].sum())
+    shuffled = table.sample(frac=1, random_state=3).reset_index(drop=True)
+    args = (["TCACAGTTCGGGGGTATACA"], "TCACAGTTCGGGGGTATACA", 5, "F", [7], "T", "A")
+
+    metrics = calculate_abe_metrics(table, *args, reads_aligned=reads_aligned)
+
+    assert metrics == calculate_abe_metrics(shuffled, *args, reads_aligned=reads_aligned)
+    allele1_reads = table["#Reads"][table["Aligned_Sequence"].str.len().eq(20) & table["Aligned_Sequence"].str[7].eq("T")].sum()
+    assert metrics["total_pct_allele1"] == allele1_reads / reads_aligned * 100
+
+@pytest.mark.parametrize("het", [False, True])
+def test_abe_metrics_over_chunks(het, caplog):
+    table = _random_allele_table(random.Random(23), "TCACAGTTCGGGGGTATACA")
+    table["#Reads"] = [random.Random(i).randint(1, 500) for i in range(len(table))]
+    shifted = pd.DataFrame({"Aligned_Sequence": ["TCACAGTTCGGGGGTATACAA"], "%Reads": [0.0], "#Reads": [50000]})
+    table = pd.concat([table, shifted], ignore_index=True)
+    reads_aligned = int(table["#Reads"].sum())
+    args = (["TCACAGTTCGGGGGTATACA"], "TCACAGTTCGGGGGTATACA", 5, "F") + (([7], "T", "A") if het else ())
+    chunks = (table[start:start + 128] for start in range(0, len(table), 128))
+
+    with caplog.at_level(logging.WARNING):
+        metrics = calculate_abe_metrics(chunks, *args, reads_aligned=reads_aligned)
+    # each warning is given once, for the whole table
+    assert caplog.text.count("alignment shifts") == 1
+
+    assert metrics == calculate_abe_metrics(table, *args, reads_aligned=reads_aligned)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from utils.allele_matrix import AlleleMatrix
+
+
+"""Tests for utils/allele_matrix.py - covers decoding an allele table weighted by %Reads and
+by #Reads, alignment shifted alleles left as zero rows, and an empty table"""
+
+def _table() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Aligned_Sequence": ["ACGT", "AC-T", "ACGTA", "GGGG"],
+        "#Reads": [50, 30, 15, 5],
+        "%Reads": [50.0, 30.0, 15.0, 5.0],
+    })
+
+def test_allele_matrix_from_table():
+    matrix = AlleleMatrix.from_table(_table(), 4)
+    assert matrix.alleles.shape == (4, 4)
+    assert matrix.alleles.dtype == np.uint8
+    assert matrix.alleles.flags["C_CONTIGUOUS"]
+    assert bytes(matrix.alleles[1]) == b"AC-T"
+    assert matrix.length_ok.tolist() == [True, True, False, True]
+    assert not matrix.alleles[2].any()
+    assert matrix.weights.dtype == np.float64
+    assert matrix.weights.tolist() == [50.0, 30.0, 15.0, 5.0]
+
+def test_allele_matrix_from_table_counts():
+    matrix = AlleleMatrix.from_table(_table(), 4, use_counts=True)
+    assert matrix.weights.dtype == np.int64
+    assert matrix.weights.tolist() == [50, 30, 15, 5]
+
+def test_allele_matrix_from_empty_table():
+    matrix = AlleleMatrix.from_table(_table().iloc[:0], 4, use_counts=True)
+    assert matrix.alleles.shape == (0, 4)
+    assert matrix.length_ok.tolist() == []
+    assert matrix.weights.tolist() == []
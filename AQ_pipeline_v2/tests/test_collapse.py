@@ -0,0 +1,68 @@
+import gzip
+import json
+import pandas as pd
+from pipeline import collapse
+from pipeline.collapse import collapse_reads, run_collapsed, COLLAPSE_DIR
+from pipeline.crispresso import FINGERPRINT_FILE
+from pipeline.quantify import quantify_sample
+from tests.helper import SAMPLE_READS, crispresso_output, fake_crispresso, make_config, write_sample
+
+"""Tests for pipeline/collapse.py - covers collapsing identical reads, rescaled allele table,
+mapping statistics and quantification window matching a run on every read (substitutions,
+deletions and insertions), unaligned and repeated reads, the fingerprint cache, paired end
+samples being run uncollapsed, and output that cannot be rescaled falling back to a full run
+FORCED FAIL."""
+
+def test_collapse_reads(tmp_path):
+    sample_dir = write_sample(tmp_path, "TEST1_1", ["ACGT", "TTTT", "ACGT", "ACGT"])
+    counts = collapse_reads([str(next(sample_dir.glob("*.fastq.gz")))], tmp_path / "collapsed.fastq.gz")
+    assert counts == {"ACGT": 3, "TTTT": 1}
+    with gzip.open(tmp_path / "collapsed.fastq.gz", "rt") as f:
+        assert f.read() == "@read_0\nACGT\n+\nIIII\n@read_1\nTTTT\n+\nIIII\n"
+
+def test_rescaled_output_matches_full_run(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(collapse, "run_crispresso", fake_crispresso(calls))
+    collapsed_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    full_dir = write_sample(tmp_path, "TEST1_2", SAMPLE_READS)
+
+    assert run_collapsed(make_config(), collapsed_dir) is True
+    fake_crispresso([])(make_config(), full_dir)
+
+    assert calls == [collapsed_dir / COLLAPSE_DIR]
+    assert not (collapsed_dir / COLLAPSE_DIR).exists()
+    assert (collapsed_dir / "CRISPResso_on_TEST1_1").exists()
+    collapsed_table, collapsed_stats, collapsed_window = crispresso_output(collapsed_dir)
+    full_table, full_stats, full_window = crispresso_output(full_dir)
+    pd.testing.assert_frame_equal(collapsed_table, full_table)
+    pd.testing.assert_frame_equal(collapsed_stats[full_stats.columns], full_stats)
+    pd.testing.assert_frame_equal(collapsed_window, full_window)
+    assert quantify_sample(make_config(), collapsed_dir) == {**quantify_sample(make_config(), full_dir), "sample": "TEST1_1"}
+
+def test_cache_hit(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(collapse, "run_crispresso", fake_crispresso(calls))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    assert run_collapsed(make_config(), sample_dir) is True
+    assert json.loads((sample_dir / FINGERPRINT_FILE).read_text())["engine"] == "collapse"
+    assert run_collapsed(make_config(), sample_dir) is False
+    assert len(calls) == 1
+
+def test_paired_end_not_collapsed(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(collapse, "run_crispresso", lambda row, sample_dir, log_path=None, force=False: calls.append(sample_dir))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS, paired=True)
+    run_collapsed(make_config(), sample_dir)
+    assert calls == [sample_dir]
+    assert not (sample_dir / COLLAPSE_DIR).exists()
+
+def test_unmatched_output_falls_back_FORCED_FAIL(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(collapse, "run_crispresso", fake_crispresso(calls, break_window_table=True))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+
+    assert run_collapsed(make_config(), sample_dir) is True
+    assert calls == [sample_dir / COLLAPSE_DIR, sample_dir]
+    _, stats, _ = crispresso_output(sample_dir)
+    assert stats["READS IN INPUTS"].iloc[0] == len(SAMPLE_READS)
+    assert not (sample_dir / COLLAPSE_DIR).exists()
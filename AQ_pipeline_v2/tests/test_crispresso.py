@@ -1,10 +1,20 @@
+import json
 import pytest
-from pipeline.crispresso import identify_amplicon, pair_fastq_files, build_window_args
+import random
+import subprocess
+from pathlib import Path
+from unittest.mock import patch
+import gzip
+from pipeline.crispresso import AmpliconIndex, identify_amplicon, pair_fastq_files, group_fastq_lanes, resolve_fastq_reads, build_window_args, order_by_fastq_size, run_crispresso, run_crispresso_batch, crispresso_output_dir, FINGERPRINT_FILE
 from config import AmpliconConfig
 
 
 """Tests for pipeline/crispresso - covers amplicon matching, longest first priority,
-stripping random suffixes, paired fastq files, and no matches being found"""
+stripping random suffixes, the AmpliconIndex against the sorted substring scan (including
+equal length ties), paired fastq files, grouping lanes by read, no matches being found, largest-first
+scheduling, per-sample CRISPResso logs, output named after the sample (older folders named
+after the fastq removed, no output FORCED FAIL), the fingerprint cache, lanes streamed into CRISPResso,
+and batched CRISPResso runs"""
 
 def test_basic_amplicon_match():
     configs = [
@@ -60,6 +70,37 @@ def test_no_match_FORCED_FAIL():
     with pytest.raises(ValueError):
         identify_amplicon("Icosa03_R408W_UTD_1.PAH1PAH1PAH1", configs)
     
+def make_named_configs(names: list[str]) -> list[AmpliconConfig]:
+    return [AmpliconConfig(name=name, protospacer="A" * 20, editor="ABE", orientation="F",
+                           amplicon="AAAA", intended_edit=5, tolerated_edits=[], note="")
+            for name in names]
+
+def test_amplicon_index_equal_length_tie_uses_list_order():
+    configs = make_named_configs(["R408W", "PAH_1", "pah_1"])
+    index = AmpliconIndex(configs)
+    assert identify_amplicon("Icosa03_PAH_1_R408W", index) is configs[0]
+    assert identify_amplicon("Icosa03_pah_1", index) is configs[1]
+
+def test_amplicon_index_no_match_FORCED_FAIL():
+    index = AmpliconIndex(make_named_configs(["PAH1"]))
+    assert index.match("Icosa03_R408W_UTD_1") is None
+    with pytest.raises(ValueError):
+        identify_amplicon("Icosa03_R408W_UTD_1", index)
+
+def test_amplicon_index_matches_sorted_scan():
+    rng = random.Random(3)
+    names = ["".join(rng.choice("ABC_12") for _ in range(rng.randint(1, 6))) for _ in range(200)]
+    configs = make_named_configs(names)
+    index = AmpliconIndex(configs)
+    for _ in range(500):
+        directory = "".join(rng.choice("ABCabc_123") for _ in range(rng.randint(5, 25)))
+        expected = None
+        for config in sorted(configs, key=lambda c: len(c.name), reverse=True):
+            if config.name.upper() in directory.split(".")[0].upper():
+                expected = config
+                break
+        assert index.match(directory) is expected
+
 def test_pair_standard_R1_R2_order():
     read1, read2 = pair_fastq_files(["Sample_R1.fastq.gz", "Sample_R2.fastq.gz"])
     assert read1 == "Sample_R1.fastq.gz"
@@ -87,6 +128,55 @@ def test_pair_no_markers_FORCED_FAIL():
     with pytest.raises(ValueError):
         pair_fastq_files(["Sample_a.fastq.gz", "Sample_b.fastq.gz"])
 
+LANE_FILES = [f"S_S1_L00{lane}_R{read}_001.fastq.gz" for lane in (3, 1, 4, 2) for read in (2, 1)]
+
+def test_group_lanes_paired():
+    read1, read2 = group_fastq_lanes(LANE_FILES)
+    assert read1 == [f"S_S1_L00{lane}_R1_001.fastq.gz" for lane in (1, 2, 3, 4)]
+    assert read2 == [f"S_S1_L00{lane}_R2_001.fastq.gz" for lane in (1, 2, 3, 4)]
+
+def test_group_lanes_single_end():
+    read1, read2 = group_fastq_lanes(["S_L002_R1_001.fastq", "S_L001_R1_001.fastq"])
+    assert read1 == ["S_L001_R1_001.fastq", "S_L002_R1_001.fastq"]
+    assert read2 == []
+
+def test_group_lanes_without_lane_tags():
+    assert group_fastq_lanes(["S_R2.fastq.gz", "S_R1.fastq.gz"]) == (["S_R1.fastq.gz"], ["S_R2.fastq.gz"])
+    assert group_fastq_lanes(["S.fastq.gz"]) == (["S.fastq.gz"], [])
+
+@pytest.mark.parametrize("fastq_files", [
+    ["S_R1.fastq.gz", "S_R2.fastq.gz", "S_R1_again.fastq.gz"],         # more than two without lanes
+    ["S_L001_R1.fastq.gz", "S_R1.fastq.gz"],                            # lanes mixed with untagged files
+    ["S_L001_R1.fastq.gz", "S_L001_R2.fastq.gz", "S_L002_R1.fastq.gz"], # lane 2 is missing R2
+    ["S_L001_R1.fastq.gz", "S_L002_R1.fastq"],                          # gzipped and plain lanes
+    ["S_L001_R2.fastq.gz", "S_L002_R2.fastq.gz"],                       # R2 without R1
+])
+def test_group_lanes_FORCED_FAIL(fastq_files):
+    with pytest.raises(ValueError):
+        group_fastq_lanes(fastq_files)
+
+def test_run_crispresso_streams_lanes(tmp_path):
+    for lane in (1, 2):
+        for read in (1, 2):
+            with gzip.open(tmp_path / f"S_L00{lane}_R{read}_001.fastq.gz", "wt") as f:
+                f.write(f"@lane{lane}\nACGT\n+\nIIII\n")
+    seen = {}
+
+    def fake_run(cmd, **kwargs):
+        # read R1 twice, as CRISPResso may, and R2 once
+        for option, passes in (("--fastq_r1", 2), ("--fastq_r2", 1)):
+            path = cmd[cmd.index(option) + 1]
+            seen[option] = [gzip.open(path, "rt").read() for _ in range(passes)]
+        return _fake_crispresso_run(cmd, **kwargs)
+
+    with patch("pipeline.crispresso.subprocess.run", side_effect=fake_run):
+        assert run_crispresso(_fingerprint_cfg(), tmp_path) is True
+    assert seen["--fastq_r1"] == ["@lane1\nACGT\n+\nIIII\n@lane2\nACGT\n+\nIIII\n"] * 2
+    assert seen["--fastq_r2"] == ["@lane1\nACGT\n+\nIIII\n@lane2\nACGT\n+\nIIII\n"]
+    assert sorted(p.name for p in tmp_path.glob("*.fastq.gz")) == [f"S_L00{lane}_R{read}_001.fastq.gz" for lane in (1, 2) for read in (1, 2)]
+    assert len(resolve_fastq_reads(tmp_path)[0]) == 4
+    assert len(json.loads((tmp_path / FINGERPRINT_FILE).read_text())["fastqs"]) == 4
+
 def test_window_args_nuclease():
     cfg = AmpliconConfig(name="x", protospacer="A"*20, editor="NUCLEASE",
                         orientation="F", amplicon="A"*40,
@@ -116,3 +206,181 @@ def test_window_args_oneqseq():
         '--plot_window_size', '10', '--quantification_window_center', '-10',
         '--quantification_window_size', '10',
     ]
+
+def test_order_by_fastq_size_largest_first(tmp_path):
+    for name, size in [("small", 10), ("large", 1000), ("medium", 100)]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "reads_R1.fastq.gz").write_bytes(b"x" * size)
+    (tmp_path / "large" / "reads_R2.fastq.gz").write_bytes(b"x" * 5)
+
+    ordered = order_by_fastq_size([tmp_path / "small", tmp_path / "large", tmp_path / "medium"])
+    assert [d.name for d in ordered] == ["large", "medium", "small"]
+
+def test_order_by_fastq_size_ties_broken_by_name(tmp_path):
+    for name in ["b", "a", "c"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "reads.fastq").write_bytes(b"x" * 10)
+
+    ordered = order_by_fastq_size([tmp_path / "c", tmp_path / "a", tmp_path / "b"])
+    assert [d.name for d in ordered] == ["a", "b", "c"]
+
+def test_run_crispresso_writes_log_file(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"")
+    cfg = AmpliconConfig(name="x", protospacer="A"*20, editor="ABE",
+                         orientation="F", amplicon="A"*40,
+                         intended_edit=5, tolerated_edits=[])
+    log_path = tmp_path / "logs" / "x.log"
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(cfg, tmp_path, log_path)
+    assert log_path.exists()
+    assert mock_run.call_args.kwargs["stderr"] == subprocess.STDOUT
+
+def test_run_crispresso_log_file_nonzero_exit_FORCED_FAIL(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"")
+    cfg = AmpliconConfig(name="x", protospacer="A"*20, editor="ABE",
+                         orientation="F", amplicon="A"*40,
+                         intended_edit=5, tolerated_edits=[])
+    with patch("pipeline.crispresso.subprocess.run", return_value=subprocess.CompletedProcess([], 1)):
+        with pytest.raises(RuntimeError):
+            run_crispresso(cfg, tmp_path, tmp_path / "x.log")
+
+def _fake_crispresso_run(cmd, **kwargs):
+    """stands in for subprocess.run, creates the CRISPResso output folder. Like CRISPResso, it
+    names the folder after --name, or after the R1 fastq when there is none"""
+    output_folder = cmd[cmd.index("--output_folder") + 1]
+    name = cmd[cmd.index("--name") + 1] if "--name" in cmd else Path(cmd[cmd.index("--fastq_r1") + 1]).name.split(".")[0]
+    (Path(output_folder) / f"CRISPResso_on_{name}").mkdir(exist_ok=True)
+    return subprocess.CompletedProcess(cmd, 0)
+
+def _fingerprint_cfg(protospacer="A"*20):
+    return AmpliconConfig(name="x", protospacer=protospacer, editor="ABE",
+                          orientation="F", amplicon=protospacer + "C"*20,
+                          intended_edit=5, tolerated_edits=[])
+
+def test_fingerprint_cache_hit_skips_crispresso(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        assert run_crispresso(_fingerprint_cfg(), tmp_path) is True
+        assert run_crispresso(_fingerprint_cfg(), tmp_path) is False
+    assert mock_run.call_count == 1
+    assert (tmp_path / FINGERPRINT_FILE).exists()
+
+def test_fingerprint_force_reruns(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(_fingerprint_cfg(), tmp_path)
+        assert run_crispresso(_fingerprint_cfg(), tmp_path, force=True) is True
+    assert mock_run.call_count == 2
+
+def test_fingerprint_changed_fastq_reruns(tmp_path):
+    fastq = tmp_path / "reads_R1.fastq.gz"
+    fastq.write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(_fingerprint_cfg(), tmp_path)
+        fastq.write_bytes(b"@r\nACGTACGT\n+\nIIIIIIII\n")
+        assert run_crispresso(_fingerprint_cfg(), tmp_path) is True
+    assert mock_run.call_count == 2
+
+def test_fingerprint_changed_protospacer_reruns(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(_fingerprint_cfg(), tmp_path)
+        assert run_crispresso(_fingerprint_cfg("A"*19 + "T"), tmp_path) is True
+    assert mock_run.call_count == 2
+
+def test_fingerprint_missing_output_folder_reruns(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(_fingerprint_cfg(), tmp_path)
+        crispresso_output_dir(tmp_path).rmdir()
+        assert run_crispresso(_fingerprint_cfg(), tmp_path) is True
+    assert mock_run.call_count == 2
+
+def test_run_crispresso_names_output_after_sample(tmp_path):
+    sample_dir = tmp_path / "S_x_1"
+    sample_dir.mkdir()
+    (sample_dir / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    # an older full run named its folder after the fastq, CRISPResso's default
+    (sample_dir / "CRISPResso_on_reads_R1").mkdir()
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_run) as mock_run:
+        run_crispresso(_fingerprint_cfg(), sample_dir)
+    cmd = mock_run.call_args.args[0]
+    assert cmd[cmd.index("--name") + 1] == "S_x_1"
+    assert [p.name for p in sample_dir.glob("CRISPResso_on_*")] == ["CRISPResso_on_S_x_1"]
+
+def test_run_crispresso_no_output_FORCED_FAIL(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", return_value=subprocess.CompletedProcess([], 0)):
+        with pytest.raises(RuntimeError):
+            run_crispresso(_fingerprint_cfg(), tmp_path)
+    assert not (tmp_path / FINGERPRINT_FILE).exists()
+
+def test_fingerprint_not_written_on_failure_FORCED_FAIL(tmp_path):
+    (tmp_path / "reads_R1.fastq.gz").write_bytes(b"@r\nACGT\n+\nIIII\n")
+    with patch("pipeline.crispresso.subprocess.run", side_effect=subprocess.CalledProcessError(1, "CRISPResso")):
+        with pytest.raises(subprocess.CalledProcessError):
+            run_crispresso(_fingerprint_cfg(), tmp_path)
+    assert not (tmp_path / FINGERPRINT_FILE).exists()
+
+def _fake_crispresso_batch_run(cmd, **kwargs):
+    """stands in for subprocess.run, creates CRISPRessoBatch output for every row of the batch file"""
+    settings = Path(cmd[cmd.index("--batch_settings") + 1])
+    batch_output = Path(cmd[cmd.index("--output_folder") + 1]) / f"CRISPRessoBatch_on_{cmd[cmd.index('--name') + 1]}"
+    for line in settings.read_text().splitlines()[1:]:
+        name = line.split("\t")[0]
+        (batch_output / f"CRISPResso_on_{name}").mkdir(parents=True)
+        (batch_output / f"CRISPResso_on_{name}" / "CRISPResso_mapping_statistics.txt").write_text("stats")
+    return subprocess.CompletedProcess(cmd, 0)
+
+def _make_batch_samples(tmp_path, names):
+    sample_dirs = []
+    for name in names:
+        sample_dir = tmp_path / "fastqs" / name
+        sample_dir.mkdir(parents=True)
+        (sample_dir / "reads_R1.fastq.gz").write_bytes(f"@r\n{name}\n".encode())
+        sample_dirs.append(sample_dir)
+    return sample_dirs
+
+def test_batch_splits_outputs_into_sample_dirs(tmp_path):
+    sample_dirs = _make_batch_samples(tmp_path, ["S_x_1", "S_x_2"])
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_batch_run) as mock_run:
+        outcomes = run_crispresso_batch(_fingerprint_cfg(), sample_dirs, tmp_path / "batch")
+
+    assert mock_run.call_count == 1
+    assert mock_run.call_args.args[0][0] == "CRISPRessoBatch"
+    assert outcomes == {sample_dirs[0]: True, sample_dirs[1]: True}
+    for sample_dir in sample_dirs:
+        assert (sample_dir / f"CRISPResso_on_{sample_dir.name}" / "CRISPResso_mapping_statistics.txt").exists()
+        assert (sample_dir / FINGERPRINT_FILE).exists()
+    assert not (tmp_path / "batch").exists()
+
+def test_batch_replaces_previous_output_folder(tmp_path):
+    sample_dirs = _make_batch_samples(tmp_path, ["S_x_1"])
+    (sample_dirs[0] / "CRISPResso_on_reads_R1").mkdir()
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_batch_run):
+        run_crispresso_batch(_fingerprint_cfg(), sample_dirs, tmp_path / "batch", force=True)
+    assert [p.name for p in sample_dirs[0].glob("CRISPResso_on_*")] == ["CRISPResso_on_S_x_1"]
+
+def test_batch_cache_hits_are_not_rerun(tmp_path):
+    sample_dirs = _make_batch_samples(tmp_path, ["S_x_1", "S_x_2"])
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_batch_run) as mock_run:
+        run_crispresso_batch(_fingerprint_cfg(), sample_dirs, tmp_path / "batch")
+        outcomes = run_crispresso_batch(_fingerprint_cfg(), sample_dirs, tmp_path / "batch")
+    assert mock_run.call_count == 1
+    assert outcomes == {sample_dirs[0]: False, sample_dirs[1]: False}
+
+def test_batch_sample_without_fastqs_fails_alone(tmp_path):
+    sample_dirs = _make_batch_samples(tmp_path, ["S_x_1"])
+    empty_dir = tmp_path / "fastqs" / "S_x_2"
+    empty_dir.mkdir()
+    with patch("pipeline.crispresso.subprocess.run", side_effect=_fake_crispresso_batch_run):
+        outcomes = run_crispresso_batch(_fingerprint_cfg(), sample_dirs + [empty_dir], tmp_path / "batch")
+    assert outcomes[sample_dirs[0]] is True
+    assert isinstance(outcomes[empty_dir], FileNotFoundError)
+
+def test_batch_missing_sample_output_FORCED_FAIL(tmp_path):
+    sample_dirs = _make_batch_samples(tmp_path, ["S_x_1"])
+    with patch("pipeline.crispresso.subprocess.run", return_value=subprocess.CompletedProcess([], 0)):
+        outcomes = run_crispresso_batch(_fingerprint_cfg(), sample_dirs, tmp_path / "batch")
+    assert isinstance(outcomes[sample_dirs[0]], RuntimeError)
+    assert not (sample_dirs[0] / FINGERPRINT_FILE).exists()
@@ -0,0 +1,105 @@
+import logging
+import random
+import pytest
+from config import AmpliconConfig
+from pipeline.crispresso import AmpliconIndex, resolve_fastq_reads
+from pipeline.demultiplex import demultiplex, pool_prefix, UNASSIGNED
+from tests.helper import write_fastq
+from utils.fastq import read_fastq
+from utils.kmers import KmerIndex
+from utils.sequences import reverse_complement
+
+"""Tests for pipeline/demultiplex.py - covers the directory prefix, single end and paired end
+pools split into Stage 1 sample directories, reads from either strand, unassigned reads kept
+out of the sample directories, reads of rows sharing an amplicon sent to the unassigned
+fastq with a warning, replacing an earlier run with force, and existing output or
+R1/R2 read count mismatch FORCED FAIL."""
+
+rng = random.Random(14)
+AMPLICONS = {name: "".join(rng.choice("ACGT") for _ in range(220)) for name in ("PAH1", "PAH2", "CFTR1")}
+NOISE = ["".join(rng.choice("ACGT") for _ in range(150)) for _ in range(5)]
+
+
+def make_configs():
+    return [
+        AmpliconConfig(name=name, protospacer=amplicon[100:120], editor="ABE", orientation="F",
+                       amplicon=amplicon, intended_edit=6, tolerated_edits=[], note="")
+        for name, amplicon in AMPLICONS.items()
+    ]
+
+def pool_reads():
+    reads = [AMPLICONS["PAH1"][:150]] * 30 + [reverse_complement(AMPLICONS["PAH2"][70:])] * 20 + NOISE
+    rng.shuffle(reads)
+    return reads
+
+def test_pool_prefix():
+    assert pool_prefix("runs/Pool3_R1_001.fastq.gz") == "Pool3"
+    assert pool_prefix("Pool3_S1_L001_R1_001.fastq") == "Pool3_S1_L001"
+    assert pool_prefix("Pool3.fastq.gz") == "Pool3"
+
+def test_single_end(tmp_path):
+    reads = pool_reads()
+    read1 = write_fastq(tmp_path / "Pool3_R1_001.fastq.gz", reads)
+    output_dir = tmp_path / "fastqs"
+    counts = demultiplex(read1, None, KmerIndex(make_configs()), output_dir, "Pool3")
+    assert counts == {"PAH1": 30, "PAH2": 20, UNASSIGNED: 5}
+
+    assert sorted(p.name for p in output_dir.iterdir()) == ["Pool3_PAH1", "Pool3_PAH2", "Pool3_unassigned_R1_001.fastq.gz"]
+    sample_dir = output_dir / "Pool3_PAH2"
+    assert AmpliconIndex(make_configs()).match(sample_dir.name).name == "PAH2"
+    _, (sample_read1,), sample_read2 = resolve_fastq_reads(sample_dir)
+    assert sample_read2 == []
+    assert {sequence for _, sequence, _ in read_fastq(sample_read1)} == {reverse_complement(AMPLICONS["PAH2"][70:])}
+
+    # input order is kept within each amplicon
+    headers = [header for header, sequence, _ in read_fastq(read1) if sequence == AMPLICONS["PAH1"][:150]]
+    assert [header for header, _, _ in read_fastq(output_dir / "Pool3_PAH1" / "Pool3_PAH1_R1_001.fastq.gz")] == headers
+
+def test_paired_end(tmp_path):
+    pah1 = AMPLICONS["PAH1"]
+    read1 = write_fastq(tmp_path / "Pool3_R1_001.fastq.gz", [pah1[:150], "N" * 150, NOISE[0]])
+    read2 = write_fastq(tmp_path / "Pool3_R2_001.fastq.gz", [reverse_complement(pah1[70:]), reverse_complement(pah1[70:]), NOISE[1]])
+    output_dir = tmp_path / "fastqs"
+    counts = demultiplex(read1, read2, KmerIndex(make_configs()), output_dir, "Pool3")
+    assert counts == {"PAH1": 2, UNASSIGNED: 1}
+
+    _, (sample_read1,), (sample_read2,) = resolve_fastq_reads(output_dir / "Pool3_PAH1")
+    assert [sequence for _, sequence, _ in read_fastq(sample_read1)] == [pah1[:150], "N" * 150]
+    assert len(list(read_fastq(sample_read2))) == 2
+    assert (output_dir / "Pool3_unassigned_R2_001.fastq.gz").exists()
+
+def test_shared_amplicon_rows_unassigned(tmp_path, caplog):
+    configs = make_configs() + [
+        AmpliconConfig(name="PAH1b", protospacer=AMPLICONS["PAH1"][130:150], editor="ABE", orientation="F",
+                       amplicon=AMPLICONS["PAH1"], intended_edit=6, tolerated_edits=[], note="")
+    ]
+    read1 = write_fastq(tmp_path / "Pool3_R1_001.fastq.gz", pool_reads())
+    output_dir = tmp_path / "fastqs"
+    with caplog.at_level(logging.WARNING):
+        counts = demultiplex(read1, None, KmerIndex(configs), output_dir, "Pool3")
+
+    # the PAH1 reads cannot be split between PAH1 and PAH1b, so neither row gets them
+    assert counts == {"PAH2": 20, UNASSIGNED: 35}
+    assert not (output_dir / "Pool3_PAH1").exists()
+    assert "PAH1, PAH1b share one amplicon sequence" in caplog.text
+
+def test_existing_output_FORCED_FAIL(tmp_path):
+    read1 = write_fastq(tmp_path / "Pool3_R1_001.fastq.gz", pool_reads())
+    demultiplex(read1, None, KmerIndex(make_configs()), tmp_path / "fastqs", "Pool3")
+    with pytest.raises(FileExistsError):
+        demultiplex(read1, None, KmerIndex(make_configs()), tmp_path / "fastqs", "Pool3")
+
+def test_force_replaces_earlier_run(tmp_path):
+    output_dir = tmp_path / "fastqs"
+    demultiplex(write_fastq(tmp_path / "a.fastq.gz", pool_reads()), None, KmerIndex(make_configs()), output_dir, "Pool3")
+    counts = demultiplex(write_fastq(tmp_path / "b.fastq.gz", [AMPLICONS["CFTR1"][:150]] * 4), None,
+                         KmerIndex(make_configs()), output_dir, "Pool3", force=True)
+    assert counts == {"CFTR1": 4}
+    assert not (output_dir / "Pool3_PAH1").exists()
+    assert not (output_dir / "Pool3_unassigned_R1_001.fastq.gz").exists()
+
+def test_read_count_mismatch_FORCED_FAIL(tmp_path):
+    read1 = write_fastq(tmp_path / "Pool3_R1_001.fastq.gz", [AMPLICONS["PAH1"][:150]] * 3)
+    read2 = write_fastq(tmp_path / "Pool3_R2_001.fastq.gz", [AMPLICONS["PAH1"][:150]] * 2)
+    with pytest.raises(ValueError, match="different numbers of reads"):
+        demultiplex(read1, read2, KmerIndex(make_configs()), tmp_path / "fastqs", "Pool3")
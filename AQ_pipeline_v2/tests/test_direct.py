@@ -0,0 +1,219 @@
+import json
+import pytest
+import pandas as pd
+from pipeline import direct
+from pipeline.crispresso import FINGERPRINT_FILE
+from pipeline.direct import protospacer_anchors, anchor_window, run_direct, DIRECT_DIR, FALLBACK_DIR
+from pipeline.quantify import quantify_sample
+from tests.helper import LEFT, PROTOSPACER, RIGHT, make_config, write_fastq
+from utils.sequences import reverse_complement
+
+"""Tests for pipeline/direct.py - covers anchoring the protospacer window (forward, reverse,
+nuclease, repeated protospacer or anchor, reads with indels), the direct engine end to end into
+quantify_sample for forward and reverse guides, samples split across lanes, paired end reads, the fingerprint cache, the
+CRISPResso fallback for unanchored reads, a failing fallback, and R1/R2 read count mismatch
+FORCED FAIL."""
+
+
+def edit(window: str, edits: dict[int, str]) -> str:
+    bases = list(window)
+    for position, base in edits.items():
+        bases[position] = base
+    return "".join(bases)
+
+def abe_reads(window: str, edits: list[tuple[int, dict[int, str]]]) -> list[str]:
+    """reads of the whole amplicon - (count, {window position: base}) per outcome"""
+    reads = []
+    for count, outcome_edits in edits:
+        reads += [LEFT + edit(window, outcome_edits) + RIGHT] * count
+    return reads
+
+FORWARD_OUTCOMES = [
+    (400, {}),
+    (200, {5: "G"}),                    # perfect correction
+    (200, {5: "G", 13: "G"}),           # with tolerated bystander
+    (100, {5: "G", 12: "G"}),           # with another A to G
+    (100, {5: "G", 0: "C"}),            # with another change
+]
+
+def test_protospacer_anchors_forward():
+    left, reference, right = protospacer_anchors(make_config("F"))
+    assert left == LEFT[-10:]
+    assert reference == PROTOSPACER
+    assert right == RIGHT[:10]
+
+def test_protospacer_anchors_reverse():
+    left, reference, right = protospacer_anchors(make_config("R"))
+    assert reference == reverse_complement(PROTOSPACER)
+    assert left == LEFT[-10:]
+
+def test_protospacer_anchors_not_applicable():
+    assert protospacer_anchors(make_config(editor="NUCLEASE")) is None
+    assert protospacer_anchors(make_config(amplicon=LEFT + PROTOSPACER + PROTOSPACER + RIGHT)) is None
+    assert protospacer_anchors(make_config(amplicon="A" * 60 + PROTOSPACER + "A" * 71)) is None
+    assert protospacer_anchors(make_config(amplicon=LEFT[-5:] + PROTOSPACER + RIGHT)) is None
+
+def test_anchor_window():
+    left, reference, right = protospacer_anchors(make_config("F"))
+    edited = edit(reference, {5: "G"})
+    assert anchor_window(LEFT + edited + RIGHT, left, right, 20) == edited
+    assert anchor_window(LEFT[30:] + edited + RIGHT[:15], left, right, 20) == edited
+    assert anchor_window(LEFT + edited[:8] + edited[9:] + RIGHT, left, right, 20) is None
+    assert anchor_window(LEFT + edited[:8] + "T" + edited[8:] + RIGHT, left, right, 20) is None
+
+def test_run_direct_forward(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    write_fastq(sample_dir / "reads_R1.fastq.gz", abe_reads(PROTOSPACER, FORWARD_OUTCOMES))
+
+    assert run_direct(make_config("F"), sample_dir) is True
+    assert not (sample_dir / FALLBACK_DIR).exists()
+    result = quantify_sample(make_config("F"), sample_dir)
+    assert result["reads_total"] == 1000
+    assert result["reads_aligned"] == 1000
+    assert result["correction_without_bystanders"] == 20.0
+    assert result["correction_with_tolerated_bystanders"] == 40.0
+    assert result["correction_with_any_AtoG_change"] == 50.0
+    assert result["correction_with_any_change_in_protospacer"] == 60.0
+
+def test_run_direct_reverse(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    window = reverse_complement(PROTOSPACER)
+    last = len(window) - 1
+    outcomes = [(count, {last - position: reverse_complement(base) for position, base in edits.items()})
+                for count, edits in FORWARD_OUTCOMES]
+    write_fastq(sample_dir / "reads_R1.fastq.gz", abe_reads(window, outcomes))
+
+    run_direct(make_config("R"), sample_dir)
+    result = quantify_sample(make_config("R"), sample_dir)
+    assert result["correction_without_bystanders"] == 20.0
+    assert result["correction_with_tolerated_bystanders"] == 40.0
+    assert result["correction_with_any_AtoG_change"] == 50.0
+    assert result["correction_with_any_change_in_protospacer"] == 60.0
+
+def test_run_direct_lanes(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    reads = abe_reads(PROTOSPACER, FORWARD_OUTCOMES)
+    for lane in range(4):
+        write_fastq(sample_dir / f"TEST1_1_L00{lane + 1}_R1_001.fastq.gz", reads[lane::4])
+
+    run_direct(make_config("F"), sample_dir)
+    result = quantify_sample(make_config("F"), sample_dir)
+    assert result["reads_total"] == 1000
+    assert result["correction_with_tolerated_bystanders"] == 40.0
+
+def test_run_direct_outputs(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    write_fastq(sample_dir / "reads_R1.fastq.gz", abe_reads(PROTOSPACER, [(3, {}), (1, {5: "G"})]))
+
+    run_direct(make_config("F"), sample_dir)
+    output_dir = sample_dir / "CRISPResso_on_TEST1_1"
+    table = pd.read_csv(output_dir / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt", sep="\t")
+    assert table["Aligned_Sequence"].tolist() == [PROTOSPACER, edit(PROTOSPACER, {5: "G"})]
+    assert table["#Reads"].tolist() == [3, 1]
+    assert table["%Reads"].tolist() == [75.0, 25.0]
+    assert table["Unedited"].tolist() == [True, False]
+    assert table["n_mutated"].tolist() == [0, 1]
+    quant_window = pd.read_csv(output_dir / "Quantification_window_nucleotide_percentage_table.txt", sep="\t", index_col=0)
+    assert quant_window.iloc[:, 5].loc["A"] == 0.75
+    assert quant_window.iloc[:, 5].loc["G"] == 0.25
+
+def fake_crispresso(table_rows: list[tuple[str, int]], reads_total: int, reads_aligned: int):
+    """stands in for run_crispresso on the fallback directory, recording the directory and the
+    fastqs it held"""
+    calls = []
+    def run(amplicon_list_row, sample_dir, log_path=None, force=False):
+        calls.append((sample_dir, sorted(path.name for path in sample_dir.glob("*.fastq.gz"))))
+        output = sample_dir / f"CRISPResso_on_{sample_dir.name}"
+        output.mkdir()
+        (output / "CRISPResso_mapping_statistics.txt").write_text(
+            "READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n"
+            f"{reads_total}\t{reads_total}\t{reads_aligned}\n"
+        )
+        lines = ["Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads"]
+        for sequence, reads in table_rows:
+            lines.append(f"{sequence}\t{PROTOSPACER}\tFalse\t0\t0\t1\t{reads}\t{reads / reads_aligned * 100}")
+        (output / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt").write_text("\n".join(lines) + "\n")
+        return True
+    return run, calls
+
+def test_run_direct_paired_end(tmp_path, monkeypatch):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    amplicon = LEFT + PROTOSPACER + RIGHT
+    edited = LEFT + edit(PROTOSPACER, {5: "G"}) + RIGHT
+    # R1 covers the window in the first pair only, R2 in the second only, both in the last two
+    read1 = [amplicon[:100], edited[:60], amplicon[:100], edited[:100]]
+    read2 = [reverse_complement(amplicon[-60:]), reverse_complement(edited[-100:]),
+             reverse_complement(amplicon[-100:]), reverse_complement(amplicon[-100:])]
+    write_fastq(sample_dir / "reads_R1.fastq.gz", read1)
+    write_fastq(sample_dir / "reads_R2.fastq.gz", read2)
+    fake, fallback_calls = fake_crispresso([], reads_total=1, reads_aligned=0)
+    monkeypatch.setattr(direct, "run_crispresso", fake)
+
+    run_direct(make_config("F"), sample_dir)
+
+    table = pd.read_csv(sample_dir / "CRISPResso_on_TEST1_1" / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt", sep="\t")
+    assert dict(zip(table["Aligned_Sequence"], table["#Reads"])) == {PROTOSPACER: 2, edit(PROTOSPACER, {5: "G"}): 1}
+    # the pair whose mates disagree
+    assert [fastqs for _, fastqs in fallback_calls] == [["fallback_R1.fastq.gz", "fallback_R2.fastq.gz"]]
+
+def test_run_direct_cache_hit(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    write_fastq(sample_dir / "reads_R1.fastq.gz", abe_reads(PROTOSPACER, [(3, {})]))
+
+    assert run_direct(make_config("F"), sample_dir) is True
+    assert json.loads((sample_dir / FINGERPRINT_FILE).read_text())["engine"] == "direct"
+    assert run_direct(make_config("F"), sample_dir) is False
+    assert run_direct(make_config("F"), sample_dir, force=True) is True
+
+def test_run_direct_fallback(tmp_path, monkeypatch):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    edited = edit(PROTOSPACER, {5: "G"})
+    deleted = PROTOSPACER[:8] + "-" + PROTOSPACER[9:]
+    reads = abe_reads(PROTOSPACER, [(6, {}), (2, {5: "G"})])
+    reads += [LEFT + PROTOSPACER[:8] + PROTOSPACER[9:] + RIGHT] * 2 + ["ACGT" * 20]
+    write_fastq(sample_dir / "reads_R1.fastq.gz", reads)
+    fake, calls = fake_crispresso([(deleted, 1), (edited, 1)], reads_total=3, reads_aligned=2)
+    monkeypatch.setattr(direct, "run_crispresso", fake)
+
+    run_direct(make_config("F"), sample_dir)
+
+    assert calls == [(sample_dir / DIRECT_DIR / FALLBACK_DIR, ["fallback.fastq.gz"])]
+    assert not (sample_dir / DIRECT_DIR).exists()
+    output_dir = sample_dir / "CRISPResso_on_TEST1_1"
+    table = pd.read_csv(output_dir / f"Alleles_frequency_table_around_sgRNA_{PROTOSPACER}.txt", sep="\t")
+    assert dict(zip(table["Aligned_Sequence"], table["#Reads"])) == {PROTOSPACER: 6, edited: 3, deleted: 1}
+    assert table["%Reads"].tolist() == [60.0, 30.0, 10.0]
+    stats = pd.read_csv(output_dir / "CRISPResso_mapping_statistics.txt", sep="\t").iloc[0]
+    assert stats["READS IN INPUTS"] == 11
+    assert stats["READS AFTER PREPROCESSING"] == 11
+    assert stats["READS ALIGNED"] == 10
+
+def test_run_direct_fallback_failure(tmp_path, monkeypatch):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    write_fastq(sample_dir / "reads_R1.fastq.gz", abe_reads(PROTOSPACER, [(9, {})]) + ["ACGT" * 20])
+    def failing_crispresso(*args, **kwargs):
+        raise RuntimeError("CRISPResso exited with status 1")
+    monkeypatch.setattr(direct, "run_crispresso", failing_crispresso)
+
+    run_direct(make_config("F"), sample_dir)
+    stats = pd.read_csv(sample_dir / "CRISPResso_on_TEST1_1" / "CRISPResso_mapping_statistics.txt", sep="\t").iloc[0]
+    assert stats["READS IN INPUTS"] == 10
+    assert stats["READS AFTER PREPROCESSING"] == 10
+    assert stats["READS ALIGNED"] == 9
+
+def test_run_direct_read_count_mismatch_FORCED_FAIL(tmp_path):
+    sample_dir = tmp_path / "TEST1_1"
+    sample_dir.mkdir()
+    amplicon = LEFT + PROTOSPACER + RIGHT
+    write_fastq(sample_dir / "reads_R1.fastq.gz", [amplicon[:100]] * 3)
+    write_fastq(sample_dir / "reads_R2.fastq.gz", [reverse_complement(amplicon[-100:])] * 2)
+    with pytest.raises(ValueError):
+        run_direct(make_config("F"), sample_dir)
@@ -2,8 +2,7 @@ import pytest
 import pandas as pd
 from loaders.amplicon_list import load_amplicon_list
 from utils.sequences import generate_search_sequences
-from analysis.abe import calculate_correction, calculate_protospacer_metrics
-from analysis.heterozygous import calculate_het_correction, calculate_het_protospacer_metrics
+from analysis.abe import calculate_abe_metrics
 from config import AmpliconConfig
 from loaders.crispresso_output import read_allele_table, read_mapping_stats
 from tests.helper import make_quant_window
@@ -36,7 +35,7 @@ def test_load_amplicon_list_UNTIL_generate_search_sequences(tmp_path):
     assert result1 == ["TCACGGTTCGGGGGTATACA", "TCGCGGTTCGGGGGTATACA", "TCACGGTTCGGGGGTGTACA", "TCGCGGTTCGGGGGTGTACA"]
     assert result2 == ["GAGACTCTGAGCGGCTGCTG", "GAGACTCCGAGCGGCTGCTG"]
 
-def test_load_amplicon_list_UNTIL_calculate_correction(tmp_path):
+def test_load_amplicon_list_UNTIL_correction_metrics(tmp_path):
     csv_file = tmp_path / "amplicon_list.csv"
     csv_file.write_text(
         "name,protospacer_or_PEG,editor,guide_orientation_relative_to_amplicon,amplicon,note,tolerated_edits,intended_edit\n"
@@ -66,13 +65,15 @@ def test_load_amplicon_list_UNTIL_calculate_correction(tmp_path):
                                         tolerated_edits=amplicon_list_object[1].tolerated_edits,
                                         orientation=amplicon_list_object[1].orientation)
 
-    result1 = calculate_correction(table1, amplicon1_search_seq)
-    result2 = calculate_correction(table2, amplicon2_search_seq)
+    result1 = calculate_abe_metrics(table1, amplicon1_search_seq, amplicon_list_object[0].protospacer,
+                                    amplicon_list_object[0].intended_edit, amplicon_list_object[0].orientation)
+    result2 = calculate_abe_metrics(table2, amplicon2_search_seq, amplicon_list_object[1].protospacer,
+                                    amplicon_list_object[1].intended_edit, amplicon_list_object[1].orientation)
 
-    assert result1 == (10.0, 60.0)
-    assert result2 == (10.0, 30.0)
+    assert (result1["correction_without_bystanders"], result1["correction_with_tolerated_bystanders"]) == (10.0, 60.0)
+    assert (result2["correction_without_bystanders"], result2["correction_with_tolerated_bystanders"]) == (10.0, 30.0)
 
-def test_load_amplicon_list_UNTIL_calculate_protospacer_metrics(tmp_path):
+def test_load_amplicon_list_UNTIL_protospacer_metrics(tmp_path):
     csv_file = tmp_path / "amplicon_list.csv"
     csv_file.write_text(
         "name,protospacer_or_PEG,editor,guide_orientation_relative_to_amplicon,amplicon,note,tolerated_edits,intended_edit\n"
@@ -102,28 +103,27 @@ def test_load_amplicon_list_UNTIL_calculate_protospacer_metrics(tmp_path):
                                         tolerated_edits=amplicon_list_object[1].tolerated_edits,
                                         orientation=amplicon_list_object[1].orientation)
 
-    result1_with_without = calculate_correction(table1, amplicon1_search_seq)
-    result2_with_without = calculate_correction(table2, amplicon2_search_seq)
-
-    result1_AtoG_anychange = calculate_protospacer_metrics(
+    result1 = calculate_abe_metrics(
         table1,
+        amplicon1_search_seq,
         amplicon_list_object[0].protospacer,
         amplicon_list_object[0].intended_edit,
         amplicon_list_object[0].orientation
     )
 
-    result2_AtoG_anychange = calculate_protospacer_metrics(
+    result2 = calculate_abe_metrics(
         table2,
+        amplicon2_search_seq,
         amplicon_list_object[1].protospacer,
         amplicon_list_object[1].intended_edit,
         amplicon_list_object[1].orientation
     )
 
-    assert result1_with_without == (5.0, 50.0)
-    assert result1_AtoG_anychange == (72.5, 100.0)
+    assert (result1["correction_without_bystanders"], result1["correction_with_tolerated_bystanders"]) == (5.0, 50.0)
+    assert (result1["correction_with_any_AtoG_change"], result1["correction_with_any_change_in_protospacer"]) == (72.5, 100.0)
 
-    assert result2_with_without == (10.0, 25.0)
-    assert result2_AtoG_anychange == (45.0, 70.0)
+    assert (result2["correction_without_bystanders"], result2["correction_with_tolerated_bystanders"]) == (10.0, 25.0)
+    assert (result2["correction_with_any_AtoG_change"], result2["correction_with_any_change_in_protospacer"]) == (45.0, 70.0)
 
 def test_load_amplicon_list_UNTIL_calculate_het_metrics_reverse(tmp_path):
     csv_file = tmp_path / "amplicon_list.csv"
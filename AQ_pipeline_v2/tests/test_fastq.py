@@ -0,0 +1,107 @@
+import gzip
+import subprocess
+import threading
+import pytest
+from pathlib import Path
+from utils.fastq import concatenated_fastq, count_fastq_records, read_fastq, read_fastq_lanes
+
+"""Tests for utils/fastq.py - covers reading lanes in order, streaming gzipped and plain lanes
+through a named pipe to repeated readers (including another process and a reader that stops
+early), the pipe being cleaned up afterwards, counting records of plain, gzipped and
+concatenated gzip files, and truncated records, truncated or corrupt gzip members and
+malformed records FORCED FAIL."""
+
+
+def write_lanes(tmp_path: Path, n_lanes: int = 3, reads_per_lane: int = 2000, gz: bool = True) -> list[str]:
+    paths = []
+    for lane in range(1, n_lanes + 1):
+        path = tmp_path / f"S_L00{lane}_R1_001.fastq{'.gz' if gz else ''}"
+        with (gzip.open(path, "wt") if gz else open(path, "w")) as f:
+            for i in range(reads_per_lane):
+                f.write(f"@lane{lane}_{i}\nACGTACGTAC\n+\nIIIIIIIIII\n")
+        paths.append(str(path))
+    return paths
+
+def test_read_fastq_lanes(tmp_path):
+    lanes = write_lanes(tmp_path, reads_per_lane=2)
+    assert [header for header, _, _ in read_fastq_lanes(lanes)] == [f"lane{lane}_{i}" for lane in (1, 2, 3) for i in (0, 1)]
+
+def test_single_file_is_passed_through(tmp_path):
+    lane, = write_lanes(tmp_path, n_lanes=1)
+    with concatenated_fastq([lane]) as path:
+        assert path == lane
+
+def test_pipe_replays_for_each_reader(tmp_path):
+    lanes = write_lanes(tmp_path)
+    expected = [record for record in read_fastq_lanes(lanes)]
+    with concatenated_fastq(lanes) as path:
+        assert Path(path).name == "S_R1_001.fastq.gz"
+        assert list(read_fastq(path)) == expected
+        assert list(read_fastq(path)) == expected
+        result = subprocess.run(["gzip", "-dc", path], capture_output=True, check=True)
+        assert result.stdout.count(b"\n") == 4 * len(expected)
+        assert list(read_fastq(path)) == expected
+    assert not Path(path).exists()
+
+def test_pipe_reader_stopping_early(tmp_path):
+    lanes = write_lanes(tmp_path, gz=False, reads_per_lane=50000)
+    with concatenated_fastq(lanes) as path:
+        with open(path) as f:
+            assert f.readline() == "@lane1_0\n"
+        assert len(list(read_fastq(path))) == 150000
+
+def test_pipe_closed_without_reader(tmp_path):
+    lanes = write_lanes(tmp_path)
+    before = threading.active_count()
+    with concatenated_fastq(lanes):
+        pass
+    assert threading.active_count() == before
+
+def test_truncated_record_FORCED_FAIL(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_text("@r1\nACGT\n+\nIIII\n@r2\nACGT\n")
+    with pytest.raises(ValueError, match="Truncated record 2"):
+        list(read_fastq(path))
+
+@pytest.mark.parametrize("gz", [True, False])
+def test_count_fastq_records(tmp_path, gz):
+    lane, = write_lanes(tmp_path, n_lanes=1, reads_per_lane=50000, gz=gz)
+    assert count_fastq_records(lane) == 50000
+
+def test_count_concatenated_gzip_members(tmp_path):
+    lanes = write_lanes(tmp_path)
+    combined = tmp_path / "combined.fastq.gz"
+    combined.write_bytes(b"".join(Path(lane).read_bytes() for lane in lanes))
+    assert count_fastq_records(combined) == 6000
+
+def test_count_trailing_blank_lines(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_text("@r1\nACGT\n+\nIIII\n@r2\nACGT\n+\nIIII\n\n\n")
+    assert count_fastq_records(path) == 2
+
+def test_count_truncated_gzip_FORCED_FAIL(tmp_path):
+    lane, = write_lanes(tmp_path, n_lanes=1)
+    data = Path(lane).read_bytes()
+    Path(lane).write_bytes(data[:len(data) // 2])
+    with pytest.raises(ValueError, match="Truncated gzip member"):
+        count_fastq_records(lane)
+
+def test_count_corrupt_gzip_FORCED_FAIL(tmp_path):
+    lane, = write_lanes(tmp_path, n_lanes=1)
+    data = bytearray(Path(lane).read_bytes())
+    data[-6] ^= 0xFF                                    # breaks the CRC
+    Path(lane).write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="Unreadable fastq"):
+        count_fastq_records(lane)
+
+@pytest.mark.parametrize("text, message", [
+    ("@r1\nACGT\n+\nIIII\n@r2\nACGT\n", "Truncated record 2"),
+    ("@r1\nACGT\n+\nIIII\n@r2\nACGT\n+\nIII\n", "Malformed record 2"),
+    ("@r1\nACGT\n+\nIIII\nr2\nACGT\n+\nIIII\n", "Malformed record 2"),
+    ("@r1\nACGT\n-\nIIII\n", "Malformed record 1"),
+])
+def test_count_malformed_FORCED_FAIL(tmp_path, text, message):
+    path = tmp_path / "reads.fastq"
+    path.write_text(text)
+    with pytest.raises(ValueError, match=message):
+        count_fastq_records(path)
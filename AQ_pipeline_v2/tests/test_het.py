@@ -1,15 +1,30 @@
 import pandas as pd
+import pytest
+import random
+from analysis.abe import calculate_abe_metrics
 from analysis.heterozygous import find_het_position
-from pipeline.quantify import calculate_het_correction, calculate_het_protospacer_metrics
+from utils.sequences import reverse_complement
 import logging
 
 """Tests for analysis/heterozygous.py - covers find_het_position (basic detection, 
 threshold edges, A/G and C/T edit skip, deletion/non-canonical base skip, multiple 
-het positions), calculate_het_correction (basic, multiple positions, insertion 
-skip with and without warning), and calculate_het_protospacer_metrics (basic, 
-multiple positions, insertion skip F/R, allele2-only insertion, deletion 
-non-regression, all-insertion edge case, shorter-than-protospacer skip, warning 
-message content)."""
+het positions), and the per-allele metrics of calculate_abe_metrics: correction (basic,
+multiple positions, insertion skip with and without warning, unsorted reads warning) and
+protospacer metrics (basic, multiple positions, insertion skip F/R, allele2-only insertion,
+deletion non-regression, all-insertion edge case, shorter-than-protospacer skip, warning
+message content), checked against a row-by-row reference in F and R, per-allele
+percentages from exact #Reads counts, and invalid orientation FORCED FAIL."""
+
+
+def _het_correction(table, search_seqs, het_pos, base1, base2, reads_aligned=None):
+    """the per-allele calculate_abe_metrics of a heterozygous sample. Only the search sequences
+        matter to the correction metrics, so the perfect correction stands in for the protospacer"""
+    return calculate_abe_metrics(table, search_seqs, search_seqs[0], 1, "F", het_pos, base1, base2, reads_aligned)
+
+def _het_protospacer_metrics(table, protospacer, intended_edit, orientation, het_pos, base1, base2, reads_aligned=None):
+    """the per-allele calculate_abe_metrics of a heterozygous sample, for the protospacer metrics"""
+    return calculate_abe_metrics(table, [protospacer], protospacer, intended_edit, orientation, het_pos, base1, base2,
+                                 reads_aligned)
 
 
 
@@ -110,7 +125,7 @@ def test_find_ALL_het_positions():
     assert base1 == "A"
     assert base2 == "T"
 
-def test_calculate_het_correction_basic():
+def test_het_correction_basic():
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCACCHTTTTCCCCCTTTTT",  # allele1, matches search_seqs[0] (wo bystanders)
@@ -125,14 +140,14 @@ def test_calculate_het_correction_basic():
     base1 = "H"
     base2 = "X"
 
-    result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+    result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     assert round(result["correction_w_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_wo_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_w_bystanders_allele2"], 2) == 75.0
     assert round(result["correction_wo_bystanders_allele2"], 2) == 0.0
 
-def test_calculate_het_protospacer_metrics_basic():
+def test_het_protospacer_metrics_basic():
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCGCCCTATTCCCCCTTTTT",  # allele1, matches search_seqs[0] (wo bystanders)
@@ -148,7 +163,7 @@ def test_calculate_het_protospacer_metrics_basic():
     het_pos = [5]
     base1 = "C"
     base2 = "T"
-    result = calculate_het_protospacer_metrics(table, 
+    result = _het_protospacer_metrics(table, 
                                       protospacer, 
                                       intended_edit, 
                                       orientation,
@@ -160,7 +175,7 @@ def test_calculate_het_protospacer_metrics_basic():
     assert round(result["correction_with_any_AtoG_change_allele2"], 2) == 75.00
     assert round(result["correction_with_any_change_in_protospacer_allele2"], 2) == 75.0
 
-def test_calculate_het_correction_multiple_pos():
+def test_het_correction_multiple_pos():
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCACCHTTTTCCHCCTTTTT",  # allele1, matches search_seqs[0] (wo bystanders)
@@ -174,14 +189,14 @@ def test_calculate_het_correction_multiple_pos():
     het_pos = [5,12]
     base1 = "H"
     base2 = "X"
-    result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+    result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     assert round(result["correction_w_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_wo_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_w_bystanders_allele2"], 2) == 75.0
     assert round(result["correction_wo_bystanders_allele2"], 2) == 0.0
 
-def test_calculate_het_protospacer_metrics_multiple_pos():
+def test_het_protospacer_metrics_multiple_pos():
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCGCCCTATTCCCCCTTTTT",  # allele1, matches search_seqs[0] (wo bystanders)
@@ -197,7 +212,7 @@ def test_calculate_het_protospacer_metrics_multiple_pos():
     het_pos = [5,11]
     base1 = "C"
     base2 = "T"
-    result = calculate_het_protospacer_metrics(table, 
+    result = _het_protospacer_metrics(table, 
                                       protospacer, 
                                       intended_edit, 
                                       orientation,
@@ -240,7 +255,7 @@ def test_het_single_insertion_F_skipped_and_warned(caplog):
     base2 = "T"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -270,7 +285,7 @@ def test_het_single_insertion_R_skipped_and_warned(caplog):
     base2 = "C"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -299,7 +314,7 @@ def test_het_single_insertion_allele2_only(caplog):
     base2 = "T"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -329,7 +344,7 @@ def test_deletion_not_skipped(caplog):
 
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -357,7 +372,7 @@ def test_all_rows_are_insertions(caplog):
     base2 = "T"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -387,7 +402,7 @@ def test_het_shorter_than_protospacer_also_skipped(caplog):
     base2 = "T"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
 
@@ -416,7 +431,7 @@ def test_warning_message_content(caplog):
     base2 = "T"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_protospacer_metrics(
+        result = _het_protospacer_metrics(
             table, protospacer, intended_edit, orientation, het_pos, base1, base2
         )
     assert round(result["correction_with_any_AtoG_change_allele1"], 2) == 64.0
@@ -446,7 +461,7 @@ def test_het_correction_single_insertion_skipped_and_warned(caplog):
     base2 = "X"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+        result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     assert round(result["correction_w_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_wo_bystanders_allele1"], 2) == 66.67
@@ -472,7 +487,7 @@ def test_het_correction_single_insertion_skipped_and_not_warned(caplog):
     base2 = "X"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+        result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     assert round(result["correction_w_bystanders_allele1"], 2) == 66.67
     assert round(result["correction_wo_bystanders_allele1"], 2) == 66.67
@@ -480,7 +495,7 @@ def test_het_correction_single_insertion_skipped_and_not_warned(caplog):
     assert round(result["correction_wo_bystanders_allele2"], 2) == 0.0
     assert "alignment shift" not in caplog.text
 
-def test_calculate_het_correction_unsorted_reads_warned(caplog):
+def test_het_correction_unsorted_reads_warned(caplog):
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCACCHTTTTCCCCCTTTTT",  # allele1 (H), matches search_seqs[0] — wo bystanders
@@ -497,7 +512,7 @@ def test_calculate_het_correction_unsorted_reads_warned(caplog):
     base2 = "X"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+        result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     # warning should fire
     assert "20.00" in caplog.text       # the unsorted pct
@@ -513,7 +528,7 @@ def test_calculate_het_correction_unsorted_reads_warned(caplog):
     assert round(result["correction_w_bystanders_allele2"], 2) == 71.43
 
 
-def test_calculate_het_correction_unsorted_reads_NOT_warned(caplog):
+def test_het_correction_unsorted_reads_NOT_warned(caplog):
     table = pd.DataFrame({
         "Aligned_Sequence": [
             "CCACCHTTTTCCCCCTTTTT",  
@@ -530,6 +545,72 @@ def test_calculate_het_correction_unsorted_reads_NOT_warned(caplog):
     base2 = "X"
 
     with caplog.at_level(logging.WARNING):
-        result = calculate_het_correction(table, search_seqs, het_pos, base1, base2)
+        result = _het_correction(table, search_seqs, het_pos, base1, base2)
 
     assert "other than" not in caplog.text
+
+
+def _het_metrics_reference(table, search_seqs, protospacer, intended_edit, orientation, het_pos, base1, base2):
+    """Row-by-row version of the per-allele metrics, to check the vectorized ones against"""
+    ref = protospacer if orientation == "F" else reverse_complement(protospacer)
+    idx, from_base, to_base = (intended_edit - 1, "A", "G") if orientation == "F" else (len(ref) - intended_edit, "T", "C")
+    sums = {allele: {"total": 0, "wo": 0, "w": 0, "any": 0, "AtoG": 0} for allele in ("allele1", "allele2")}
+    for seq, pct in zip(table["Aligned_Sequence"], table["%Reads"]):
+        if len(seq) != len(ref) or seq[het_pos[0]] not in (base1, base2):
+            continue
+        allele = sums["allele1" if seq[het_pos[0]] == base1 else "allele2"]
+        allele["total"] += pct
+        allele["wo"] += pct if seq == search_seqs[0] else 0
+        allele["w"] += pct if seq in search_seqs else 0
+        if seq[idx] == to_base:
+            allele["any"] += pct
+            if all(i in het_pos or c == r or (r == from_base and c == to_base) for i, (c, r) in enumerate(zip(seq, ref))):
+                allele["AtoG"] += pct
+    expected = {}
+    for name, allele in sums.items():
+        for key, metric in (("wo", "correction_wo_bystanders"), ("w", "correction_w_bystanders"),
+                            ("AtoG", "correction_with_any_AtoG_change"), ("any", "correction_with_any_change_in_protospacer")):
+            expected[f"{metric}_{name}"] = allele[key] / allele["total"] * 100 if allele["total"] > 0 else 0.0
+        expected[f"total_pct_{name}"] = allele["total"]
+    return expected
+
+@pytest.mark.parametrize("orientation", ["F", "R"])
+def test_het_metrics_match_row_by_row_reference(orientation):
+    rng = random.Random(17)
+    protospacer = "TCACAGTTCGGGGGTATACA"
+    ref = protospacer if orientation == "F" else reverse_complement(protospacer)
+    het_pos = [7, 12]
+    seqs = []
+    for _ in range(2000):
+        seq = list(ref)
+        seq[7] = rng.choice("CCCCCCGGGGGGA")       # mostly the two alleles, a few unsorted
+        for _ in range(rng.randint(0, 3)):
+            seq[rng.randrange(len(seq))] = rng.choice("ACGT-")
+        if rng.random() < 0.02:
+            seq.insert(rng.randrange(len(seq)), "A")
+        seqs.append("".join(seq))
+    table = pd.DataFrame({"Aligned_Sequence": seqs, "%Reads": [round(rng.random(), 2) for _ in seqs]})
+    search_seqs = [ref, seqs[0], seqs[1]]
+
+    result = calculate_abe_metrics(table, search_seqs, protospacer, 5, orientation, het_pos, "C", "G")
+
+    expected = _het_metrics_reference(table, search_seqs, protospacer, 5, orientation, het_pos, "C", "G")
+    assert {key: result[key] for key in expected} == expected
+
+def test_het_metrics_from_read_counts():
+    table = pd.DataFrame({
+        "Aligned_Sequence": ["GTTCTTTT", "ATTCTTTT", "GTTATTTT", "ATTATTTT", "ATTGTTTT"],
+        "#Reads": [1, 2, 1, 1, 1],
+        "%Reads": [16.67, 33.33, 16.67, 16.67, 16.67],
+    })
+    result = calculate_abe_metrics(table, ["GTTCTTTT", "GTTATTTT"], "ATTCTTTT", 1, "F", [3], "C", "A", reads_aligned=6)
+    assert result["correction_wo_bystanders_allele1"] == 1 / 3 * 100
+    assert result["total_pct_allele1"] == 3 / 6 * 100
+    assert result["total_pct_allele2"] == 2 / 6 * 100
+    assert result["correction_with_any_change_in_protospacer_allele1"] == 1 / 3 * 100
+    assert result["correction_with_any_AtoG_change_allele2"] == 50.0
+
+def test_het_protospacer_metrics_invalid_orientation_FORCED_FAIL():
+    table = pd.DataFrame({"Aligned_Sequence": ["ATTTTTTT"], "%Reads": [100.0]})
+    with pytest.raises(ValueError, match="orientation"):
+        _het_protospacer_metrics(table, "ATTTTTTT", 1, "X", [3], "T", "C")
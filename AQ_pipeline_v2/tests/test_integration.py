@@ -1,6 +1,6 @@
 import subprocess
 from pathlib import Path
-from tests.helper import make_fastq_gz, make_nuclease_fastq_gz
+from tests.helper import SAMPLE_READS, fake_crispresso, make_config, make_fastq_gz, make_nuclease_fastq_gz, write_sample
 from utils.sequences import reverse_complement
 import os
 import pandas as pd
@@ -8,8 +8,8 @@ import shutil
 
 """End-to-end integration tests for the AQ pipeline - covers ABE (forward + reverse), 
 het ABE (heterozygous forward + reverse), and ONESEQ (forward + reverse) full 
-workflows. Each test builds a tmp_path directory with fastq files and amplicon_list, 
-then invokes CRISPResso_Loop.py and Quantification_Loop.py via subprocess. Output 
+workflows, and --resume combined with --incremental keeping one summary row per sample.
+Each test builds a tmp_path directory with fastq files and amplicon_list, then invokes CRISPResso_Loop.py and Quantification_Loop.py via subprocess. Output 
 CSVs are saved to tests/test_output/ for manual inspection.
 
 Requires: Linux or macOS environment with CRISPResso installed (Windows users 
@@ -365,3 +365,23 @@ def test_failed_samples_csv_generated(tmp_path):
     assert df["error_type"].iloc[0] == "ValueError"
     assert "amplicon" in df["error_message"].iloc[0].lower()
     assert not (tmp_path / "ABE_Quantification_Summary.csv").exists()
+
+def test_resume_with_incremental(tmp_path):
+    # CRISPResso output is written by the test fake, so CRISPResso is not needed
+    config = make_config()
+    with open(tmp_path / "amplicon_list.csv", "w") as f:
+        f.write("name,protospacer_or_PEG,editor,guide_orientation_relative_to_amplicon,amplicon,note,tolerated_edits,intended_edit\n")
+        f.write(f"{config.name},{config.protospacer},ABE,F,{config.amplicon},,14,6\n")
+    (tmp_path / "fastqs").mkdir()
+    for name in ("TEST1_1", "TEST1_2"):
+        fake_crispresso([])(config, write_sample(tmp_path / "fastqs", name, SAMPLE_READS))
+
+    quantify = ["python", str(Path(__file__).parent.parent / "Quantification_Loop.py")]
+    subprocess.run(quantify, cwd=tmp_path, env=env, input="n\n", text=True, check=True)
+    first = pd.read_csv(tmp_path / "ABE_Quantification_Summary.csv")
+    # both samples are journaled as quantified, and both already have a summary row
+    subprocess.run(quantify + ["--resume", "--incremental"], cwd=tmp_path, env=env, input="n\n", text=True, check=True)
+    resumed = pd.read_csv(tmp_path / "ABE_Quantification_Summary.csv")
+
+    assert resumed["sample"].tolist() == ["TEST1_1", "TEST1_2"]
+    pd.testing.assert_frame_equal(resumed, first)
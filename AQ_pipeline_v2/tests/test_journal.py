@@ -0,0 +1,60 @@
+import json
+import numpy as np
+from pipeline.journal import RunJournal, MATCHED, CRISPRESSO_DONE, QUANTIFIED, FAILED
+
+
+"""Tests for pipeline/journal.py - covers recording states, resuming from an existing
+journal, starting a fresh journal, numpy values in results, and a truncated final line"""
+
+
+def test_record_and_state(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record("Sample_PAH1_1", MATCHED, amplicon="PAH1")
+    journal.record("Sample_PAH1_1", CRISPRESSO_DONE, amplicon="PAH1")
+
+    assert journal.state("Sample_PAH1_1") == CRISPRESSO_DONE
+    assert journal.state("Sample_R186W_1") is None
+    lines = (tmp_path / "journal.jsonl").read_text().splitlines()
+    assert [json.loads(line)["state"] for line in lines] == [MATCHED, CRISPRESSO_DONE]
+
+def test_resume_loads_last_state(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record("Sample_PAH1_1", MATCHED)
+    journal.record("Sample_PAH1_1", QUANTIFIED, summary_type="ABE", result={"sample": "Sample_PAH1_1", "reads_total": 10})
+    journal.record("Sample_R186W_1", FAILED, error_type="ValueError", error_message="bad")
+
+    resumed = RunJournal(tmp_path / "journal.jsonl", resume=True)
+    assert resumed.state("Sample_PAH1_1") == QUANTIFIED
+    assert resumed.entries["Sample_PAH1_1"]["result"]["reads_total"] == 10
+    assert resumed.state("Sample_R186W_1") == FAILED
+
+def test_fresh_run_discards_previous_entries(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record("Sample_PAH1_1", CRISPRESSO_DONE)
+
+    fresh = RunJournal(tmp_path / "journal.jsonl")
+    assert fresh.state("Sample_PAH1_1") is None
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+
+def test_resume_without_existing_journal(tmp_path):
+    journal = RunJournal(tmp_path / "logs" / "journal.jsonl", resume=True)
+    assert journal.entries == {}
+    journal.record("Sample_PAH1_1", MATCHED)
+    assert (tmp_path / "logs" / "journal.jsonl").exists()
+
+def test_numpy_values_are_serialized(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record("Sample_PAH1_1", QUANTIFIED, result={"reads_total": np.int64(7), "pct": np.float64(12.5)})
+
+    resumed = RunJournal(tmp_path / "journal.jsonl", resume=True)
+    assert resumed.entries["Sample_PAH1_1"]["result"] == {"reads_total": 7, "pct": 12.5}
+
+def test_truncated_final_line_is_ignored(tmp_path):
+    journal = RunJournal(tmp_path / "journal.jsonl")
+    journal.record("Sample_PAH1_1", CRISPRESSO_DONE)
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write('{"sample": "Sample_R186W_1", "sta')
+
+    resumed = RunJournal(tmp_path / "journal.jsonl", resume=True)
+    assert resumed.state("Sample_PAH1_1") == CRISPRESSO_DONE
+    assert resumed.state("Sample_R186W_1") is None
@@ -0,0 +1,51 @@
+import random
+from tests.helper import make_config
+from utils.kmers import KmerIndex, kmers
+from utils.sequences import reverse_complement
+
+"""Tests for utils/kmers.py - covers k-mers with and without a stride, assigning
+reads from either strand, reads with sequencing errors, rows sharing an amplicon sequence,
+and reads that match no amplicon."""
+
+rng = random.Random(13)
+AMPLICONS = ["".join(rng.choice("ACGT") for _ in range(220)) for _ in range(5)]
+
+
+def amplicon_config(name, amplicon):
+    return make_config(name=name, amplicon=amplicon, protospacer=amplicon[100:120], tolerated_edits=[])
+
+def make_configs():
+    return [amplicon_config(f"AMP{i}", amplicon) for i, amplicon in enumerate(AMPLICONS)]
+
+def test_kmers():
+    assert kmers("ACGTAC", k=3) == ["ACG", "CGT", "GTA", "TAC"]
+    assert kmers("ACGTAC", k=3, stride=2) == ["ACG", "GTA"]
+    assert kmers("ACGTACG", k=3, stride=2) == ["ACG", "GTA", "ACG"]
+    assert kmers("AC", k=3) == []
+
+def test_assign_read_both_strands():
+    configs = make_configs()
+    index = KmerIndex(configs)
+    for config in configs:
+        assert index.assign_read(config.amplicon[20:170]) is config
+        assert index.assign_read(reverse_complement(config.amplicon[50:200])) is config
+
+def test_assign_read_with_errors():
+    configs = make_configs()
+    index = KmerIndex(configs)
+    read = list(configs[3].amplicon[:150])
+    for position in (30, 70, 110):
+        read[position] = "A" if read[position] != "A" else "C"
+    assert index.assign_read("".join(read)) is configs[3]
+
+def test_shared_amplicon_sequence():
+    configs = make_configs() + [amplicon_config("AMP0_GUIDE2", AMPLICONS[0])]
+    index = KmerIndex(configs)
+    assert index.candidates(AMPLICONS[0][:150]) == [configs[0], configs[-1]]
+    assert index.assign_read(AMPLICONS[0][:150]) is configs[0]
+
+def test_unrelated_read():
+    index = KmerIndex(make_configs())
+    assert index.assign_read("".join(rng.choice("ACGT") for _ in range(150))) is None
+    assert index.assign_read("N" * 150) is None
+    assert index.candidates("ACGT") == []
@@ -1,11 +1,16 @@
+import pandas as pd
 import pytest
+from importlib.util import find_spec
+from loaders import crispresso_output
 from loaders.amplicon_list import load_amplicon_list, find_amplicon_list
 from config import AmpliconConfig
-from loaders.crispresso_output import read_allele_table, read_mapping_stats, read_editing_frequency
+from loaders.crispresso_output import (ABE_ALLELE_COLUMNS, NUCLEASE_ALLELE_COLUMNS, iter_allele_table, read_allele_table,
+                                       read_mapping_stats, read_editing_frequency)
 
 
 """Tests for loaders/amplicon_list.py - covers CSV parsing, tolerated edit formats,
-and amplicon list file discovery."""
+and amplicon list file discovery. Also covers the CRISPResso output loaders, including the
+pyarrow allele table parser matching the C parser (skipped without pyarrow)."""
 
 def test_parse_single_row(tmp_path):
     csv_file = tmp_path / "amplicon_list.csv"
@@ -235,6 +240,65 @@ def test_read_allele_table(tmp_path):
     assert len(result) == 2
     assert list(result.columns) == ["Aligned_Sequence","Reference_Sequence","Unedited","n_deleted","n_inserted","n_mutated","#Reads","%Reads"] 
     assert result["#Reads"][0] == 11185
+    assert result["#Reads"].dtype == "int64"
+
+def test_read_allele_table_columns(tmp_path):
+    allele_file = tmp_path / "Alleles_frequency_table_around.txt"
+    allele_file.write_text(
+        "Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads\n"
+        "AAGCGAACGT\tAATCGAACGT\tFalse\t0\t0\t1\t11185\t45.92\n"
+        "AAT---ACGT\tAATCGAACGT\tFalse\t3\t0\t0\t10150\t41.67\n"
+    )
+    abe = read_allele_table(allele_file, ABE_ALLELE_COLUMNS)
+    assert list(abe.columns) == ["Aligned_Sequence", "#Reads", "%Reads"]
+    nuclease = read_allele_table(allele_file, NUCLEASE_ALLELE_COLUMNS)
+    assert list(nuclease.columns) == ["n_deleted", "n_inserted", "#Reads", "%Reads"]
+    assert nuclease["n_deleted"].dtype == "int32"
+    assert nuclease["#Reads"].tolist() == [11185, 10150]
+
+def test_read_allele_table_columns_missing_skipped(tmp_path):
+    allele_file = tmp_path / "Alleles_frequency_table_around.txt"
+    allele_file.write_text("Aligned_Sequence\t%Reads\nAAGCGAACGT\t100.0\n")
+    assert list(read_allele_table(allele_file, ABE_ALLELE_COLUMNS).columns) == ["Aligned_Sequence", "%Reads"]
+
+@pytest.mark.parametrize("engine", [
+    "c",
+    pytest.param("pyarrow", marks=pytest.mark.skipif(find_spec("pyarrow") is None, reason="pyarrow is not installed")),
+])
+def test_parse_allele_table_engine(tmp_path, monkeypatch, engine):
+    allele_file = tmp_path / "Alleles_frequency_table_around.txt"
+    allele_file.write_text(
+        "Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads\n"
+        "AAGCGAACGT\tAATCGAACGT\tFalse\t0\t0\t1\t11185\t45.92\n"
+        "AAT---ACGT\tAATCGAACGT\tFalse\t3\t0\t0\t10150\t41.67\n"
+    )
+    monkeypatch.setattr(crispresso_output, "ALLELE_TABLE_ENGINE", "c")
+    expected = {columns: crispresso_output._parse_allele_table(allele_file, columns)
+                for columns in (None, ABE_ALLELE_COLUMNS, NUCLEASE_ALLELE_COLUMNS)}
+    monkeypatch.setattr(crispresso_output, "ALLELE_TABLE_ENGINE", engine)
+    for columns, table in expected.items():
+        result = crispresso_output._parse_allele_table(allele_file, columns)
+        pd.testing.assert_frame_equal(result, table)
+    assert result["#Reads"].dtype == "int64"
+    assert result["n_deleted"].dtype == "int32"
+
+def test_iter_allele_table(tmp_path):
+    allele_file = tmp_path / "Alleles_frequency_table.txt"
+    allele_file.write_text(
+        "Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads\n"
+        + "".join(f"AAGCGAACG{i}\tAATCGAACGT\tFalse\t0\t0\t1\t{i}\t1.0\n" for i in range(5))
+    )
+    chunks = list(iter_allele_table(allele_file, ABE_ALLELE_COLUMNS, chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ["Aligned_Sequence", "#Reads", "%Reads"]
+    assert pd.concat(chunks)["#Reads"].tolist() == [0, 1, 2, 3, 4]
+    assert chunks[0]["#Reads"].dtype == "int64"
+
+def test_iter_allele_table_empty(tmp_path):
+    allele_file = tmp_path / "Alleles_frequency_table.txt"
+    allele_file.write_text("Aligned_Sequence\t#Reads\t%Reads\n")
+    chunks = list(iter_allele_table(allele_file))
+    assert len(chunks) == 1 and chunks[0].empty
 
 def test_read_allele_table_file_not_found_FORCED_FAIL(tmp_path):
     with pytest.raises(FileNotFoundError):
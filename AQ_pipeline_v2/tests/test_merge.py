@@ -0,0 +1,173 @@
+import pytest
+import pandas as pd
+import importlib
+import json
+from pipeline.merge import (MERGE_RECORD_FILE, check_amplicon, merge_allele_tables, merge_crispresso_outputs,
+                            merge_editing_frequencies, merge_mapping_stats, merge_quant_windows, merge_record,
+                            write_merge_record)
+from tests.helper import make_config
+
+"""Tests for pipeline/merge.py - covers summing allele tables and recomputing %Reads, summing
+mapping statistics and editing frequency counts, read-weighted quantification windows, merging
+whole CRISPResso_on_* folders and recording their inputs, merge records ignored once the
+mapping statistics are rewritten, checking outputs against their amplicon, CRISPResso_Merge.py
+replacing one of its inputs with --force and looking up --amplicon, and windows, guides or
+amplicons that do not match, existing output without --force or an unknown --amplicon FORCED
+FAIL."""
+
+
+def merge_config(protospacer="ACGT"):
+    return make_config(protospacer=protospacer, amplicon="TTTAACGTTT", intended_edit=1, tolerated_edits=[])
+
+def allele_table(rows):
+    return pd.DataFrame([(a, r, a == r, n, 0.0) for a, r, n in rows],
+                        columns=["Aligned_Sequence", "Reference_Sequence", "Unedited", "#Reads", "%Reads"])
+
+def quant_window(a_fraction):
+    return pd.DataFrame({"A": [a_fraction, 1 - a_fraction], "C": [0.0, 1.0]}, index=pd.Index(["A", "G"], name="Nucleotide"))
+
+def write_output(folder, rows, a_fraction, reads_in_inputs, guide="ACGT"):
+    folder.mkdir(parents=True)
+    aligned = sum(n for _, _, n in rows)
+    allele_table(rows).to_csv(folder / f"Alleles_frequency_table_around_sgRNA_{guide}.txt", sep="\t", index=False)
+    (folder / "CRISPResso_mapping_statistics.txt").write_text(
+        "READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\tN_COMPUTED_ALN\n"
+        f"{reads_in_inputs}\t{reads_in_inputs}\t{aligned}\t3\n")
+    quant_window(a_fraction).to_csv(folder / "Quantification_window_nucleotide_percentage_table.txt", sep="\t")
+
+def test_merge_allele_tables():
+    first = allele_table([("AC", "AC", 6), ("GC", "AC", 2)])
+    second = allele_table([("GC", "AC", 5), ("A-", "AC", 1)])
+    merged = merge_allele_tables([first, second], 14)
+    assert merged["Aligned_Sequence"].tolist() == ["GC", "AC", "A-"]
+    assert merged["#Reads"].tolist() == [7, 6, 1]
+    assert merged["%Reads"].tolist() == pytest.approx([50.0, 600 / 14, 100 / 14])
+    assert list(merged.columns) == list(first.columns)
+
+def test_merge_keeps_insertions_apart():
+    merged = merge_allele_tables([allele_table([("ACG", "A-C", 2)]), allele_table([("ACG", "ACG", 3)])], 5)
+    assert len(merged) == 2
+
+def test_merge_mapping_stats():
+    assert merge_mapping_stats([{"READS IN INPUTS": 10, "READS ALIGNED": 8},
+                                {"READS IN INPUTS": 5, "READS ALIGNED": 1}]) == {"READS IN INPUTS": 15, "READS ALIGNED": 9}
+
+def test_merge_quant_windows():
+    merged = merge_quant_windows([quant_window(0.9), quant_window(0.5)], [300, 100])
+    assert merged.loc["A", "A"] == pytest.approx(0.8)
+    assert merged.loc["G", "C"] == pytest.approx(1.0)
+    assert merged.index.name == "Nucleotide"
+
+def test_merge_editing_frequencies():
+    columns = ["Amplicon", "Unmodified%", "Modified%", "Reads_in_input", "Reads_aligned", "Unmodified", "Modified",
+               "Insertions", "Deletions", "Substitutions"]
+    first = pd.DataFrame([["Reference", 75.0, 25.0, 110, 100, 75, 25, 5, 10, 10]], columns=columns)
+    second = pd.DataFrame([["Reference", 50.0, 50.0, 60, 50, 25, 25, 5, 5, 15]], columns=columns)
+    merged = merge_editing_frequencies([first, second])
+    assert merged.iloc[0].tolist() == ["Reference", pytest.approx(200 / 3), pytest.approx(100 / 3), 170, 150, 100, 50, 10, 15, 25]
+
+def test_merge_crispresso_outputs(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6), ("GC", "AC", 2)], 0.75, 10)
+    write_output(tmp_path / "run2", [("GC", "AC", 5)], 0.0, 6)
+    merge_crispresso_outputs([tmp_path / "run1", tmp_path / "run2"], tmp_path / "merged")
+    stats = pd.read_csv(tmp_path / "merged" / "CRISPResso_mapping_statistics.txt", sep="\t")
+    assert stats.iloc[0].tolist() == [16, 16, 13, 6, 0, 0, 0]
+    table = pd.read_csv(tmp_path / "merged" / "Alleles_frequency_table_around_sgRNA_ACGT.txt", sep="\t")
+    assert table["#Reads"].tolist() == [7, 6]
+    window = pd.read_csv(tmp_path / "merged" / "Quantification_window_nucleotide_percentage_table.txt", sep="\t", index_col=0)
+    assert window.loc["A", "A"] == pytest.approx(0.75 * 8 / 13)
+    assert not (tmp_path / "merged" / "CRISPResso_quantification_of_editing_frequency.txt").exists()
+
+def test_mismatched_windows_FORCED_FAIL():
+    with pytest.raises(ValueError, match="do not match"):
+        merge_quant_windows([quant_window(0.5), quant_window(0.5).T], [1, 1])
+
+def test_different_guides_FORCED_FAIL(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("AC", "AC", 6)], 0.75, 10, guide="TTTT")
+    with pytest.raises(ValueError, match="different guides"):
+        merge_crispresso_outputs([tmp_path / "run1", tmp_path / "run2"], tmp_path / "merged")
+
+def test_write_merge_record(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("AC", "AC", 4)], 0.75, 5)
+    merge_crispresso_outputs([tmp_path / "run1", tmp_path / "run2"], tmp_path / "merged")
+    write_merge_record(tmp_path / "merged", [tmp_path / "run1", tmp_path / "run2"])
+    inputs = json.loads((tmp_path / "merged" / MERGE_RECORD_FILE).read_text())["inputs"]
+    assert [(i["reads_in_inputs"], i["reads_aligned"]) for i in inputs] == [(10, 6), (5, 4)]
+    assert merge_record(tmp_path / "merged")["inputs"] == inputs
+
+def test_merge_record_ignored_after_rerun(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("AC", "AC", 4)], 0.75, 5)
+    merge_crispresso_outputs([tmp_path / "run1", tmp_path / "run2"], tmp_path / "merged")
+    write_merge_record(tmp_path / "merged", [tmp_path / "run1", tmp_path / "run2"])
+    # a later CRISPResso run reusing the folder rewrites the mapping statistics only
+    (tmp_path / "merged" / "CRISPResso_mapping_statistics.txt").write_text(
+        "READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n10\t10\t6\n")
+    assert (tmp_path / "merged" / MERGE_RECORD_FILE).exists()
+    assert merge_record(tmp_path / "merged") is None
+    assert merge_record(tmp_path / "run1") is None
+
+def test_check_amplicon(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("GC", "AC", 6)], 0.75, 10)
+    check_amplicon([tmp_path / "run1", tmp_path / "run2"], merge_config())
+
+def test_check_amplicon_guide_FORCED_FAIL(tmp_path):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    with pytest.raises(ValueError, match="run with guide ACGT"):
+        check_amplicon([tmp_path / "run1"], merge_config("ACGA"))
+
+def test_check_amplicon_reference_FORCED_FAIL(tmp_path):
+    write_output(tmp_path / "run1", [("GG", "GG", 6)], 0.75, 10)
+    with pytest.raises(ValueError, match="not part of the TEST1 amplicon"):
+        check_amplicon([tmp_path / "run1"], merge_config())
+
+@pytest.fixture
+def merge_cli(tmp_path, monkeypatch):
+    """CRISPResso_Merge.py run from a project directory holding amplicon_list.csv"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "amplicon_list.csv").write_text(
+        "name,protospacer_or_PEG,editor,guide_orientation_relative_to_amplicon,amplicon,note,tolerated_edits,intended_edit\n"
+        "TEST1,ACGT,ABE,F,TTTAACGTTT,,,1\n")
+    return importlib.import_module("CRISPResso_Merge")
+
+def test_merge_cli_force_replaces_input(tmp_path, merge_cli):
+    output = tmp_path / "fastqs" / "S1_TEST1_1" / "CRISPResso_on_S1_TEST1_1"
+    write_output(output, [("AC", "AC", 6), ("GC", "AC", 2)], 0.75, 10)
+    write_output(tmp_path / "topup" / "CRISPResso_on_S1_TEST1_1", [("GC", "AC", 5)], 0.5, 7)
+    merge_cli.main([str(output), str(tmp_path / "topup" / "CRISPResso_on_S1_TEST1_1"), "--output", str(output), "--force"])
+
+    table = pd.read_csv(output / "Alleles_frequency_table_around_sgRNA_ACGT.txt", sep="\t")
+    assert dict(zip(table["Aligned_Sequence"], table["#Reads"])) == {"GC": 7, "AC": 6}
+    stats = pd.read_csv(output / "CRISPResso_mapping_statistics.txt", sep="\t").iloc[0]
+    assert (stats["READS IN INPUTS"], stats["READS ALIGNED"]) == (17, 13)
+    record = merge_record(output)
+    assert [i["reads_in_inputs"] for i in record["inputs"]] == [10, 7]
+    assert [p.name for p in output.parent.iterdir()] == [output.name]
+
+def test_merge_cli_existing_output_FORCED_FAIL(tmp_path, merge_cli):
+    output = tmp_path / "CRISPResso_on_S1_TEST1_1"
+    write_output(output, [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "topup", [("GC", "AC", 5)], 0.5, 7)
+    with pytest.raises(SystemExit, match="--force"):
+        merge_cli.main([str(output), str(tmp_path / "topup"), "--output", str(output)])
+    assert not (output / MERGE_RECORD_FILE).exists()
+
+def test_merge_cli_amplicon_lookup(tmp_path, merge_cli):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("GC", "AC", 5)], 0.5, 7)
+    # the output name does not hold the amplicon name, so it must be given
+    output = tmp_path / "CRISPResso_on_S1_topup"
+    with pytest.raises(ValueError, match="No valid amplicon match"):
+        merge_cli.main([str(tmp_path / "run1"), str(tmp_path / "run2"), "--output", str(output)])
+    merge_cli.main([str(tmp_path / "run1"), str(tmp_path / "run2"), "--output", str(output), "--amplicon", "TEST1"])
+    assert merge_record(output) is not None
+
+def test_merge_cli_unknown_amplicon_FORCED_FAIL(tmp_path, merge_cli):
+    write_output(tmp_path / "run1", [("AC", "AC", 6)], 0.75, 10)
+    write_output(tmp_path / "run2", [("GC", "AC", 5)], 0.5, 7)
+    with pytest.raises(SystemExit, match="PAH1 is not in amplicon_list.csv"):
+        merge_cli.main([str(tmp_path / "run1"), str(tmp_path / "run2"),
+                        "--output", str(tmp_path / "CRISPResso_on_S1_PAH1_1"), "--amplicon", "PAH1"])
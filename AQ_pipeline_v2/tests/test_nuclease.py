@@ -12,6 +12,18 @@ def test_calcualte_frameshift_basic_mix():
     assert result["pct_frameshift_indels"] == 40
     assert result["pct_inframe_indels"] == 20
 
+def test_calculate_frameshift_from_read_counts():
+    df = pd.DataFrame({
+        "n_inserted": [0, 0, 0, 1],
+        "n_deleted":  [0, 1, 3, 0],
+        "#Reads":     [1, 1, 1, 0],
+        "%Reads":     [33.3, 33.3, 33.3, 0.0],
+    })
+    result = calculate_frameshift(df, reads_aligned=3)
+    assert result["pct_frameshift_indels"] == 33.33
+    assert result["pct_inframe_indels"] == 33.33
+    assert calculate_frameshift(iter([df[:2], df[2:]]), reads_aligned=3) == result
+
 def test_calcualte_frameshift_empty():
     df = pd.DataFrame({
 
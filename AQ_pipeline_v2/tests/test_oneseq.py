@@ -1,79 +1,144 @@
+import random
 import pytest
 import pandas as pd
-from analysis.oneseq import calculate_oneseq
+from analysis.oneseq import calculate_oneseq_edits
+from utils.sequences import reverse_complement
 
-"""Tests for analysis/oneseq.py - covers calculate_oneseq with matches in both 
-first 10bp and full protospacer, no matches, all-match, matches only in full, 
-and the 10bp boundary edge cases (position 10 vs position 11)."""
+"""Tests for analysis/oneseq.py - covers calculate_oneseq_edits forward and reverse, the 10bp
+boundary, protospacers without an A, all reads matching, matches only past the first 10bp,
+non A to G changes and length mismatches, a row-by-row reference on random tables, percentages
+from exact #Reads counts, chunked tables, and invalid orientation FORCED FAIL."""
 
-def test_calculate_oneseq_basic():
+def test_calculate_oneseq_edits_no_A_to_edit():
+    protospacer = "CCCCCTTTTTCCCCCTTTTT"
     table = pd.DataFrame({
-        "Aligned_Sequence": ["CCXCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCXCCTTTTT" ,"CCCCCTTTTTCCCCCTTGTT"],
+        "Aligned_Sequence": ["CCGCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCCCCTTGTT", protospacer],
         "%Reads": [35.0, 25.0, 40.0]
     })
-    first_10_seqs = ["CCXCCTTTTTCCCCCTTTTT"]
-    full_seqs = ["CCXCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCXCCTTTTT"]
-
-    first_10, full_proto = calculate_oneseq(table, first_10_seqs, full_seqs)
-    assert first_10 == 35.0
-    assert full_proto == 60.0
-
-def test_calculate_oneseq_no_matches():
-    table = pd.DataFrame({
-        "Aligned_Sequence": ["CCXCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCXCCTTTTT" ,"CCCCCTTTTTCCCCCTTGTT"],
-        "%Reads": [35.0, 25.0, 40.0]
-    })
-    first_10_seqs = ["CCCCCTTTTTCCCCCTTTTT"]
-    full_seqs = ["CCCCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCCCCTTTTT"]
-
-    first_10, full_proto = calculate_oneseq(table, first_10_seqs, full_seqs)
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
     assert first_10 == 0.0
     assert full_proto == 0.0
 
-def test_calculate_oneseq_all_reads_match():
+def test_calculate_oneseq_edits_all_reads_match():
+    protospacer = "CACCCTTTTTCCACCTTTTT"
     table = pd.DataFrame({
-        "Aligned_Sequence": ["CXCCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCXCCTTTTT"],
+        "Aligned_Sequence": ["CGCCCTTTTTCCACCTTTTT", "CACCCTTTTTCCGCCTTTTT"],
         "%Reads": [35.0, 65.0]
     })
-    first_10_seqs = ["CXCCCTTTTTCCCCCTTTTT"]
-    full_seqs = ["CXCCCTTTTTCCCCCTTTTT", "CCCCCTTTTTCCXCCTTTTT"]
-
-    first_10, full_proto = calculate_oneseq(table, first_10_seqs, full_seqs)
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
     assert first_10 == 35.0
     assert full_proto == 100.0
 
-def test_calculate_oneseq_only_in_full():
+def test_calculate_oneseq_edits_only_in_full():
+    protospacer = "CCCCCTTTTTCCACCTTTTT"
     table = pd.DataFrame({
-        "Aligned_Sequence": ["CCCCCTTTTTCCXCCTTTTT"],
+        "Aligned_Sequence": ["CCCCCTTTTTCCGCCTTTTT"],
         "%Reads": [35.0]
     })
-    first_10_seqs = []
-    full_seqs = ["CCCCCTTTTTCCXCCTTTTT"]
-
-    first_10, full_proto = calculate_oneseq(table,first_10_seqs,full_seqs)
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
     assert first_10 == 0.0
     assert full_proto == 35.0
 
-def test_calculate_oneseq_pos_10():
+def test_calculate_oneseq_edits_forward():
+    protospacer = "GGAGGTTTTTCCACCGGGGG"
     table = pd.DataFrame({
-        "Aligned_Sequence": ["CCCCCTTTTXCCCCCTTTTT"],
-        "%Reads": [35.0]
+        "Aligned_Sequence": ["GGGGGTTTTTCCACCGGGGG", "GGAGGTTTTTCCGCCGGGGG", "GGGGGTTTTTCCGCCGGGGG", protospacer],
+        "%Reads": [35.0, 25.0, 10.0, 30.0]
     })
-    first_10_seqs = ["CCCCCTTTTXCCCCCTTTTT"]
-    full_seqs = ["CCCCCTTTTXCCCCCTTTTT"]
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
+    assert first_10 == 35.0
+    assert full_proto == 70.0
 
-    first_10, full_proto = calculate_oneseq(table,first_10_seqs,full_seqs)
+def test_calculate_oneseq_edits_reverse():
+    protospacer = "GGAGGTTTTTCCACCGGGGG"
+    reference = reverse_complement(protospacer)
+    table = pd.DataFrame({
+        "Aligned_Sequence": [reference.replace("CCTCC", "CCCCC"), reference.replace("GGTGG", "GGCGG"), reference],
+        "%Reads": [35.0, 25.0, 40.0]
+    })
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "R")
     assert first_10 == 35.0
-    assert full_proto == 35.0
+    assert full_proto == 60.0
 
-def test_calculate_oneseq_pos_11():
+def test_calculate_oneseq_edits_pos_10_and_11():
+    protospacer = "CCCCCTTTTAACCCCTTTTT"
     table = pd.DataFrame({
-        "Aligned_Sequence": ["CCCCCTTTTTXCCCCTTTTT"],
-        "%Reads": [35.0]
+        "Aligned_Sequence": ["CCCCCTTTTGACCCCTTTTT", "CCCCCTTTTAGCCCCTTTTT"],
+        "%Reads": [35.0, 25.0]
     })
-    first_10_seqs = []
-    full_seqs = ["CCCCCTTTTTXCCCCTTTTT"]
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
+    assert first_10 == 35.0
+    assert full_proto == 60.0
 
-    first_10, full_proto = calculate_oneseq(table,first_10_seqs,full_seqs)
+def test_calculate_oneseq_edits_other_changes_excluded():
+    protospacer = "GGAGGTTTTTCCACCGGGGG"
+    table = pd.DataFrame({
+        "Aligned_Sequence": ["GGGGGTTTTTCCACCGGGGC", "GGGGGTTTTTCCACCGGGG", "GGTGGTTTTTCCACCGGGGG", "GG-GGTTTTTCCACCGGGGG"],
+        "%Reads": [35.0, 25.0, 20.0, 20.0]
+    })
+    first_10, full_proto = calculate_oneseq_edits(table, protospacer, "F")
     assert first_10 == 0.0
-    assert full_proto == 35.0
\ No newline at end of file
+    assert full_proto == 0.0
+
+def _oneseq_reference(table, protospacer, orientation):
+    """row-by-row reference: an allele counts when it differs from the protospacer and every
+        difference is an A to G edit, within the first 10 bp of the guide for the first metric"""
+    reference = protospacer if orientation == "F" else reverse_complement(protospacer)
+    from_base, to_base = ("A", "G") if orientation == "F" else ("T", "C")
+    first_10 = range(10) if orientation == "F" else range(len(reference) - 10, len(reference))
+    first_10_pct, full_pct = 0.0, 0.0
+    for seq, pct in zip(table["Aligned_Sequence"], table["%Reads"]):
+        if len(seq) != len(reference):
+            continue
+        changes = [i for i, (c, r) in enumerate(zip(seq, reference)) if c != r]
+        if not changes or any(reference[i] != from_base or seq[i] != to_base for i in changes):
+            continue
+        full_pct += pct
+        if all(i in first_10 for i in changes):
+            first_10_pct += pct
+    return first_10_pct, full_pct
+
+@pytest.mark.parametrize("orientation", ["F", "R"])
+def test_calculate_oneseq_edits_matches_row_by_row_reference(orientation):
+    rng = random.Random(7)
+    for _ in range(50):
+        protospacer = "".join(rng.choice("ACGT") for _ in range(20))
+        reference = protospacer if orientation == "F" else reverse_complement(protospacer)
+        from_base, to_base = ("A", "G") if orientation == "F" else ("T", "C")
+        sequences = [reference]
+        for _ in range(40):
+            allele = list(reference)
+            if rng.random() < 0.5:
+                allele = [to_base if c == from_base and rng.random() < 0.3 else c for c in allele]
+            else:
+                allele[rng.randrange(20)] = rng.choice("ACGT-")
+            sequences.append("".join(allele))
+        table = pd.DataFrame({"Aligned_Sequence": sequences, "%Reads": [rng.random() * 5 for _ in sequences]})
+
+        assert calculate_oneseq_edits(table, protospacer, orientation) == _oneseq_reference(table, protospacer, orientation)
+
+def test_calculate_oneseq_edits_from_read_counts():
+    protospacer = "GGAGGTTTTTCCACCGGGGG"
+    table = pd.DataFrame({
+        "Aligned_Sequence": ["GGGGGTTTTTCCACCGGGGG", "GGAGGTTTTTCCGCCGGGGG", protospacer],
+        "#Reads": [1, 1, 1],
+        "%Reads": [33.33, 33.33, 33.33]
+    })
+    assert calculate_oneseq_edits(table, protospacer, "F") == (33.33, 66.66)
+    assert calculate_oneseq_edits(table, protospacer, "F", reads_aligned=3) == (1 / 3 * 100, 2 / 3 * 100)
+
+def test_calculate_oneseq_edits_over_chunks():
+    protospacer = "GGAGGTTTTTCCACCGGGGG"
+    table = pd.DataFrame({
+        "Aligned_Sequence": ["GGGGGTTTTTCCACCGGGGG", "GGAGGTTTTTCCGCCGGGGG", protospacer, "GGGGGTTTTTCCGCCGGGGG"],
+        "#Reads": [3, 5, 7, 11],
+        "%Reads": [11.54, 19.23, 26.92, 42.31]
+    })
+    chunks = iter([table[:1], table[1:3], table[3:]])
+    assert calculate_oneseq_edits(chunks, protospacer, "F", reads_aligned=26) == \
+        calculate_oneseq_edits(table, protospacer, "F", reads_aligned=26) == (3 / 26 * 100, 19 / 26 * 100)
+
+def test_calculate_oneseq_edits_invalid_orientation_FORCED_FAIL():
+    table = pd.DataFrame({"Aligned_Sequence": ["GGGGG"], "%Reads": [100.0]})
+    with pytest.raises(ValueError):
+        calculate_oneseq_edits(table, "GGAGG", "X")
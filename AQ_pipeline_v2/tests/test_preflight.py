@@ -0,0 +1,67 @@
+import gzip
+import random
+import pytest
+from pathlib import Path
+from config import AmpliconConfig
+from pipeline.crispresso import AmpliconIndex
+from pipeline.preflight import preflight_amplicon
+from utils.kmers import KmerIndex
+
+"""Tests for pipeline/preflight.py - covers confirming the name matched amplicon, proposing
+the amplicon the reads come from when the directory name is wrong or missing, tolerating
+reads from other amplicons, and samples whose reads match nothing or that have no reads
+FORCED FAIL."""
+
+rng = random.Random(7)
+AMPLICONS = {name: "".join(rng.choice("ACGT") for _ in range(220)) for name in ("PAH1", "PAH2", "CFTR1")}
+
+
+def make_indexes():
+    configs = [
+        AmpliconConfig(name=name, protospacer=amplicon[100:120], editor="ABE", orientation="F",
+                       amplicon=amplicon, intended_edit=6, tolerated_edits=[], note="")
+        for name, amplicon in AMPLICONS.items()
+    ]
+    return AmpliconIndex(configs), KmerIndex(configs)
+
+def write_sample(root: Path, name: str, sequences: list[str]) -> Path:
+    sample_dir = root / name
+    sample_dir.mkdir()
+    with gzip.open(sample_dir / f"{name}_R1_001.fastq.gz", "wt") as f:
+        for i, sequence in enumerate(sequences):
+            f.write(f"@read_{i}\n{sequence}\n+\n{'I' * len(sequence)}\n")
+    return sample_dir
+
+def test_confirmed(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_PAH2_A1", [AMPLICONS["PAH2"][:150]] * 80 + [AMPLICONS["CFTR1"][:150]] * 20)
+    assert preflight_amplicon(sample_dir, amplicon_configs, kmer_index).name == "PAH2"
+
+def test_only_first_reads_checked(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_PAH2_A1", [AMPLICONS["PAH2"][:150]] * 10 + ["N" * 150] * 90)
+    assert preflight_amplicon(sample_dir, amplicon_configs, kmer_index, n_reads=10).name == "PAH2"
+
+def test_wrong_name_proposes_amplicon_FORCED_FAIL(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_PAH1_A1", [AMPLICONS["CFTR1"][60:210]] * 50)
+    with pytest.raises(ValueError, match="matched PAH1 by name.*look like CFTR1"):
+        preflight_amplicon(sample_dir, amplicon_configs, kmer_index)
+
+def test_missing_name_proposes_amplicon_FORCED_FAIL(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_A1", [AMPLICONS["PAH1"][:150]] * 50)
+    with pytest.raises(ValueError, match="matched no amplicon by name.*look like PAH1"):
+        preflight_amplicon(sample_dir, amplicon_configs, kmer_index)
+
+def test_unmatched_reads_FORCED_FAIL(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_PAH1_A1", ["".join(rng.choice("ACGT") for _ in range(150)) for _ in range(50)])
+    with pytest.raises(ValueError, match="no amplicon is supported"):
+        preflight_amplicon(sample_dir, amplicon_configs, kmer_index)
+
+def test_no_reads_FORCED_FAIL(tmp_path):
+    amplicon_configs, kmer_index = make_indexes()
+    sample_dir = write_sample(tmp_path, "Plate1_PAH1_A1", [])
+    with pytest.raises(ValueError, match="no reads"):
+        preflight_amplicon(sample_dir, amplicon_configs, kmer_index)
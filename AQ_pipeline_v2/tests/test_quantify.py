@@ -1,6 +1,7 @@
 import pytest
 from pathlib import Path
-from pipeline.quantify import quantify_sample, quantify_nuclease_sample
+import os
+from pipeline.quantify import quantify_sample, quantify_nuclease_sample, quantify_samples, summary_sample_name, latest_crispresso_output_mtime
 from config import AmpliconConfig
 from unittest.mock import patch
 import pandas as pd
@@ -9,7 +10,9 @@ from tests.helper import make_dummy_crispresso_output
 """Tests for pipeline/quantify.py - covers end-to-end quantify_sample with mock 
 CRISPResso outputs, missing CRISPResso subfolder forced fail, multiple allele 
 tables forced fail, and dispatch routing tests (ONESEQ, ABE non-het, ABE het, 
-unknown editor forced fail)."""
+unknown editor forced fail), and quantify_samples serially and on a process pool,
+including a failing sample, summary sample names, and the CRISPResso output modification
+time used by --incremental."""
 
 
 
@@ -48,7 +51,7 @@ def test_quantify_sample(tmp_path):
     assert result["reads_total"] == 6500
     assert result["reads_aligned"] == 6000
     assert result["correction_without_bystanders"] == 15
-    assert result["correction_with_tolerated_bystanders"] == 28.33
+    assert result["correction_with_tolerated_bystanders"] == 1700 / 6000 * 100     # from #Reads, not the rounded %Reads
     assert result["correction_with_any_AtoG_change"] == 40
     assert result["correction_with_any_change_in_protospacer"] == 50
     assert result["w_bystanders_minus_wo_bystanders"] == 13.33
@@ -57,6 +60,8 @@ def test_quantify_sample(tmp_path):
     assert result["target_locus"] == "TGTATACCCCCGAACTGTGA"
     assert result["perfect_correction"] == "TGTATGCCCCCGAACTGTGA"
     assert result["corrected_locus_with_bystanders"] == "TGTATGCCCCCGAACTGTGA;TGTATGCCCCCGAGCTGTGA"
+    # a streamed allele table gives the same result
+    assert quantify_sample(configs[0], tmp_path/"sample_dir", stream_min_bytes=0) == result
 
 def test_missing_CRISPResso_subfolder_FORCED_FAIL(tmp_path):
     configs = [
@@ -224,4 +229,59 @@ def test_quantify_nuclease_sample():
     assert result["pct_substitutions"] == 5.0       # 50/1000*100
     assert result["pct_frameshift_indels"] == 40.0  # 20 (1bp del) + 20 (1bp ins)
     assert result["pct_inframe_indels"] == 20.0     # 3bp del
-    assert result["target_locus"] == "GCATGACTAGTCGTACGCTG"
\ No newline at end of file
+    assert result["target_locus"] == "GCATGACTAGTCGTACGCTG"
+
+ONESEQ_CONFIG = AmpliconConfig(
+    name="TEST", protospacer="GGAGGTTTTTCCCCCGGGGG", editor="ABE",
+    orientation="F", amplicon="A" * 30, intended_edit="ONESEQ",
+    tolerated_edits=[], note=""
+)
+
+def write_oneseq_sample(sample_dir: Path, edited_pct: float):
+    crispresso_subfolder = sample_dir / "CRISPResso_on_sample"
+    crispresso_subfolder.mkdir(parents=True)
+    (crispresso_subfolder / "CRISPResso_mapping_statistics.txt").write_text(
+        "READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\tN_COMPUTED_ALN\tN_CACHED_ALN\tN_COMPUTED_NOTALN\tN_CACHED_NOTALN\n"
+        "1000\t900\t800\t1\t1\t1\t1"
+    )
+    (crispresso_subfolder / "Alleles_frequency_table_around_sgRNA_GGAGG.txt").write_text(
+        "Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads\n"
+        f"GGGGGTTTTTCCCCCGGGGG\tGGAGGTTTTTCCCCCGGGGG\tFalse\t0\t0\t1\t{round(edited_pct * 8)}\t{edited_pct}\n"
+        f"GGAGGTTTTTCCCCCGGGGG\tGGAGGTTTTTCCCCCGGGGG\tTrue\t0\t0\t0\t{800 - round(edited_pct * 8)}\t{100 - edited_pct}\n"
+    )
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_quantify_samples(tmp_path, workers):
+    jobs = []
+    for i in range(4):
+        sample_dir = tmp_path / f"sample_{i}"
+        write_oneseq_sample(sample_dir, edited_pct=10.0 * i)
+        jobs.append((sample_dir, ONESEQ_CONFIG))
+    (tmp_path / "sample_missing").mkdir()
+    jobs.append((tmp_path / "sample_missing", ONESEQ_CONFIG))
+
+    outcomes = dict(quantify_samples(jobs, workers=workers))
+
+    assert sorted(outcomes) == [sample_dir for sample_dir, _ in jobs]
+    for i in range(4):
+        result = outcomes[tmp_path / f"sample_{i}"]
+        assert result["sample"] == f"sample_{i}"
+        assert result["pct_AtoG_anywhere"] == 10.0 * i
+    assert isinstance(outcomes[tmp_path / "sample_missing"], FileNotFoundError)
+
+def test_summary_sample_name():
+    assert summary_sample_name("Sample_ABE_1") == "Sample_ABE_1"
+    assert summary_sample_name("Sample_ABE_1-ds.0123abcd") == "Sample_ABE_1"
+    assert summary_sample_name("Sample_ABE_1_L001-ds.0123abcd") == "Sample_ABE_1"
+
+def test_latest_crispresso_output_mtime(tmp_path):
+    sample_dir = tmp_path / "sample_0"
+    write_oneseq_sample(sample_dir, edited_pct=10.0)
+    output_files = list((sample_dir / "CRISPResso_on_sample").iterdir())
+    for age, path in enumerate(output_files):
+        os.utime(path, (1_000_000 + age, 1_000_000 + age))
+
+    assert latest_crispresso_output_mtime(sample_dir) == 1_000_000 + len(output_files) - 1
+
+def test_latest_crispresso_output_mtime_no_output(tmp_path):
+    assert latest_crispresso_output_mtime(tmp_path) is None
@@ -1,11 +1,12 @@
 import pytest
-from utils.sequences import reverse_complement, generate_search_sequences, generate_oneseq_search_sequences
+from utils.sequences import reverse_complement, generate_search_sequences, encode_sequences, oneseq_search_pattern
 
 
 """Tests for utils/sequences.py - covers reverse complement extensively, generate search
 sequence no bystanders, multiple bystander, edit at the first and last position, invalid
 orientation FORCED FAIL, position out of range FORCED FAIL, wrong intended base FORCED FAIL,
-wrong tolerated base FORCED FAIL"""
+wrong tolerated base FORCED FAIL, encoding sequences into a uint8 matrix, and the ONESEQ
+IUPAC search patterns"""
 
 def test_reverse_complement_basic():
     assert reverse_complement("ATCG") == "CGAT"
@@ -165,64 +166,35 @@ def test_generate_search_sequences_wrong_tolerated_base_reverse_FORCED_FAIL():
         )
 
 
-def test_generate_oneseq_search_sequences_single_edit_forward():
-    protospacer = "AGGGGTTTTTCCCCCGGGGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == ["GGGGGTTTTTCCCCCGGGGG"]
-    assert full == ["GGGGGTTTTTCCCCCGGGGG"]
-
-def test_generate_oneseq_search_sequences_no_edit_forward():
-    protospacer = "GGGGGTTTTTCCCCCGGGGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == []
-    assert full == []
-
-def test_generate_oneseq_search_sequences_edit_post_10bp_forward():
-    protospacer = "GGGGGTTTTTCCCCCGGAGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == []
-    assert full == ["GGGGGTTTTTCCCCCGGGGG"]
-
-def test_generate_oneseq_search_sequence_edit_pre_and_post_10bp_forward():
-    protospacer = "GGAGGTTTTTCCCCCGGAGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == ["GGGGGTTTTTCCCCCGGAGG"]
-    assert full == ["GGGGGTTTTTCCCCCGGAGG", "GGAGGTTTTTCCCCCGGGGG", "GGGGGTTTTTCCCCCGGGGG"]
-
-def test_generate_oneseq_search_sequence_last_10bp_reverse():
-    protospacer = "CCCCCTTTTTCCCCCGGAGG"
-    orientation = "R"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == []
-    assert full == ["CCCCCGGGGGAAAAAGGGGG"]
-    
-def test_generate_oneseq_search_sequence_first10bp_reverse():
-    protospacer = "GGAGGTTTTTCCCCCGGGGG"
-    orientation = "R"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == ["CCCCCGGGGGAAAAACCCCC"]
-    assert full == ["CCCCCGGGGGAAAAACCCCC"]
-
-def test_generate_invalid_orientation_FORCED_FAIL():
-    protospacer = "GGAGGTTTTTCCCCCGGGGG"
-    orientation = "X"
+def test_encode_sequences():
+    matrix, length_ok = encode_sequences(["ACGT", "AC-T", "ACGTA", "ACG"], 4)
+    assert matrix.shape == (4, 4)
+    assert matrix.dtype.name == "uint8"
+    assert bytes(matrix[0]) == b"ACGT"
+    assert bytes(matrix[1]) == b"AC-T"
+    assert length_ok.tolist() == [True, True, False, False]
+    assert not matrix[2].any()
+
+def test_encode_sequences_empty():
+    matrix, length_ok = encode_sequences([], 4)
+    assert matrix.shape == (0, 4)
+    assert length_ok.tolist() == []
+
+def test_oneseq_search_pattern_forward():
+    assert oneseq_search_pattern("GGAGGTTTTACCCCCGGAGG", "F") == "GGRGGTTTTRCCCCCGGRGG"
+    assert oneseq_search_pattern("GGAGGTTTTACCCCCGGAGG", "F", first_n=10) == "GGRGGTTTTRCCCCCGGAGG"
+
+def test_oneseq_search_pattern_reverse():
+    assert oneseq_search_pattern("GGAGGTTTTTCCCCCGGAGG", "R") == "CCYCCGGGGGAAAAACCYCC"
+    assert oneseq_search_pattern("GGAGGTTTTTCCCCCGGAGG", "R", first_n=10) == "CCTCCGGGGGAAAAACCYCC"
+
+def test_oneseq_search_pattern_no_A():
+    assert oneseq_search_pattern("GGGGGTTTTTCCCCCGGGGG", "F") == "GGGGGTTTTTCCCCCGGGGG"
+
+def test_oneseq_search_pattern_A_at_first_10bp_boundary():
+    assert oneseq_search_pattern("GGGGGTTTTACCCCCGGGGG", "F", first_n=10) == "GGGGGTTTTRCCCCCGGGGG"
+    assert oneseq_search_pattern("GGGGGTTTTTACCCCGGGGG", "F", first_n=10) == "GGGGGTTTTTACCCCGGGGG"
+
+def test_oneseq_search_pattern_invalid_orientation_FORCED_FAIL():
     with pytest.raises(ValueError):
-        first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-
-def test_generate_oneseq_sequences_A_at_boundary_inside():
-    protospacer = "GGGGGTTTTACCCCCGGGGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == ["GGGGGTTTTGCCCCCGGGGG"]
-    assert full == ["GGGGGTTTTGCCCCCGGGGG"]
-
-def test_generate_oneseq_sequences_A_at_boundary_outside():
-    protospacer = "GGGGGTTTTTACCCCGGGGG"
-    orientation = "F"
-    first_10, full = generate_oneseq_search_sequences(protospacer, orientation)
-    assert first_10 == []
-    assert full == ["GGGGGTTTTTGCCCCGGGGG"]
\ No newline at end of file
+        oneseq_search_pattern("GGAGG", "X")
@@ -0,0 +1,65 @@
+import gzip
+import pandas as pd
+import pytest
+from pipeline import shard
+from pipeline.crispresso import FINGERPRINT_FILE
+from pipeline.quantify import quantify_sample
+from pipeline.shard import SHARD_DIR, run_sharded, shard_sample
+from tests.helper import SAMPLE_READS, crispresso_output, fake_crispresso, make_config, write_sample
+
+"""Tests for pipeline/shard.py - covers dealing reads and read pairs into shards, a sharded run
+matching a run on the whole sample (tables and Stage 2 result), the fingerprint cache, and a
+shard whose CRISPResso run fails FORCED FAIL."""
+
+
+def shard_reads(shard_dir, read):
+    fastq, = shard_dir.glob(f"*_R{read}_001.fastq.gz")
+    with gzip.open(fastq, "rt") as f:
+        return f.read().splitlines()
+
+def test_shard_sample(tmp_path):
+    sample_dir = write_sample(tmp_path, "TEST1_1", [f"ACGT{'A' * i}" for i in range(10)], paired=True)
+    shard_dirs = shard_sample(sample_dir, tmp_path / "shards", 3)
+    assert [d.name for d in shard_dirs] == ["shard_1", "shard_2", "shard_3"]
+    assert [len(shard_reads(d, 1)) // 4 for d in shard_dirs] == [4, 3, 3]
+    assert all(shard_reads(d, 1) == shard_reads(d, 2) for d in shard_dirs)
+    assert shard_reads(shard_dirs[1], 1)[:2] == ["@read_1", "ACGTA"]
+
+def test_sharded_run_matches_full_run(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(shard, "run_crispresso", fake_crispresso(calls))
+    sharded_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    full_dir = write_sample(tmp_path, "TEST1_2", SAMPLE_READS)
+
+    assert run_sharded(make_config(), sharded_dir, n_shards=4) is True
+    fake_crispresso([])(make_config(), full_dir)
+
+    assert sorted(calls) == [sharded_dir / SHARD_DIR / f"shard_{i}" for i in range(1, 5)]
+    assert not (sharded_dir / SHARD_DIR).exists()
+    sharded_table, sharded_stats, sharded_window = crispresso_output(sharded_dir)
+    full_table, full_stats, full_window = crispresso_output(full_dir)
+    pd.testing.assert_frame_equal(sharded_table, full_table)
+    pd.testing.assert_frame_equal(sharded_stats[full_stats.columns], full_stats)
+    pd.testing.assert_frame_equal(sharded_window, full_window)
+    assert quantify_sample(make_config(), sharded_dir) == {**quantify_sample(make_config(), full_dir), "sample": "TEST1_1"}
+
+def test_cache_hit(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(shard, "run_crispresso", fake_crispresso(calls))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    assert run_sharded(make_config(), sample_dir, n_shards=2) is True
+    assert run_sharded(make_config(), sample_dir, n_shards=2) is False
+    assert (sample_dir / FINGERPRINT_FILE).exists()
+    assert len(calls) == 2
+
+def test_failed_shard_FORCED_FAIL(tmp_path, monkeypatch):
+    def failing(amplicon_list_row, sample_dir, log_path=None, force=False):
+        if sample_dir.name == "shard_2":
+            raise RuntimeError("CRISPResso exited with status 1")
+        return fake_crispresso([])(amplicon_list_row, sample_dir, log_path, force)
+    monkeypatch.setattr(shard, "run_crispresso", failing)
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    with pytest.raises(RuntimeError, match="status 1"):
+        run_sharded(make_config(), sample_dir, n_shards=2)
+    assert not (sample_dir / FINGERPRINT_FILE).exists()
+    assert not list(sample_dir.glob("CRISPResso_on_*"))
@@ -0,0 +1,128 @@
+import gzip
+import json
+import pytest
+import subprocess
+from collections import Counter
+from pathlib import Path
+from unittest.mock import patch
+from pipeline import subsample
+from pipeline.crispresso import FINGERPRINT_FILE, run_crispresso
+from pipeline.quantify import quantify_sample
+from pipeline.subsample import (SUBSAMPLE_DIR, reservoir_sample, run_subsampled, subsample_record, subsample_sample,
+                                subsampling_factor)
+from pipeline.validate import check_input_reads, validate_sample
+from tests.helper import SAMPLE_READS, fake_crispresso, make_config, write_fake_output, write_sample
+
+"""Tests for pipeline/subsample.py - covers the reservoir sample being uniform, reproducible and
+in read order, read pairs staying together, the subsampling factor reaching the Stage 2 result,
+the fingerprint cache, a later full run through run_crispresso replacing the subsampled output
+and its record, the read count cross-check, replacing a run on all reads only with force, and
+samples without reads, existing full-depth output or a leftover fastq-named output next to the
+subsampled one FORCED FAIL."""
+
+
+def test_reservoir_sample():
+    sampled, total = reservoir_sample(range(1000), 50)
+    assert total == 1000
+    assert len(sampled) == 50 and sampled == sorted(sampled)
+    assert reservoir_sample(range(1000), 50) == (sampled, total)
+    assert reservoir_sample(range(1000), 50, seed=1)[0] != sampled
+
+def test_reservoir_sample_short_stream():
+    assert reservoir_sample(iter("abc"), 10) == (["a", "b", "c"], 3)
+
+def test_reservoir_sample_uniform():
+    picks = Counter()
+    for seed in range(2000):
+        picks.update(reservoir_sample(range(40), 10, seed=seed)[0])
+    # every item should be picked in about a quarter of the draws
+    assert all(abs(count / 2000 - 0.25) < 0.05 for count in picks.values())
+    assert len(picks) == 40
+
+def test_pairs_stay_together(tmp_path):
+    sample_dir = write_sample(tmp_path, "TEST1_1", [f"ACGT{'A' * i}" for i in range(300)], paired=True)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    assert subsample_sample(sample_dir, output_dir, 25) == (25, 300)
+    reads = {}
+    for read in (1, 2):
+        with gzip.open(output_dir / f"TEST1_1_R{read}_001.fastq.gz", "rt") as f:
+            reads[read] = f.read().splitlines()
+    assert len(reads[1]) == 100
+    assert reads[1] == reads[2]
+
+def test_run_subsampled(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso(calls))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+
+    assert run_subsampled(make_config(), sample_dir, max_reads=200) is True
+    assert calls == [sample_dir / SUBSAMPLE_DIR]
+    assert not (sample_dir / SUBSAMPLE_DIR).exists()
+    output = sample_dir / "CRISPResso_on_TEST1_1"
+    assert subsample_record(output)["reads_sampled"] == 200
+    assert subsampling_factor(output) == len(SAMPLE_READS) / 200
+
+    result = quantify_sample(make_config(), sample_dir)
+    assert result["reads_total"] == 200
+    assert result["subsampling_factor"] == 5.0
+
+    assert run_subsampled(make_config(), sample_dir, max_reads=200) is False
+    assert json.loads((sample_dir / FINGERPRINT_FILE).read_text())["engine"].startswith("subsample:200:")
+
+def test_record_ignored_after_full_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso([]))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    run_subsampled(make_config(), sample_dir, max_reads=200)
+
+    def crispresso(cmd, **kwargs):
+        # CRISPResso writes <output_folder>/CRISPResso_on_<name>, or names it after the fastq without --name
+        output_folder, name = Path(cmd[cmd.index("--output_folder") + 1]), cmd[cmd.index("--name") + 1]
+        write_fake_output(Path(cmd[cmd.index("--fastq_r1") + 1]), output_folder / f"CRISPResso_on_{name}")
+        return subprocess.CompletedProcess(cmd, 0)
+
+    with patch("pipeline.crispresso.subprocess.run", side_effect=crispresso):
+        assert run_crispresso(make_config(), sample_dir) is True
+    output, = sample_dir.glob("CRISPResso_on_*")
+    assert subsample_record(output) is None
+    result = quantify_sample(make_config(), sample_dir)
+    assert result["reads_total"] == len(SAMPLE_READS)
+    assert "subsampling_factor" not in result
+
+def test_full_depth_output_kept_FORCED_FAIL(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso(calls))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    fake_crispresso([])(make_config(), sample_dir)
+    with pytest.raises(FileExistsError, match="--force"):
+        run_subsampled(make_config(), sample_dir, max_reads=200)
+    assert calls == []
+    assert quantify_sample(make_config(), sample_dir)["reads_total"] == len(SAMPLE_READS)
+
+    assert run_subsampled(make_config(), sample_dir, force=True, max_reads=200) is True
+    assert quantify_sample(make_config(), sample_dir)["subsampling_factor"] == 5.0
+
+def test_leftover_default_named_output_FORCED_FAIL(tmp_path, monkeypatch):
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso([]))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    run_subsampled(make_config(), sample_dir, max_reads=200)
+    # a full run from before outputs were named after the sample, next to the subsampled one
+    (sample_dir / "CRISPResso_on_TEST1_1_R1_001").mkdir()
+    with pytest.raises(ValueError, match="CRISPResso_on_TEST1_1_R1_001"):
+        quantify_sample(make_config(), sample_dir)
+
+def test_validated_read_counts(tmp_path, monkeypatch):
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso([]))
+    sample_dir = write_sample(tmp_path, "TEST1_1", SAMPLE_READS)
+    validate_sample(sample_dir)
+    run_subsampled(make_config(), sample_dir, max_reads=200)
+    check_input_reads(sample_dir, sample_dir / "CRISPResso_on_TEST1_1" / "CRISPResso_mapping_statistics.txt")
+
+def test_no_reads_FORCED_FAIL(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(subsample, "run_crispresso", fake_crispresso(calls))
+    sample_dir = write_sample(tmp_path, "TEST1_1", [])
+    with pytest.raises(ValueError, match="No reads"):
+        run_subsampled(make_config(), sample_dir, max_reads=200)
+    assert calls == []
+    assert not (sample_dir / SUBSAMPLE_DIR).exists()
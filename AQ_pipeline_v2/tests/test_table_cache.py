@@ -0,0 +1,124 @@
+import os
+import pytest
+import pandas as pd
+from loaders import table_cache
+from loaders.table_cache import configure_table_cache, evict_table_cache
+from loaders.crispresso_output import (ABE_ALLELE_COLUMNS, ALLELE_TABLE_DTYPES, read_allele_table, read_quant_window,
+                                       read_mapping_stats)
+
+"""Tests for loaders/table_cache.py - covers the cache being disabled by default, allele
+table (whole and column subsets), quantification window and mapping statistics round trips
+through the sidecar, stale
+sidecars after the source changes, corrupt sidecars, text columns with missing values not
+being cached, and LRU eviction under the size limit."""
+
+ALLELE_TABLE = (
+    "Aligned_Sequence\tReference_Sequence\tUnedited\tn_deleted\tn_inserted\tn_mutated\t#Reads\t%Reads\n"
+    "TGTATACCCCCGAACTGTGA\tTGTATACCCCCGAACTGTGA\tTrue\t0\t0\t0\t2000\t33.0\n"
+    "TGTATGCCCC--------GA\tTGTATACCCCCGAACTGTGA\tFalse\t8\t0\t1\t600\t10.0\n"
+)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    configure_table_cache(tmp_path / "cache")
+    yield tmp_path / "cache"
+    configure_table_cache(None)
+
+def write_allele_table(path, text=ALLELE_TABLE):
+    path.write_text(text)
+    return path
+
+def test_cache_disabled_by_default(tmp_path):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    read_allele_table(path)
+    assert table_cache.table_cache_settings()[0] is None
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_allele_table_round_trip(tmp_path, cache_dir):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    parsed = read_allele_table(path)
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+
+    cached = read_allele_table(path)
+    pd.testing.assert_frame_equal(cached, parsed)
+    pd.testing.assert_frame_equal(cached, pd.read_csv(path, sep="\t", dtype=ALLELE_TABLE_DTYPES))
+
+def test_column_subsets_cached_separately(tmp_path, cache_dir):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    read_allele_table(path)
+    read_allele_table(path, ABE_ALLELE_COLUMNS)
+    assert len(list(cache_dir.glob("*.npz"))) == 2
+    assert list(read_allele_table(path, ABE_ALLELE_COLUMNS).columns) == list(ABE_ALLELE_COLUMNS)
+    assert len(read_allele_table(path).columns) == 8
+
+def test_cached_table_is_used(tmp_path, cache_dir, monkeypatch):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    read_allele_table(path)
+    monkeypatch.setattr(pd, "read_csv", lambda *args, **kwargs: pytest.fail("text file was parsed again"))
+    assert read_allele_table(path)["#Reads"].sum() == 2600
+
+def test_quant_window_round_trip(tmp_path, cache_dir):
+    path = tmp_path / "quant_window.txt"
+    path.write_text("Base\t1\t2\nA\t0.95\t0.02\nC\t0.02\t0.95\nG\t0.02\t0.02\nT\t0.01\t0.01\n")
+    parsed = read_quant_window(path)
+    cached = read_quant_window(path)
+    pd.testing.assert_frame_equal(cached, parsed)
+    assert cached.loc["A", "1"] == 0.95
+
+def test_mapping_stats_round_trip(tmp_path, cache_dir):
+    path = tmp_path / "CRISPResso_mapping_statistics.txt"
+    path.write_text("READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n7000\t6500\t6000\n")
+    assert read_mapping_stats(path) == (6500, 6000)
+    assert read_mapping_stats(path) == (6500, 6000)
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+
+def test_mapping_stats_validation_applies_to_cached_values_FORCED_FAIL(tmp_path, cache_dir):
+    path = tmp_path / "CRISPResso_mapping_statistics.txt"
+    path.write_text("READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n7000\t6500\t10\n")
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            read_mapping_stats(path)
+
+def test_stale_sidecar_is_replaced(tmp_path, cache_dir):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    read_allele_table(path)
+    write_allele_table(path, ALLELE_TABLE.replace("2000", "1000"))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert read_allele_table(path)["#Reads"].sum() == 1600
+    assert read_allele_table(path)["#Reads"].sum() == 1600
+
+def test_corrupt_sidecar_is_ignored(tmp_path, cache_dir):
+    path = write_allele_table(tmp_path / "alleles.txt")
+    parsed = read_allele_table(path)
+    sidecar, = cache_dir.glob("*.npz")
+    sidecar.write_bytes(b"not an npz file")
+
+    pd.testing.assert_frame_equal(read_allele_table(path), parsed)
+
+def test_missing_text_values_not_cached(tmp_path, cache_dir):
+    path = write_allele_table(tmp_path / "alleles.txt", ALLELE_TABLE.replace("TGTATGCCCC--------GA", ""))
+    parsed = read_allele_table(path)
+    assert list(cache_dir.glob("*.npz")) == []
+    assert parsed["Aligned_Sequence"].isna().sum() == 1
+
+def test_lru_eviction(tmp_path):
+    paths = [write_allele_table(tmp_path / f"alleles_{i}.txt") for i in range(3)]
+    configure_table_cache(tmp_path / "cache")
+    try:
+        for path in paths:
+            read_allele_table(path)
+        sidecars = sorted((tmp_path / "cache").glob("*.npz"), key=lambda p: p.stat().st_mtime_ns)
+        sidecar_size = sidecars[0].stat().st_size
+        for age, sidecar in enumerate(sidecars):
+            os.utime(sidecar, ns=(0, (age + 1) * 1_000_000_000))
+        read_allele_table(paths[0])                 # most recently used again
+
+        configure_table_cache(tmp_path / "cache", max_bytes=2 * sidecar_size)
+        evict_table_cache()
+        remaining = list((tmp_path / "cache").glob("*.npz"))
+        assert len(remaining) == 2
+        assert table_cache._sidecar_path(paths[0], "_parse_allele_table") in remaining
+    finally:
+        configure_table_cache(None)
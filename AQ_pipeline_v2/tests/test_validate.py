@@ -0,0 +1,90 @@
+import json
+import pytest
+from pathlib import Path
+from pipeline.merge import write_merge_record
+from pipeline.validate import READ_COUNTS_FILE, check_input_reads, recorded_read_count, validate_sample
+from tests.helper import write_fastq
+
+"""Tests for pipeline/validate.py - covers counting single end, paired end and multi-lane
+samples, saving the counts and ignoring them once a fastq changes, cross-checking READS IN
+INPUTS (merged top-up outputs are not checked), and R1/R2 count mismatches, samples without
+reads, CRISPResso reading fewer reads than validated and merge records whose mapping statistics
+were since overwritten FORCED FAIL."""
+
+
+def write_mapping_stats(path: Path, reads_in_inputs: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("READS IN INPUTS\tREADS AFTER PREPROCESSING\tREADS ALIGNED\n"
+                    f"{reads_in_inputs}\t{reads_in_inputs}\t{reads_in_inputs}\n")
+
+def test_validate_single_end(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 120)
+    assert validate_sample(tmp_path) == 120
+    recorded = json.loads((tmp_path / READ_COUNTS_FILE).read_text())
+    assert recorded["reads"] == 120
+    assert [entry["name"] for entry in recorded["fastqs"]] == ["S1_R1_001.fastq.gz"]
+    assert recorded_read_count(tmp_path) == 120
+
+def test_validate_paired_lanes(tmp_path):
+    for lane, n_reads in ((1, 30), (2, 20)):
+        for read in (1, 2):
+            write_fastq(tmp_path / f"S1_L00{lane}_R{read}_001.fastq.gz", ["ACGTACGTAC"] * n_reads)
+    assert validate_sample(tmp_path) == 50
+    assert len(json.loads((tmp_path / READ_COUNTS_FILE).read_text())["fastqs"]) == 4
+
+def test_changed_fastq_discards_count(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 10)
+    validate_sample(tmp_path)
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 11)
+    assert recorded_read_count(tmp_path) is None
+
+def test_not_validated(tmp_path):
+    write_mapping_stats(tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt", 5)
+    assert recorded_read_count(tmp_path) is None
+    check_input_reads(tmp_path, tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt")
+
+def test_check_input_reads(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 40)
+    validate_sample(tmp_path)
+    stats_file = tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt"
+    write_mapping_stats(stats_file, 40)
+    check_input_reads(tmp_path, stats_file)
+
+def test_merged_output_not_checked(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 40)
+    validate_sample(tmp_path)
+    stats_file = tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt"
+    write_mapping_stats(stats_file, 70)
+    write_merge_record(stats_file.parent, [])
+    check_input_reads(tmp_path, stats_file)
+
+def test_stale_merge_record_checked_FORCED_FAIL(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 40)
+    validate_sample(tmp_path)
+    stats_file = tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt"
+    write_mapping_stats(stats_file, 70)
+    write_merge_record(stats_file.parent, [])
+    # a later run writing into the merged folder leaves merged_from.json behind
+    write_mapping_stats(stats_file, 25)
+    with pytest.raises(ValueError, match="CRISPResso read 25 reads"):
+        check_input_reads(tmp_path, stats_file)
+
+def test_check_input_reads_FORCED_FAIL(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 40)
+    validate_sample(tmp_path)
+    stats_file = tmp_path / "CRISPResso_on_S1" / "CRISPResso_mapping_statistics.txt"
+    write_mapping_stats(stats_file, 25)
+    with pytest.raises(ValueError, match="CRISPResso read 25 reads"):
+        check_input_reads(tmp_path, stats_file)
+
+def test_paired_count_mismatch_FORCED_FAIL(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 10)
+    write_fastq(tmp_path / "S1_R2_001.fastq.gz", ["ACGTACGTAC"] * 9)
+    with pytest.raises(ValueError, match="holds 10 reads but S1_R2_001.fastq.gz holds 9"):
+        validate_sample(tmp_path)
+    assert not (tmp_path / READ_COUNTS_FILE).exists()
+
+def test_no_reads_FORCED_FAIL(tmp_path):
+    write_fastq(tmp_path / "S1_R1_001.fastq.gz", ["ACGTACGTAC"] * 0)
+    with pytest.raises(ValueError, match="No reads"):
+        validate_sample(tmp_path)
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from utils.sequences import encode_sequences
+
+# AlleleMatrix — an allele table's quantification window alleles decoded once into a uint8 matrix,
+# which the ABE, heterozygous and ONE-seq calculators all work on
+
+
+def table_weights(allele_table: pd.DataFrame, use_counts: bool) -> np.ndarray:
+    """Returns what each allele adds to a read sum: #Reads as int64 when use_counts, otherwise
+        %Reads as float64"""
+    if use_counts:
+        return allele_table["#Reads"].to_numpy(dtype=np.int64)
+    return allele_table["%Reads"].to_numpy(dtype=np.float64)
+
+
+@dataclass
+class AlleleMatrix:
+    """The alleles of an allele table (or one chunk of it) as a fixed-width matrix of ASCII codes,
+        so every metric is a whole-array comparison and masked sum rather than a walk over the
+        Aligned_Sequence strings.
+    Attributes:
+        alleles: (n_alleles, width) uint8 matrix of the Aligned_Sequence characters. Rows of
+            alleles whose length is not width are left as zeros
+        length_ok: boolean mask of the alleles that are exactly width long. The rest are
+            alignment shifted and never match a reference
+        weights: what each allele adds to a read sum, #Reads as int64 when counted, otherwise
+            %Reads as float64
+    """
+    alleles: np.ndarray
+    length_ok: np.ndarray
+    weights: np.ndarray
+
+    @classmethod
+    def from_table(cls, allele_table: pd.DataFrame, width: int, use_counts: bool = False) -> "AlleleMatrix":
+        """Decodes an allele table
+        Args:
+            allele_table: the allele frequency table, or a chunk of it
+            width: the quantification window length (the protospacer length)
+            use_counts: weight alleles by #Reads rather than %Reads
+        Returns:
+            AlleleMatrix: the decoded table
+        """
+        alleles, length_ok = encode_sequences(allele_table["Aligned_Sequence"].tolist(), width)
+        return cls(alleles, length_ok, table_weights(allele_table, use_counts))
@@ -0,0 +1,217 @@
+import gzip
+import os
+import queue
+import re
+import tempfile
+import threading
+import zlib
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import repeat, zip_longest
+from pathlib import Path
+from typing import TextIO
+
+# Minimal streaming FASTQ reader/writer (plain or gzipped) for the pipeline's own read handling
+
+LANE_CHUNK_BYTES = 1 << 20      # bytes copied at a time when streaming lanes through a pipe
+VALIDATE_QUEUE_CHUNKS = 8       # decompressed chunks buffered between the two validation threads
+
+
+def open_fastq(path: str | Path, mode: str = "rt") -> TextIO:
+    """Opens a fastq file as text, transparently gzipped when the name ends in .gz
+    Args:
+        path: path of the fastq file
+        mode: "rt" to read or "wt" to write
+    Returns:
+        TextIO: the open file
+    """
+    if str(path).endswith(".gz"):
+        # level 1: the pipeline's own fastqs are intermediate files, speed matters more than size
+        return gzip.open(path, mode, encoding="ascii", compresslevel=1)
+    return open(path, mode, encoding="ascii")
+
+def read_fastq(path: str | Path) -> Iterator[tuple[str, str, str]]:
+    """Streams the records of a fastq file one at a time
+    Args:
+        path: path of the fastq file, plain or gzipped
+    Yields:
+        tuple[str, str, str]: the header (without "@"), sequence and quality string of each read
+    Raises:
+        ValueError: a record is truncated or does not follow the 4 line fastq layout
+    """
+    with open_fastq(path) as f:
+        for record_number, record in enumerate(zip_longest(f, f, f, f), start=1):
+            if not any(line and line.strip() for line in record):
+                break                                   # blank lines at the end of the file
+            header, sequence, separator, quality = record
+            if quality is None:
+                raise ValueError(f"Truncated record {record_number} in {path}")
+            if not header.startswith("@") or not separator.startswith("+"):
+                raise ValueError(f"Malformed record {record_number} in {path}")
+            yield header[1:].rstrip("\n"), sequence.rstrip("\n"), quality.rstrip("\n")
+
+def read_fastq_lanes(paths: list[str | Path]) -> Iterator[tuple[str, str, str]]:
+    """Streams the records of a sample split across lanes, one lane after another
+    Args:
+        paths: the fastq files of one read, in lane order
+    Yields:
+        tuple[str, str, str]: the header (without "@"), sequence and quality string of each read
+    Raises:
+        ValueError: a record is truncated or does not follow the 4 line fastq layout
+    """
+    for path in paths:
+        yield from read_fastq(path)
+
+@contextmanager
+def concatenated_fastq(paths: list[str]) -> Iterator[str]:
+    """Presents the lanes of one read as a single fastq, without writing a merged copy. The
+        lanes' bytes are fed, one after another, into a named pipe by a background thread;
+        concatenated gzip files are themselves a valid gzip file, so nothing is decompressed.
+        CRISPResso may read its input more than once, so every time a reader opens the pipe
+        it gets the whole stream from the first lane. Readers that open it at the same moment
+        would share one copy of the stream, so each must open it in turn.
+    Args:
+        paths: the fastq files of one read in lane order, all gzipped or all plain
+    Yields:
+        str: path of the named pipe, or the file itself when there is only one
+    """
+    if len(paths) == 1:
+        yield str(paths[0])
+        return
+
+    with tempfile.TemporaryDirectory(prefix="aq_lanes_") as pipe_dir:
+        # named like the lanes minus the lane tag, so the extension still says whether it is gzipped
+        pipe = Path(pipe_dir) / re.sub(r"_L\d{3}(?=[_.])", "", Path(paths[0]).name, flags=re.IGNORECASE)
+        next_pipe = Path(pipe_dir) / "next_pipe"
+        os.mkfifo(pipe)
+        stop = threading.Event()
+
+        def feed():
+            while not stop.is_set():
+                with open(pipe, "wb", buffering=0) as out:     # blocks until a reader opens the pipe
+                    # put a fresh pipe in place before writing, so the next reader can't attach to
+                    # this one and this reader sees end of file when it is closed
+                    os.mkfifo(next_pipe)
+                    os.replace(next_pipe, pipe)
+                    try:
+                        for path in paths:
+                            with open(path, "rb") as lane:
+                                while (chunk := lane.read(LANE_CHUNK_BYTES)) and not stop.is_set():
+                                    out.write(chunk)
+                    except BrokenPipeError:
+                        pass                                    # the reader stopped early
+
+        feeder = threading.Thread(target=feed, name=f"feed {pipe.name}", daemon=True)
+        feeder.start()
+        try:
+            yield str(pipe)
+        finally:
+            stop.set()
+            # release a feeder waiting for its next reader, and drain anything it is still writing
+            reader = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                while feeder.is_alive():
+                    try:
+                        os.read(reader, LANE_CHUNK_BYTES)
+                    except BlockingIOError:
+                        pass
+                    feeder.join(0.01)
+            finally:
+                os.close(reader)
+
+def _decompressed_chunks(path: str | Path, chunks: queue.Queue, stop: threading.Event) -> None:
+    """Background half of count_fastq_records(): reads a fastq file and puts its decompressed
+        bytes on the queue, then None at the end, or the exception that stopped it.
+        Every gzip member is decompressed, and a member cut short is an error."""
+    try:
+        with open(path, "rb") as f:
+            if not str(path).endswith(".gz"):
+                while (chunk := f.read(LANE_CHUNK_BYTES)) and not stop.is_set():
+                    chunks.put(chunk)
+            else:
+                decompressor = zlib.decompressobj(wbits=31)
+                while (data := f.read(LANE_CHUNK_BYTES)) and not stop.is_set():
+                    while data:
+                        chunks.put(decompressor.decompress(data))
+                        data = b""
+                        if decompressor.eof:
+                            # concatenated members (lanes cat'ed together, bgzip blocks); zero padding ends the file
+                            data = decompressor.unused_data
+                            if not data.strip(b"\x00"):
+                                break
+                            decompressor = zlib.decompressobj(wbits=31)
+                if f.tell() and not decompressor.eof and not stop.is_set():
+                    raise ValueError(f"Truncated gzip member in {path}")
+        chunks.put(None)
+    except (OSError, ValueError, zlib.error) as error:
+        chunks.put(ValueError(f"Unreadable fastq {path}: {error}") if isinstance(error, zlib.error) else error)
+
+def _check_records(lines: list[bytes], first_record: int, path: str | Path) -> None:
+    """Checks a run of complete 4 line records for the fastq layout, raising a ValueError
+        that names the first bad record"""
+    headers, sequences, separators, qualities = lines[0::4], lines[1::4], lines[2::4], lines[3::4]
+    if (all(map(bytes.startswith, headers, repeat(b"@")))
+            and all(map(bytes.startswith, separators, repeat(b"+")))
+            and list(map(len, sequences)) == list(map(len, qualities))):
+        return
+    for offset, (header, sequence, separator, quality) in enumerate(zip(headers, sequences, separators, qualities)):
+        if not header.startswith(b"@") or not separator.startswith(b"+") or len(sequence) != len(quality):
+            raise ValueError(f"Malformed record {first_record + offset} in {path}")
+
+def count_fastq_records(path: str | Path) -> int:
+    """Counts the reads of a fastq file while checking every record, without building any
+        per-read objects. Decompression runs on a background thread and the record checks on
+        the calling thread, so the two overlap (zlib releases the GIL while it works).
+    Args:
+        path: path of the fastq file, plain or gzipped
+    Returns:
+        int: the number of records
+    Raises:
+        ValueError: a gzip member is truncated or corrupt, a record is truncated, or a record
+            does not follow the 4 line fastq layout (header "@", separator "+", as many
+            quality characters as bases)
+    """
+    chunks = queue.Queue(maxsize=VALIDATE_QUEUE_CHUNKS)
+    stop = threading.Event()
+    decompressor = threading.Thread(target=_decompressed_chunks, args=(path, chunks, stop),
+                                    name=f"decompress {Path(path).name}", daemon=True)
+    decompressor.start()
+    records = 0
+    partial_line = b""
+    partial_record = []             # lines of a record split across chunks
+    try:
+        while (chunk := chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            lines = (partial_line + chunk).split(b"\n")
+            partial_line = lines.pop()
+            lines = partial_record + lines
+            complete = len(lines) - len(lines) % 4
+            _check_records(lines[:complete], records + 1, path)
+            records += complete // 4
+            partial_record = lines[complete:]
+    finally:
+        stop.set()
+        while decompressor.is_alive():              # unblock it if the queue is full
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                decompressor.join(0.01)
+
+    lines = partial_record + [partial_line]
+    while lines and not lines[-1].strip():
+        lines.pop()                                 # blank lines at the end of the file
+    if len(lines) % 4:
+        raise ValueError(f"Truncated record {records + len(lines) // 4 + 1} in {path}")
+    _check_records(lines, records + 1, path)
+    return records + len(lines) // 4
+
+def write_fastq_record(f: TextIO, header: str, sequence: str, quality: str) -> None:
+    """Writes one read to an open fastq file
+    Args:
+        f: the file, as returned by open_fastq(path, "wt")
+        header: the read name, without "@"
+        sequence: the read sequence
+        quality: the read quality string
+    """
+    f.write(f"@{header}\n{sequence}\n+\n{quality}\n")
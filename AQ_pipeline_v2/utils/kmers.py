@@ -0,0 +1,81 @@
+from collections import Counter
+from itertools import chain
+from config import AmpliconConfig
+from utils.sequences import reverse_complement
+
+# K-mer index of the amplicons in amplicon_list.csv, used to tell which amplicon a read comes
+# from without aligning it
+
+KMER_LENGTH = 15
+READ_STRIDE = 4             # a read is sampled at every READ_STRIDE-th k-mer
+MIN_READ_HITS = 3           # sampled k-mers a read must share with an amplicon to be assigned to it
+
+
+def kmers(sequence: str, k: int = KMER_LENGTH, stride: int = 1) -> list[str]:
+    """Returns the k-mers of a sequence
+    Args:
+        sequence: the sequence
+        k: the k-mer length
+        stride: distance between the starts of consecutive k-mers
+    Returns:
+        list[str]: the k-mers, in sequence order
+    """
+    starts = range(0, max(len(sequence) - k + 1, 0), stride)
+    return list(map(sequence.__getitem__, map(slice, starts, range(k, len(sequence) + 1, stride))))
+
+class KmerIndex:
+    """Inverted index from every k-mer of the amplicons, on both strands, to the amplicons
+        containing it, so a read can be assigned to an amplicon whichever strand it was
+        sequenced from. Reads are only sampled (every READ_STRIDE-th k-mer), which is plenty
+        to tell amplicons apart and keeps lookups per read low.
+    Attributes:
+        configs: the indexed AmpliconConfig objects, in amplicon_list.csv order
+        k: the k-mer length
+    """
+
+    def __init__(self, amplicon_configs: list[AmpliconConfig], k: int = KMER_LENGTH):
+        """Builds the index
+        Args:
+            amplicon_configs: list of all AmpliconConfig objects from amplicon_list.csv
+            k: the k-mer length
+        """
+        self.configs = list(amplicon_configs)
+        self.k = k
+        postings = {}
+        for position, config in enumerate(self.configs):
+            amplicon = config.amplicon.upper()
+            for kmer in set(kmers(amplicon, k)) | set(kmers(reverse_complement(amplicon), k)):
+                postings.setdefault(kmer, []).append(position)
+        self._postings = {kmer: tuple(positions) for kmer, positions in postings.items()}
+
+    def candidates(self, sequence: str) -> list[AmpliconConfig]:
+        """Finds the amplicons sharing the most sampled k-mers with a read
+        Args:
+            sequence: the read sequence
+        Returns:
+            list[AmpliconConfig]: the best scoring amplicons in amplicon_list.csv order (more
+                than one when they tie, e.g. rows sharing an amplicon), empty if none shares
+                at least MIN_READ_HITS k-mers with the read
+        """
+        sampled = kmers(sequence, self.k, READ_STRIDE)
+        hits = Counter(chain.from_iterable(filter(None, map(self._postings.get, sampled))))
+        if not hits:
+            return []
+        best = max(hits.values())
+        if best < MIN_READ_HITS:
+            return []
+        return [self.configs[position] for position in sorted(hits) if hits[position] == best]
+
+    def assign_read(self, sequence: str) -> AmpliconConfig | None:
+        """Finds the amplicon a read comes from
+        Args:
+            sequence: the read sequence
+        Returns:
+            AmpliconConfig | None: the best scoring amplicon (the first listed, if several rows
+                share its sequence), None if there is no candidate or candidates with
+                different sequences tie
+        """
+        candidates = self.candidates(sequence)
+        if not candidates or len({config.amplicon.upper() for config in candidates}) > 1:
+            return None
+        return candidates[0]
@@ -1,5 +1,6 @@
 
 from itertools import combinations
+import numpy as np
 
 
 # DNA sequence utilities: reverse complement, ABE search sequence generation, ONE-seq search sequence generation
@@ -21,6 +22,25 @@ def reverse_complement(seq:str) -> str:
                   "G" : "C" }
     return "".join(complement[base] for base in reversed(seq.upper()))
     
+def encode_sequences(sequences: list[str], width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Encodes equal-length sequences into a 2-D array of ASCII codes so they can be compared
+        column by column with whole-array operations instead of character by character.
+    Args:
+        sequences: the sequences to encode (e.g. the Aligned_Sequence column)
+        width: the expected sequence length
+    Returns:
+        tuple[np.ndarray, np.ndarray]: a (len(sequences), width) uint8 matrix, and a boolean mask
+            of which sequences had exactly `width` characters. Rows for sequences of any other
+            length are left as zeros.
+    """
+    lengths = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    length_ok = lengths == width
+    matrix = np.zeros((len(sequences), width), dtype=np.uint8)
+    if length_ok.any():
+        joined = "".join(seq for seq, ok in zip(sequences, length_ok) if ok).encode("ascii")
+        matrix[length_ok] = np.frombuffer(joined, dtype=np.uint8).reshape(-1, width)
+    return matrix, length_ok
+
 def generate_search_sequences(
                             protospacer: str,
                             intended_edit: int,
@@ -75,59 +95,24 @@ def generate_search_sequences(
 
     return sequences
 
-def generate_oneseq_search_sequences(protospacer:str,
-                                     orientation:str) -> tuple[list[str], list[str]]:
-    """Creates all search sequences for ONESEQ case. Includes all A to G changes, and A to G changes
-        only in the first 10 bp.
-    Args: 
+def oneseq_search_pattern(protospacer: str, orientation: str, first_n: int | None = None) -> str:
+    """Describes the ONESEQ search sequences as a single IUPAC pattern rather than listing
+        every A to G combination. Each A that may be edited is written as R (A or G); for R
+        orientation the pattern is reverse complemented, so those positions read Y (C or T).
+    Args:
         protospacer: the users guide sequence
         orientation: the orientation of the guide sequence relative to the amplicon
+        first_n: only A's within the first first_n bp of the guide may be edited, None for all
     Returns:
-        tuple[list[str], list[str]]: returns a tuple of lists containing sequences with edits in
-            the first 10bp and edits anywhere in the protospacer respectively 
+        str: the pattern, matching the amplicon-strand sequences in CRISPResso's allele table
     Raises:
         ValueError: orientation is neither forward nor reverse
-    Note:
-        For R orientation, edited sequences are reverse-complemented before being returned
-        so they match the amplicon-strand sequences reported by CRISPResso's allele table.
-        An A->G edit on the guide strand appears as T->C in the allele table.
     """
-    
     if orientation not in ("F", "R"):
         raise ValueError(f"orientation must be 'F' or 'R', got '{orientation}'")
-    
-    working_seq = protospacer
-    
-    a_pos_full_protospacer = []
-    for index, c in enumerate(working_seq):
-        if c.upper() == "A":
-            a_pos_full_protospacer.append(index)
-
-    a_pos_first_ten_of_protospacer = []
-
-    for index, c in enumerate(working_seq[:10]):
-        if c.upper() == "A":
-            a_pos_first_ten_of_protospacer.append(index)
-    first_10bp_seqs = []
-    for i in range(1, len(a_pos_first_ten_of_protospacer)+1):
-        for combo in combinations(a_pos_first_ten_of_protospacer, i):
-            seq = list(working_seq)
-            for pos in combo:
-                seq[pos] = "G"
-            first_10bp_seqs.append("".join(seq))
-    full_bp_seqs = []
-    for i in range(1, len(a_pos_full_protospacer) + 1):
-        for combo in combinations(a_pos_full_protospacer, i):
-            seq = list(working_seq)
-            for pos in combo:
-                seq[pos] = "G"
-            full_bp_seqs.append("".join(seq))
-    
+    limit = len(protospacer) if first_n is None else first_n
+    pattern = "".join("R" if c.upper() == "A" and i < limit else c.upper() for i, c in enumerate(protospacer))
     if orientation == "R":
-        for index, seq in enumerate(first_10bp_seqs):
-            first_10bp_seqs[index] = reverse_complement(seq)
-        for index, seq in enumerate(full_bp_seqs):
-            full_bp_seqs[index] = reverse_complement(seq)
-
-        
-    return (first_10bp_seqs, full_bp_seqs)
\ No newline at end of file
+        iupac_complement = {"A": "T", "T": "A", "C": "G", "G": "C", "R": "Y"}
+        pattern = "".join(iupac_complement[c] for c in reversed(pattern))
+    return pattern